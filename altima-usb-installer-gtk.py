@@ -2,24 +2,39 @@
 import gi
 import subprocess
 import traceback
-import requests
 import zipfile
 import os
 import glob
 import json
 import shutil
 import threading
+import sys
 
-gi.require_version("Gtk", "3.0")
-from gi.repository import Gtk, GLib
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+from altima_usb_installer import (
+    catalog, eject, history, mounts, preflight, rawwrite, slideshow, server, sources, ventoy
+)
 
-# Only import WebKit2 on Linux/macOS - V2.06
-if os.name != "nt":
+gi.require_version("Gtk", "3.0")
+gi.require_version("GdkPixbuf", "2.0")
+from gi.repository import Gtk, Gdk, GLib, GdkPixbuf
+
+# WebKit slides cost a whole web process, so only load it when asked for
+USE_WEBKIT_SLIDES = os.name != "nt" and (
+    "--webkit-slides" in sys.argv or os.environ.get("ALTIMA_WEBKIT_SLIDES") == "1"
+)
+if USE_WEBKIT_SLIDES:
     gi.require_version("WebKit2", "4.0")
     from gi.repository import WebKit2
 
+# --serve shares this machine's download cache with other installers on the LAN
+SERVE_CACHE = "--serve" in sys.argv
+
 # --- App Constants ---
-ALTIMA_ISO_LIST = "https://download.altimalinux.com/altima-iso-list.json"
+# --source DIR|URL or ALTIMA_SOURCE points at a local mirror
+SOURCE = sources.configured(sys.argv)
+# Past transfer speeds, for mirror order and time estimates
+HISTORY = history.History()
 VENTOY_WIN_URL = "https://download.altimalinux.com/ventoy.zip"
 VENTOY_DEST = "ventoy"
 
@@ -42,6 +57,9 @@ class AltimaUSBInstaller(Gtk.Window):
         self.set_default_size(950, 520)
 
         self.selected_usb = None
+        self.selected_usbs = []
+        self.raw_mode = False
+        self.iso_catalog = catalog.Catalog([])
         self.current_slide = 0
 
         # Main horizontal box
@@ -57,15 +75,21 @@ class AltimaUSBInstaller(Gtk.Window):
         self.left_box.set_size_request(300, -1)
         self.hbox.pack_start(self.left_box, False, False, 0)
 
-        # Right side (WebKit or static slideshow)
-        if os.name != "nt":
+        # Right side (pre-rendered slideshow, or WebKit on request)
+        if USE_WEBKIT_SLIDES:
             self.webview = WebKit2.WebView()
             self.webview.set_hexpand(True)
             self.webview.set_vexpand(True)
             self.hbox.pack_start(self.webview, True, True, 0)
         else:
             self.image_slide = Gtk.Image()
+            self.image_slide.set_hexpand(True)
+            self.image_slide.set_vexpand(True)
+            self.image_slide.connect("size-allocate", self.on_slide_allocate)
             self.hbox.pack_start(self.image_slide, True, True, 0)
+            self.slideshow = slideshow.Slideshow(
+                SLIDESHOW_IMAGES, render_slide, self.image_slide.set_from_pixbuf
+            )
 
         self.start_slideshow()
         self.init_usb_screen()
@@ -74,23 +98,36 @@ class AltimaUSBInstaller(Gtk.Window):
     # Slideshow
     # -----------------------------
     def start_slideshow(self):
-        if os.name != "nt":
+        if USE_WEBKIT_SLIDES:
             self.webview.load_uri(SLIDESHOW_URLS[self.current_slide])
-            GLib.timeout_add_seconds(5, self.rotate_slides)
-        else:
-            self.image_slide.set_from_file(SLIDESHOW_IMAGES[self.current_slide])
-            GLib.timeout_add_seconds(5, self.rotate_slides)
+        GLib.timeout_add_seconds(5, self.rotate_slides)
 
     def rotate_slides(self):
-        self.current_slide = (self.current_slide + 1) % (
-            len(SLIDESHOW_URLS) if os.name != "nt" else len(SLIDESHOW_IMAGES)
-        )
-        if os.name != "nt":
-            self.webview.load_uri(SLIDESHOW_URLS[self.current_slide])
-        else:
-            self.image_slide.set_from_file(SLIDESHOW_IMAGES[self.current_slide])
+        if not USE_WEBKIT_SLIDES:
+            return self.slideshow.tick(self.slides_visible())
+        self.current_slide = (self.current_slide + 1) % len(SLIDESHOW_URLS)
+        self.webview.load_uri(SLIDESHOW_URLS[self.current_slide])
         return True
 
+    def slides_visible(self):
+        window = self.get_window()
+        return (
+            self.get_mapped() and window is not None
+            and not window.get_state() & Gdk.WindowState.ICONIFIED
+        )
+
+    def on_slide_allocate(self, widget, allocation):
+        self.slideshow.set_size(allocation.width, allocation.height)
+
+    def pause_slides(self, reason):
+        """Hold the slides still while reason (a transfer) runs; safe from any thread."""
+        if not USE_WEBKIT_SLIDES:
+            GLib.idle_add(self.slideshow.pause, reason)
+
+    def resume_slides(self, reason):
+        if not USE_WEBKIT_SLIDES:
+            GLib.idle_add(self.slideshow.resume, reason)
+
     # -----------------------------
     # Screen 1: USB Detection
     # -----------------------------
@@ -109,6 +146,7 @@ class AltimaUSBInstaller(Gtk.Window):
         self.left_box.pack_start(self.textview, False, False, 0)
 
         self.usb_listbox = Gtk.ListBox()
+        self.usb_listbox.set_selection_mode(Gtk.SelectionMode.MULTIPLE)
         self.left_box.pack_start(self.usb_listbox, True, True, 0)
 
         self.scan_button = Gtk.Button(label="Scan for USB Devices")
@@ -120,6 +158,13 @@ class AltimaUSBInstaller(Gtk.Window):
         self.ok_button.set_sensitive(False)
         self.left_box.pack_start(self.ok_button, False, False, 0)
 
+        # Raw (dd-style) writing is Linux only for now
+        self.raw_button = Gtk.Button(label="Write ISO Directly (no Ventoy)")
+        self.raw_button.connect("clicked", self.prepare_raw_write)
+        self.raw_button.set_sensitive(False)
+        if os.name != "nt":
+            self.left_box.pack_start(self.raw_button, False, False, 0)
+
         self.show_all()
 
     def scan_usb_devices(self, widget):
@@ -164,6 +209,7 @@ class AltimaUSBInstaller(Gtk.Window):
 
                 if output_lines:
                     GLib.idle_add(self.ok_button.set_sensitive, True)
+                    GLib.idle_add(self.raw_button.set_sensitive, True)
                 GLib.idle_add(self.show_all)
             except Exception:
                 GLib.idle_add(self.textbuffer.set_text, traceback.format_exc())
@@ -174,36 +220,41 @@ class AltimaUSBInstaller(Gtk.Window):
     # Screen 2: Ventoy Preparation
     # -----------------------------
     def download_and_prepare_ventoy(self, widget):
-        selected = self.usb_listbox.get_selected_row()
+        selected = self.usb_listbox.get_selected_rows()
         if not selected:
             self.textbuffer.set_text("Please select a USB device first.")
             return
 
-        self.selected_usb = selected.get_child().get_text()
-        self.textbuffer.set_text(f"Selected: {self.selected_usb}\nDownloading Ventoy...")
+        self.selected_usbs = [row.get_child().get_text() for row in selected]
+        self.selected_usb = self.selected_usbs[0]
+        self.raw_mode = False
+        if os.name != "nt" and not self.confirm_erase(self.selected_usbs, "Erase and install Ventoy?"):
+            return
+        self.textbuffer.set_text("Selected:\n" + "\n".join(self.selected_usbs) + "\nDownloading Ventoy...")
 
         def download_and_run():
+            self.pause_slides("ventoy")
             try:
                 os.makedirs(VENTOY_DEST, exist_ok=True)
-                ventoy_zip_path = os.path.join(VENTOY_DEST, "ventoy.zip")
-
-                with requests.get(VENTOY_WIN_URL, stream=True) as r:
-                    r.raise_for_status()
-                    total = int(r.headers.get("content-length", 0))
-                    downloaded = 0
-                    with open(ventoy_zip_path, "wb") as f:
-                        for chunk in r.iter_content(chunk_size=8192):
-                            if chunk:
-                                f.write(chunk)
-                                downloaded += len(chunk)
-                                if total > 0:
-                                    percent = (downloaded / total) * 100
-                                    GLib.idle_add(
-                                        self.textbuffer.set_text,
-                                        f"Downloading Ventoy... {percent:.2f}%"
-                                    )
-
-                with zipfile.ZipFile(ventoy_zip_path, "r") as zip_ref:
+
+                def show_progress(downloaded, total):
+                    if total > 0:
+                        percent = (downloaded / total) * 100
+                        GLib.idle_add(self.textbuffer.set_text, f"Downloading Ventoy... {percent:.2f}%")
+
+                # The versioned Linux release is cached (and served to peers);
+                # the unversioned Windows zip is fetched fresh every time
+                if os.name == "nt":
+                    ventoy_archive = sources.fetch_to_cache(SOURCE, VENTOY_WIN_URL, show_progress,
+                                                            cache=VENTOY_DEST)
+                else:
+                    ventoy_archive = sources.fetch_to_cache(SOURCE, ventoy.VENTOY_LINUX_URL, show_progress)
+
+                if os.name != "nt":
+                    self.install_ventoy_linux(ventoy.extract_release(ventoy_archive, VENTOY_DEST))
+                    return
+
+                with zipfile.ZipFile(ventoy_archive, "r") as zip_ref:
                     zip_ref.extractall(VENTOY_DEST)
 
                 GLib.idle_add(self.textbuffer.set_text, "✅ Ventoy downloaded. Running Ventoy2Disk...")
@@ -211,23 +262,69 @@ class AltimaUSBInstaller(Gtk.Window):
                 ventoy_folders = glob.glob(os.path.join(VENTOY_DEST, "ventoy-*"))
                 if ventoy_folders:
                     ventoy_exe = os.path.join(ventoy_folders[0], "Ventoy2Disk.exe")
-                    if os.path.exists(ventoy_exe) and os.name == "nt":
+                    if os.path.exists(ventoy_exe):
                         subprocess.run(
                             ["powershell", "Start-Process", ventoy_exe, "-Verb", "runAs"],
                             check=True
                         )
                         GLib.idle_add(self.goto_iso_screen)
-                    elif os.name != "nt":
-                        GLib.idle_add(self.goto_iso_screen)
                     else:
                         GLib.idle_add(self.textbuffer.set_text, "❌ Ventoy2Disk.exe not found.")
                 else:
                     GLib.idle_add(self.textbuffer.set_text, "❌ Ventoy folder not found.")
             except Exception:
                 GLib.idle_add(self.textbuffer.set_text, traceback.format_exc())
+            finally:
+                self.resume_slides("ventoy")
 
         threading.Thread(target=download_and_run, daemon=True).start()
 
+    def prepare_raw_write(self, widget):
+        selected = self.usb_listbox.get_selected_rows()
+        if not selected:
+            self.textbuffer.set_text("Please select a USB device first.")
+            return
+
+        self.selected_usbs = [row.get_child().get_text() for row in selected]
+        self.selected_usb = self.selected_usbs[0]
+        if not self.confirm_erase(self.selected_usbs, "Erase and write the ISO directly?"):
+            return
+        self.raw_mode = True
+        self.goto_iso_screen()
+
+    def confirm_erase(self, usb_lines, title):
+        dialog = Gtk.MessageDialog(
+            transient_for=self, modal=True,
+            message_type=Gtk.MessageType.WARNING,
+            buttons=Gtk.ButtonsType.YES_NO,
+            text=title,
+        )
+        dialog.format_secondary_text(
+            "All data on these devices will be lost:\n" + "\n".join(usb_lines)
+        )
+        response = dialog.run()
+        dialog.destroy()
+        return response == Gtk.ResponseType.YES
+
+    def install_ventoy_linux(self, script):
+        devices = [f"/dev/{mounts.disk_from_usb_line(line)}" for line in self.selected_usbs]
+        status = {device: "waiting..." for device in devices}
+
+        def show_progress(device, fraction, line):
+            status[device] = f"{fraction * 100:.0f}% {line}"
+            text = "\n".join(f"{d}: {s}" for d, s in status.items())
+            GLib.idle_add(self.textbuffer.set_text, f"Installing Ventoy...\n{text}")
+
+        results = ventoy.install_many(devices, script, progress=show_progress)
+        lines = [
+            f"✅ {r.device}: Ventoy installed" if r.ok
+            else f"❌ {r.device}: {r.output.splitlines()[-1] if r.output else r.returncode}"
+            for r in results
+        ]
+        GLib.idle_add(self.textbuffer.set_text, "\n".join(lines))
+        if any(r.ok for r in results):
+            GLib.idle_add(self.goto_iso_screen)
+
     # -----------------------------
     # Screen 3: ISO Download & Auto-Copy
     # -----------------------------
@@ -235,10 +332,12 @@ class AltimaUSBInstaller(Gtk.Window):
         for child in self.left_box.get_children():
             self.left_box.remove(child)
 
+        target = ", ".join(self.selected_usbs) if self.raw_mode else self.selected_usb
+        heading = "Write ISO directly to" if self.raw_mode else "Ventoy installed on"
         label = Gtk.Label(
-            label=f"Ventoy installed on: {self.selected_usb}\nSelect an ISO to download:"
+            label=f"{heading}: {target}\nSelect an ISO to download:"
         )
-        label.set_markup(f"<b>Ventoy installed on: {self.selected_usb}</b>\nSelect an ISO to download:")
+        label.set_markup(f"<b>{heading}: {target}</b>\nSelect an ISO to download:")
         self.left_box.pack_start(label, False, False, 0)
 
         self.iso_listbox = Gtk.ListBox()
@@ -269,21 +368,12 @@ class AltimaUSBInstaller(Gtk.Window):
 
         def fetch_list():
             try:
-                response = requests.get(ALTIMA_ISO_LIST, timeout=5)
-                if response.status_code == 200:
-                    data = response.json()
-                else:
-                    data = {}
-
-                isos = data.get("isos", [
-                    {"name": "Altima Linux Minimal (Fallback)", "file": "altima-minimal-1.0.iso"},
-                    {"name": "Altima Linux Full (Fallback)", "file": "altima-full-1.0.iso"}
-                ])
+                self.iso_catalog = catalog.fetch(SOURCE)
 
                 GLib.idle_add(self.iso_listbox.foreach, lambda w: self.iso_listbox.remove(w))
-                for iso in isos:
+                for iso in self.iso_catalog.current():
                     row = Gtk.ListBoxRow()
-                    row.add(Gtk.Label(label=f"{iso['name']} ({iso['file']})"))
+                    row.add(Gtk.Label(label=f"{iso.name} ({iso.file})"))
                     GLib.idle_add(self.iso_listbox.add, row)
                 GLib.idle_add(self.show_all)
             except Exception:
@@ -299,27 +389,33 @@ class AltimaUSBInstaller(Gtk.Window):
 
         iso_text = selected.get_child().get_text()
         iso_file = iso_text.split("(")[-1].strip(")")
-        self.output_buffer.set_text(f"Downloading {iso_file}...")
+        entry = self.iso_catalog.get(iso_file)
+        source = HISTORY.order(
+            sources.with_mirrors(SOURCE, self.iso_catalog.mirrors_for(entry) if entry else ())
+        )
+        eta = HISTORY.eta(entry.size, iso=iso_file) if entry and entry.size else None
+        estimate = f" (about {history.format_duration(eta)})" if eta else ""
+        self.output_buffer.set_text(f"Downloading {iso_file}...{estimate}")
 
         def download_and_copy():
+            self.pause_slides("transfer")
             try:
-                iso_url = ALTIMA_ISO_LIST.replace("altima-iso-list.json", iso_file)
-                iso_path = os.path.join(os.getcwd(), iso_file)
-
-                # ✅ Download with progress bar
-                with requests.get(iso_url, stream=True, timeout=10) as r:
-                    r.raise_for_status()
-                    total = int(r.headers.get("content-length", 0))
-                    downloaded = 0
-                    with open(iso_path, "wb") as f:
-                        for chunk in r.iter_content(chunk_size=8192):
-                            if chunk:
-                                f.write(chunk)
-                                downloaded += len(chunk)
-                                if total > 0:
-                                    fraction = downloaded / total
-                                    GLib.idle_add(self.progress_bar.set_fraction, fraction)
-                                    GLib.idle_add(self.progress_bar.set_text, f"{fraction*100:.1f}%")
+                def show_progress(downloaded, total):
+                    if total > 0:
+                        fraction = downloaded / total
+                        GLib.idle_add(self.progress_bar.set_fraction, fraction)
+                        GLib.idle_add(self.progress_bar.set_text, f"{fraction*100:.1f}%")
+
+                # ✅ Download into the cache with progress bar; a local mirror is read in place
+                iso_path = sources.fetch_to_cache(source, iso_file, show_progress,
+                                                  variants=entry.compressed if entry else (),
+                                                  size=entry.size if entry else None,
+                                                  digests=entry.digests if entry else None,
+                                                  history=HISTORY)
+
+                if self.raw_mode:
+                    self.write_raw_image(iso_path)
+                    return
 
                 # ✅ Copy to USB
                 copied_path = None
@@ -338,19 +434,20 @@ class AltimaUSBInstaller(Gtk.Window):
                         ).strip()
                         if drive_letter:
                             copied_path = f"{drive_letter}:\\{iso_file}"
+                            preflight.check(copied_path, os.path.getsize(iso_path))
                             shutil.copy(iso_path, copied_path)
+                    except preflight.NoSpaceError:
+                        raise
                     except Exception:
                         pass
                 else:
-                    possible_mounts = []
-                    for base in ["/media", "/run/media"]:
-                        if os.path.exists(base):
-                            for root, dirs, _ in os.walk(base):
-                                for d in dirs:
-                                    if "ventoy" in d.lower():
-                                        possible_mounts.append(os.path.join(root, d))
-                    if possible_mounts:
-                        copied_path = os.path.join(possible_mounts[0], iso_file)
+                    disk = mounts.disk_from_usb_line(self.selected_usb)
+                    volumes = mounts.find_ventoy_volumes([disk] if disk else None)
+                    volume = volumes.get(disk) if disk else next(iter(volumes.values()), None)
+                    if volume and volume.mountpoint:
+                        copied_path = os.path.join(volume.mountpoint, iso_file)
+                        # ✅ Fail now rather than with ENOSPC halfway through the copy
+                        preflight.check(copied_path, os.path.getsize(iso_path))
                         shutil.copy(iso_path, copied_path)
 
                 if copied_path:
@@ -365,14 +462,44 @@ class AltimaUSBInstaller(Gtk.Window):
                         self.output_buffer.set_text,
                         f"✅ ISO downloaded to {iso_path}\nCopy manually if needed."
                     )
+            except preflight.NoSpaceError as e:
+                GLib.idle_add(self.output_buffer.set_text, f"⚠ Not enough space for {iso_file}: {e.strerror}")
             except Exception:
                 GLib.idle_add(self.output_buffer.set_text, traceback.format_exc())
             finally:
                 GLib.idle_add(self.progress_bar.set_fraction, 0)
                 GLib.idle_add(self.progress_bar.set_text, "")
+                self.resume_slides("transfer")
 
         threading.Thread(target=download_and_copy, daemon=True).start()
 
+    def write_raw_image(self, iso_path):
+        devices = [f"/dev/{mounts.disk_from_usb_line(line)}" for line in self.selected_usbs]
+        status = {device: "waiting..." for device in devices}
+        fractions = {device: 0.0 for device in devices}
+
+        def show_progress(device, done, total, rate):
+            status[device] = f"{done / total * 100:.1f}% at {rate / (1024 * 1024):.1f} MB/s"
+            fractions[device] = done / total
+            text = "\n".join(f"{d}: {s}" for d, s in status.items())
+            GLib.idle_add(self.output_buffer.set_text, f"Writing {os.path.basename(iso_path)}...\n{text}")
+            # The bar follows the slowest stick
+            GLib.idle_add(self.progress_bar.set_fraction, min(fractions.values()))
+
+        # Unmounts the sticks and asks for root; discarding first lets the
+        # ISO's empty blocks go unwritten on sticks that read them back as zeros
+        results = rawwrite.write_sticks(iso_path, devices, progress=show_progress, direct=True,
+                                        discard_first=True, skip_zeros=True)
+        lines = [
+            f"✅ {r.device}: written at {r.bytes_written / max(r.seconds, 1e-6) / (1024 * 1024):.1f} MB/s"
+            if r.ok else f"❌ {r.device}: {r.error}"
+            for r in results
+        ]
+        if self.eject_checkbox.get_active():
+            ejected = eject.eject_all([r.device for r in results if r.ok])
+            lines += [f"⚠ {r.target}: could not eject ({r.error})" for r in ejected if not r.ok]
+        GLib.idle_add(self.output_buffer.set_text, "\n".join(lines))
+
     def eject_usb(self, copied_path):
         try:
             if os.name == "nt":
@@ -385,10 +512,15 @@ class AltimaUSBInstaller(Gtk.Window):
                     check=True
                 )
             else:
-                # Attempt to unmount & power off
-                mount = copied_path.split("/")[2]
-                subprocess.run(["udisksctl", "unmount", "-b", f"/dev/{mount}"])
-                subprocess.run(["udisksctl", "power-off", "-b", f"/dev/{mount}"])
+                # Flush, unmount & power off the stick holding copied_path
+                result = eject.eject_all(
+                    [copied_path],
+                    progress=lambda disk, fraction, message: GLib.idle_add(
+                        self.output_buffer.set_text, message
+                    )
+                )[0]
+                if not result.ok:
+                    raise OSError(result.error)
             GLib.idle_add(self.output_buffer.set_text, "✅ USB ejected safely.")
         except Exception:
             GLib.idle_add(
@@ -399,7 +531,13 @@ class AltimaUSBInstaller(Gtk.Window):
             )
 
 
+def render_slide(path, width, height):
+    return GdkPixbuf.Pixbuf.new_from_file_at_scale(path, width, height, True)
+
+
 def main():
+    if SERVE_CACHE:
+        server.serve_in_background()
     win = AltimaUSBInstaller()
     win.connect("destroy", Gtk.main_quit)
     win.show_all()
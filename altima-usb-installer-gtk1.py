@@ -2,7 +2,6 @@
 import gi
 import subprocess
 import traceback
-import requests
 import zipfile
 import os
 import glob
@@ -10,16 +9,45 @@ import json
 import shutil
 import threading
 import re
+import sys
+import time
 import hashlib
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+from altima_usb_installer import (
+    catalog, chunks, eject, hashing, hedged, history, journal, mounts, persistence, preflight, probe,
+    slideshow, server, sources, transfer, ventoy, verify
+)
+
 gi.require_version("Gtk", "3.0")
-gi.require_version("WebKit2", "4.0")
-from gi.repository import Gtk, GLib, WebKit2
+gi.require_version("GdkPixbuf", "2.0")
+from gi.repository import Gtk, Gdk, GLib, GdkPixbuf
+
+# WebKit slides cost a whole web process, so only load it when asked for
+USE_WEBKIT_SLIDES = "--webkit-slides" in sys.argv or os.environ.get("ALTIMA_WEBKIT_SLIDES") == "1"
+if USE_WEBKIT_SLIDES:
+    gi.require_version("WebKit2", "4.0")
+    from gi.repository import WebKit2
+
+# --serve shares this machine's download cache with other installers on the LAN
+SERVE_CACHE = "--serve" in sys.argv
 
 # --- App Constants ---
-ALTIMA_ISO_LIST = "https://download.altimalinux.com/altima-iso-list.json"
+# --source DIR|URL or ALTIMA_SOURCE points at a local mirror
+SOURCE = sources.configured(sys.argv)
+# Downloads to a stick are journalled so a crash or reboot resumes them at startup
+JOURNAL = journal.Journal()
+# Past transfer speeds, for mirror order and time estimates
+HISTORY = history.History()
 VENTOY_WIN_URL = "https://download.altimalinux.com/ventoy.zip"
 VENTOY_DEST = "ventoy"
+QUICK_VERIFY_SAMPLE = 0.1
+
+SLIDESHOW_IMAGES = [
+    os.path.abspath("slide1.png"),
+    os.path.abspath("slide2.png"),
+    os.path.abspath("slide3.png")
+]
 
 SLIDESHOW_URLS = [
     "file://" + os.path.abspath("slide1.html"),
@@ -37,7 +65,10 @@ class AltimaUSBInstaller(Gtk.Window):
         self.selected_usb = None
         self.current_slide = 0
         self.ventoy_mounts = []
-        self.iso_data = []
+        self.iso_catalog = catalog.Catalog([])
+        self.iso_entries = []
+        # Files on a stick a download in this process is writing; touched on the GTK thread only
+        self.active_targets = set()
 
         self.hbox = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=6)
         self.add(self.hbox)
@@ -46,10 +77,20 @@ class AltimaUSBInstaller(Gtk.Window):
         self.left_box.set_size_request(280, -1)
         self.hbox.pack_start(self.left_box, False, False, 5)
 
-        self.webview = WebKit2.WebView()
-        self.webview.set_hexpand(True)
-        self.webview.set_vexpand(True)
-        self.hbox.pack_start(self.webview, True, True, 5)
+        if USE_WEBKIT_SLIDES:
+            self.webview = WebKit2.WebView()
+            self.webview.set_hexpand(True)
+            self.webview.set_vexpand(True)
+            self.hbox.pack_start(self.webview, True, True, 5)
+        else:
+            self.image_slide = Gtk.Image()
+            self.image_slide.set_hexpand(True)
+            self.image_slide.set_vexpand(True)
+            self.image_slide.connect("size-allocate", self.on_slide_allocate)
+            self.hbox.pack_start(self.image_slide, True, True, 5)
+            self.slideshow = slideshow.Slideshow(
+                SLIDESHOW_IMAGES, render_slide, self.image_slide.set_from_pixbuf
+            )
 
         self.start_slideshow()
         self.init_usb_screen()
@@ -58,14 +99,36 @@ class AltimaUSBInstaller(Gtk.Window):
     # Slideshow
     # -----------------------------
     def start_slideshow(self):
-        self.webview.load_uri(SLIDESHOW_URLS[self.current_slide])
+        if USE_WEBKIT_SLIDES:
+            self.webview.load_uri(SLIDESHOW_URLS[self.current_slide])
         GLib.timeout_add_seconds(5, self.rotate_slides)
 
     def rotate_slides(self):
+        if not USE_WEBKIT_SLIDES:
+            return self.slideshow.tick(self.slides_visible())
         self.current_slide = (self.current_slide + 1) % len(SLIDESHOW_URLS)
         self.webview.load_uri(SLIDESHOW_URLS[self.current_slide])
         return True
 
+    def slides_visible(self):
+        window = self.get_window()
+        return (
+            self.get_mapped() and window is not None
+            and not window.get_state() & Gdk.WindowState.ICONIFIED
+        )
+
+    def on_slide_allocate(self, widget, allocation):
+        self.slideshow.set_size(allocation.width, allocation.height)
+
+    def pause_slides(self, reason):
+        """Hold the slides still while reason (a transfer) runs; safe from any thread."""
+        if not USE_WEBKIT_SLIDES:
+            GLib.idle_add(self.slideshow.pause, reason)
+
+    def resume_slides(self, reason):
+        if not USE_WEBKIT_SLIDES:
+            GLib.idle_add(self.slideshow.resume, reason)
+
     # -----------------------------
     # Screen 1: USB Detection
     # -----------------------------
@@ -83,6 +146,7 @@ class AltimaUSBInstaller(Gtk.Window):
         self.left_box.pack_start(self.textview, True, True, 0)
 
         self.usb_listbox = Gtk.ListBox()
+        self.usb_listbox.set_selection_mode(Gtk.SelectionMode.MULTIPLE)
         self.left_box.pack_start(self.usb_listbox, True, True, 0)
 
         self.scan_button = Gtk.Button(label="Scan for USB Devices")
@@ -158,13 +222,16 @@ class AltimaUSBInstaller(Gtk.Window):
     # Screen 2: Ventoy Preparation
     # -----------------------------
     def download_and_prepare_ventoy(self, widget):
-        selected = self.usb_listbox.get_selected_row()
+        selected = self.usb_listbox.get_selected_rows()
         if not selected:
             self.textbuffer.set_text("Please select a USB device first.")
             return
 
-        self.selected_usb = selected.get_child().get_text()
-        self.textbuffer.set_text(f"Selected: {self.selected_usb}\nPreparing Ventoy folder...")
+        self.selected_usbs = [row.get_child().get_text() for row in selected]
+        self.selected_usb = self.selected_usbs[0]
+        if os.name != "nt" and not self.confirm_erase(self.selected_usbs):
+            return
+        self.textbuffer.set_text("Selected:\n" + "\n".join(self.selected_usbs) + "\nPreparing Ventoy folder...")
 
         if os.path.exists(VENTOY_DEST):
             try:
@@ -174,27 +241,28 @@ class AltimaUSBInstaller(Gtk.Window):
                 return
 
         def download_and_run():
+            self.pause_slides("ventoy")
             try:
                 os.makedirs(VENTOY_DEST, exist_ok=True)
-                ventoy_zip_path = os.path.join(VENTOY_DEST, "ventoy.zip")
-
-                with requests.get(VENTOY_WIN_URL, stream=True) as r:
-                    r.raise_for_status()
-                    total = int(r.headers.get("content-length", 0))
-                    downloaded = 0
-                    with open(ventoy_zip_path, "wb") as f:
-                        for chunk in r.iter_content(chunk_size=8192):
-                            if chunk:
-                                f.write(chunk)
-                                downloaded += len(chunk)
-                                if total > 0:
-                                    percent = (downloaded / total) * 100
-                                    GLib.idle_add(
-                                        self.textbuffer.set_text,
-                                        f"Downloading Ventoy... {percent:.2f}%"
-                                    )
-
-                with zipfile.ZipFile(ventoy_zip_path, "r") as zip_ref:
+
+                def show_progress(downloaded, total):
+                    if total > 0:
+                        percent = (downloaded / total) * 100
+                        GLib.idle_add(self.textbuffer.set_text, f"Downloading Ventoy... {percent:.2f}%")
+
+                # The versioned Linux release is cached (and served to peers);
+                # the unversioned Windows zip is fetched fresh every time
+                if os.name == "nt":
+                    ventoy_archive = sources.fetch_to_cache(SOURCE, VENTOY_WIN_URL, show_progress,
+                                                            cache=VENTOY_DEST)
+                else:
+                    ventoy_archive = sources.fetch_to_cache(SOURCE, ventoy.VENTOY_LINUX_URL, show_progress)
+
+                if os.name != "nt":
+                    self.install_ventoy_linux(ventoy.extract_release(ventoy_archive, VENTOY_DEST))
+                    return
+
+                with zipfile.ZipFile(ventoy_archive, "r") as zip_ref:
                     zip_ref.extractall(VENTOY_DEST)
 
                 GLib.idle_add(self.textbuffer.set_text, "✅ Ventoy downloaded. Running Ventoy2Disk...")
@@ -202,23 +270,56 @@ class AltimaUSBInstaller(Gtk.Window):
                 ventoy_folders = glob.glob(os.path.join(VENTOY_DEST, "ventoy-*"))
                 if ventoy_folders:
                     ventoy_exe = os.path.join(ventoy_folders[0], "Ventoy2Disk.exe")
-                    if os.path.exists(ventoy_exe) and os.name == "nt":
+                    if os.path.exists(ventoy_exe):
                         subprocess.run(
                             ["powershell", "Start-Process", ventoy_exe, "-Verb", "runAs"],
                             check=True
                         )
                         GLib.idle_add(self.goto_iso_screen)
-                    elif os.name != "nt":
-                        GLib.idle_add(self.goto_iso_screen)
                     else:
                         GLib.idle_add(self.textbuffer.set_text, "❌ Ventoy2Disk.exe not found.")
                 else:
                     GLib.idle_add(self.textbuffer.set_text, "❌ Ventoy folder not found.")
             except Exception:
                 GLib.idle_add(self.textbuffer.set_text, traceback.format_exc())
+            finally:
+                self.resume_slides("ventoy")
 
         threading.Thread(target=download_and_run, daemon=True).start()
 
+    def confirm_erase(self, usb_lines):
+        dialog = Gtk.MessageDialog(
+            transient_for=self, modal=True,
+            message_type=Gtk.MessageType.WARNING,
+            buttons=Gtk.ButtonsType.YES_NO,
+            text="Erase and install Ventoy?",
+        )
+        dialog.format_secondary_text(
+            "All data on these devices will be lost:\n" + "\n".join(usb_lines)
+        )
+        response = dialog.run()
+        dialog.destroy()
+        return response == Gtk.ResponseType.YES
+
+    def install_ventoy_linux(self, script):
+        devices = [f"/dev/{mounts.disk_from_usb_line(line)}" for line in self.selected_usbs]
+        status = {device: "waiting..." for device in devices}
+
+        def show_progress(device, fraction, line):
+            status[device] = f"{fraction * 100:.0f}% {line}"
+            text = "\n".join(f"{d}: {s}" for d, s in status.items())
+            GLib.idle_add(self.textbuffer.set_text, f"Installing Ventoy...\n{text}")
+
+        results = ventoy.install_many(devices, script, progress=show_progress)
+        lines = [
+            f"✅ {r.device}: Ventoy installed" if r.ok
+            else f"❌ {r.device}: {r.output.splitlines()[-1] if r.output else r.returncode}"
+            for r in results
+        ]
+        GLib.idle_add(self.textbuffer.set_text, "\n".join(lines))
+        if any(r.ok for r in results):
+            GLib.idle_add(self.goto_iso_screen)
+
     # -----------------------------
     # Screen 3: Ventoy USB + ISO Download
     # -----------------------------
@@ -238,11 +339,12 @@ class AltimaUSBInstaller(Gtk.Window):
         self.refresh_button.connect("clicked", self.refresh_ventoy_list)
         self.left_box.pack_start(self.refresh_button, False, False, 0)
 
-        iso_label = Gtk.Label(label="Select an ISO to download:")
-        iso_label.set_markup("<b>Select an ISO to download:</b>")
+        iso_label = Gtk.Label(label="Select one or more ISOs to download:")
+        iso_label.set_markup("<b>Select one or more ISOs to download:</b>")
         self.left_box.pack_start(iso_label, False, False, 0)
 
         self.iso_listbox = Gtk.ListBox()
+        self.iso_listbox.set_selection_mode(Gtk.SelectionMode.MULTIPLE)
         self.left_box.pack_start(self.iso_listbox, True, True, 0)
 
         self.output_area = Gtk.TextView()
@@ -250,11 +352,27 @@ class AltimaUSBInstaller(Gtk.Window):
         self.output_buffer = self.output_area.get_buffer()
         self.left_box.pack_start(self.output_area, True, True, 0)
 
-        self.download_iso_button = Gtk.Button(label="Download & Copy ISO")
+        self.quick_verify_checkbox = Gtk.CheckButton(
+            label=f"Quick verify (spot-check {QUICK_VERIFY_SAMPLE:.0%} of the stick)"
+        )
+        self.left_box.pack_start(self.quick_verify_checkbox, False, False, 0)
+
+        persistence_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=6)
+        persistence_box.pack_start(Gtk.Label(label="Persistence (GiB, 0 for none):"), False, False, 0)
+        self.persistence_spin = Gtk.SpinButton.new_with_range(0, 64, 1)
+        persistence_box.pack_start(self.persistence_spin, False, False, 0)
+        self.left_box.pack_start(persistence_box, False, False, 0)
+
+        self.download_iso_button = Gtk.Button(label="Download & Copy ISOs")
         self.download_iso_button.set_size_request(210, 35)
         self.download_iso_button.connect("clicked", self.download_iso)
         self.left_box.pack_start(self.download_iso_button, False, False, 0)
 
+        self.eject_all_button = Gtk.Button(label="Eject All Ventoy USBs")
+        self.eject_all_button.set_size_request(210, 35)
+        self.eject_all_button.connect("clicked", self.eject_all_usbs)
+        self.left_box.pack_start(self.eject_all_button, False, False, 0)
+
         self.show_all()
         self.refresh_ventoy_list()
         self.load_iso_list()
@@ -264,33 +382,49 @@ class AltimaUSBInstaller(Gtk.Window):
         self.ventoy_mounts = []
 
         if os.name != "nt":
-            usb_mount = "/media"
-            for d in os.listdir(usb_mount):
-                full_path = os.path.join(usb_mount, d)
-                if os.path.isdir(full_path) and os.path.exists(os.path.join(full_path, "ventoy")):
-                    self.ventoy_mounts.append(full_path)
-                    row = Gtk.ListBoxRow()
-                    row.add(Gtk.Label(label=full_path))
-                    self.ventoy_listbox.add(row)
+            for volume in mounts.find_ventoy_volumes().values():
+                if not volume.mountpoint:
+                    continue
+                self.ventoy_mounts.append(volume)
+                row = Gtk.ListBoxRow()
+                row.add(Gtk.Label(label=volume.mountpoint))
+                self.ventoy_listbox.add(row)
 
         self.show_all()
 
+    def show_eject_progress(self, disk, fraction, message):
+        GLib.idle_add(self.output_buffer.set_text, message)
+
+    def eject_all_usbs(self, widget):
+        disks = [volume.disk for volume in self.ventoy_mounts]
+        if not disks:
+            self.output_buffer.set_text("No Ventoy USBs to eject.")
+            return
+        self.output_buffer.set_text(f"Ejecting {len(disks)} USB(s)...")
+
+        def run():
+            results = eject.eject_all(disks, progress=self.show_eject_progress)
+            lines = [
+                f"✅ {r.disk} ejected" if r.ok else f"⚠ {r.target}: {r.error}"
+                for r in results
+            ]
+            GLib.idle_add(self.output_buffer.set_text, "\n".join(lines))
+            GLib.idle_add(self.refresh_ventoy_list)
+
+        threading.Thread(target=run, daemon=True).start()
+
     def load_iso_list(self):
         self.output_buffer.set_text("Fetching ISO list...")
 
         def fetch_list():
             try:
-                response = requests.get(ALTIMA_ISO_LIST, timeout=5)
-                data = response.json() if response.status_code == 200 else {}
-                self.iso_data = data.get("isos", [
-                    {"name": "Altima Linux Minimal (Fallback)", "file": "altima-minimal-1.0.iso"},
-                    {"name": "Altima Linux Full (Fallback)", "file": "altima-full-1.0.iso"}
-                ])
+                self.iso_catalog = catalog.fetch(SOURCE)
+                self.iso_entries = self.iso_catalog.current()
 
                 self.iso_listbox.foreach(lambda w: self.iso_listbox.remove(w))
-                for iso in self.iso_data:
+                for iso in self.iso_entries:
                     row = Gtk.ListBoxRow()
-                    row.add(Gtk.Label(label=f"{iso['name']} ({iso['file']})"))
+                    row.add(Gtk.Label(label=f"{iso.name} ({iso.file})"))
                     GLib.idle_add(self.iso_listbox.add, row)
 
                 # ✅ Auto-select first ISO row
@@ -299,6 +433,7 @@ class AltimaUSBInstaller(Gtk.Window):
                         self.iso_listbox.select_row(self.iso_listbox.get_row_at_index(0))
                 GLib.idle_add(select_first)
                 GLib.idle_add(self.show_all)
+                GLib.idle_add(self.resume_interrupted)
             except Exception:
                 GLib.idle_add(self.output_buffer.set_text, traceback.format_exc())
 
@@ -307,114 +442,296 @@ class AltimaUSBInstaller(Gtk.Window):
     def sanitize_filename(self, name):
         return re.sub(r"[^\w\-.]", "-", name)
 
-    def fetch_checksum_from_file(self, checksum_url):
-        try:
-            r = requests.get(checksum_url, timeout=5)
-            if r.status_code == 200:
-                # Parse first hash in file (supports .md5 or .sha256)
-                match = re.search(r"([a-fA-F0-9]{32,64})", r.text)
-                if match:
-                    return match.group(1)
-        except Exception:
-            pass
-        return None
-
-    def verify_checksum(self, file_path, expected_hash):
-        sha256 = hashlib.sha256()
-        with open(file_path, "rb") as f:
-            for chunk in iter(lambda: f.read(8192), b""):
-                sha256.update(chunk)
-        return sha256.hexdigest().lower() == expected_hash.lower()
+    def fetch_checksum_from_file(self, checksum_file):
+        """First hash in a .md5/.sha256 file, or None; raises SourceError if unreachable."""
+        text = hedged.fetch_bytes(SOURCE, checksum_file).decode("utf-8", "replace")
+        match = re.search(r"([a-fA-F0-9]{32,64})", text)
+        return match.group(1) if match else None
 
     def download_iso(self, widget):
-        selected_iso_row = self.iso_listbox.get_selected_row()
+        selected_iso_rows = self.iso_listbox.get_selected_rows()
         selected_usb_row = self.ventoy_listbox.get_selected_row()
 
-        if not selected_iso_row:
+        if not selected_iso_rows:
             self.output_buffer.set_text("Please select an ISO first.")
             return
         if not selected_usb_row and os.name != "nt":
             self.output_buffer.set_text("Please select a Ventoy USB first.")
             return
 
-        selected_index = self.iso_listbox.get_children().index(selected_iso_row)
-        iso_data = self.iso_data[selected_index]
-        iso_file = self.sanitize_filename(iso_data["file"])
-        iso_checksum = iso_data.get("sha256")
-        self.output_buffer.set_text(f"Downloading {iso_file} directly to Ventoy USB...")
+        entries = [self.iso_entries[row.get_index()] for row in selected_iso_rows]
+        ventoy_volume = self.ventoy_mounts[selected_usb_row.get_index()] if selected_usb_row else None
+        verify_sample = QUICK_VERIFY_SAMPLE if self.quick_verify_checkbox.get_active() else 1.0
+        persistence_size = int(self.persistence_spin.get_value()) * 1024 ** 3
+        self.start_download(entries, ventoy_volume, verify_sample, persistence_size=persistence_size)
+
+    def resume_interrupted(self):
+        """Restart downloads a crash or reboot cut short, from their last durable byte.
+
+        Runs after every ISO list load; start_download() skips records whose
+        target this process is already writing.
+        """
+        volumes = {volume.disk: volume for volume in self.ventoy_mounts}
+        for record in JOURNAL.unfinished():
+            entry = self.iso_catalog.get(record.isos[0]) if record.mode == "download" else None
+            if entry is not None and record.device in volumes:
+                self.start_download([entry], volumes[record.device], 1.0, record)
+
+    def start_download(self, entries, ventoy_volume, verify_sample, record=None, persistence_size=0):
+        """Download entries onto one Ventoy stick back to back, then eject it once.
+
+        The ISOs go on largest first, into files checked and reserved
+        together before the first byte is written. With persistence_size
+        each gets a persistence image of that many bytes. Nothing starts if
+        a download in this process is already writing one of the targets.
+        """
+        entries = sorted(entries, key=lambda e: e.size or 0, reverse=True)
+        names = ", ".join(self.sanitize_filename(e.file) for e in entries)
+        targets = {
+            os.path.join(ventoy_volume.mountpoint, self.sanitize_filename(e.file)) for e in entries
+        } if ventoy_volume else set()
+        busy = targets & self.active_targets
+        if busy:
+            if record is None:
+                self.output_buffer.set_text(
+                    "Already downloading " + ", ".join(sorted(os.path.basename(t) for t in busy))
+                    + " to this USB stick."
+                )
+            return
+        self.active_targets |= targets
+        # Batches to different sticks run at once; each holds the slides on its own
+        transfer_reason = "transfer " + ", ".join(sorted(targets))
+        stick = probe.identify(ventoy_volume.disk) if ventoy_volume else None
+        device = dict(device_model=stick.model, device_serial=stick.serial) if stick else {}
+        verb = "Resuming" if record else "Downloading"
+        eta = None
+        if all(e.size for e in entries) and not record:
+            iso = entries[0].file if len(entries) == 1 else None
+            eta = HISTORY.eta(sum(e.size for e in entries), iso=iso, device_model=stick and stick.model)
+        estimate = f" (about {history.format_duration(eta)})" if eta else ""
+        self.output_buffer.set_text(f"{verb} {names} directly to Ventoy USB...{estimate}")
 
         def download_and_copy():
-            try:
-                iso_url = ALTIMA_ISO_LIST.replace("altima-iso-list.json", iso_file)
-
-                if os.name == "nt":
-                    GLib.idle_add(
-                        self.output_buffer.set_text,
-                        "✅ ISO downloaded, but copy to Ventoy USB must be manual on Windows."
-                    )
-                    return
-
-                ventoy_mount = selected_usb_row.get_child().get_text()
-                iso_usb_path = os.path.join(ventoy_mount, iso_file)
-
-                total_size = 0
-                downloaded = 0
-                with requests.get(iso_url, stream=True) as r, open(iso_usb_path, "wb") as f:
-                    r.raise_for_status()
-                    total_size = int(r.headers.get("content-length", 0))
-                    for chunk in r.iter_content(chunk_size=1024 * 1024):
-                        if chunk:
-                            f.write(chunk)
-                            downloaded += len(chunk)
-                            if total_size > 0:
-                                percent = (downloaded / total_size) * 100
-                                GLib.idle_add(
-                                    self.output_buffer.set_text,
-                                    f"Writing {iso_file} to Ventoy USB... {percent:.2f}%"
-                                )
-
-                written_size = os.path.getsize(iso_usb_path)
-                if written_size != total_size:
-                    GLib.idle_add(
-                        self.output_buffer.set_text,
-                        f"⚠ File size mismatch: {written_size} vs expected {total_size}"
-                    )
-                    return
-
-                # ✅ Checksum handling
-                checksum_value = None
-                if iso_checksum:
-                    if iso_checksum.endswith((".md5", ".sha256")):
-                        checksum_url = ALTIMA_ISO_LIST.replace("altima-iso-list.json", iso_checksum)
-                        checksum_value = self.fetch_checksum_from_file(checksum_url)
-                    else:
-                        checksum_value = iso_checksum
-
-                if checksum_value:
-                    self.output_buffer.set_text("Verifying checksum...")
-                    if self.verify_checksum(iso_usb_path, checksum_value):
-                        msg = f"✅ ISO verified & copied to {iso_usb_path}\n"
-                    else:
-                        msg = f"⚠ Checksum mismatch for {iso_file}\n"
-                else:
-                    msg = f"✅ ISO copied to {iso_usb_path}\n"
+            if os.name == "nt":
+                GLib.idle_add(
+                    self.output_buffer.set_text,
+                    "✅ ISO downloaded, but copy to Ventoy USB must be manual on Windows."
+                )
+                GLib.idle_add(self.active_targets.difference_update, targets)
+                return
 
-                # ✅ Auto-eject USB (Linux)
-                if os.name != "nt":
-                    try:
-                        subprocess.run(["udisksctl", "power-off", "-b", ventoy_mount], check=False)
+            reserved = {}
+            self.pause_slides(transfer_reason)
+            try:
+                if record is None:
+                    # ✅ Check and reserve the space for the whole batch, so a stick
+                    # that cannot take every ISO fails now and each gets one long run
+                    reserved = preflight.open_reserved_files(ventoy_volume.mountpoint, {
+                        self.sanitize_filename(e.file): e.size for e in entries if e.size
+                    })
+                results = []
+                for entry in entries:
+                    f = reserved.pop(self.sanitize_filename(entry.file), None)
+                    results.append(self.copy_iso(entry, ventoy_volume, verify_sample, device, record, f))
+                msg = "".join(text for _, text in results)
+
+                if persistence_size:
+                    for entry, (copied, _) in zip(entries, results):
+                        if not copied:
+                            continue
+                        iso_file = self.sanitize_filename(entry.file)
+                        slow = persistence.zero_fills(ventoy_volume.mountpoint)
+                        GLib.idle_add(self.output_buffer.set_text,
+                                      f"Creating persistence image for {iso_file}..."
+                                      + (f"\n{slow}; this takes several minutes." if slow else ""))
+                        try:
+                            persistence.add_persistence(ventoy_volume.mountpoint, iso_file,
+                                                        persistence_size)
+                            msg += f"✅ {iso_file} boots with persistence\n"
+                        except (OSError, persistence.ConfigError) as e:
+                            msg += f"⚠ No persistence for {iso_file}: {e}\n"
+
+                # ✅ Flush and eject once for the whole batch (Linux)
+                if all(copied for copied, _ in results):
+                    result = eject.eject_all([ventoy_volume.disk], progress=self.show_eject_progress)[0]
+                    if result.ok:
                         msg += "💡 USB safely ejected. Ready to boot!"
-                    except Exception:
-                        msg += "⚠ Could not auto-eject. Please eject manually."
+                    else:
+                        msg += f"⚠ Could not auto-eject ({result.error}). Please eject manually."
 
                 GLib.idle_add(self.output_buffer.set_text, msg)
+            except preflight.NoSpaceError as e:
+                GLib.idle_add(
+                    self.output_buffer.set_text,
+                    f"⚠ Not enough space on the Ventoy USB for {names}: {e.strerror}"
+                )
             except Exception:
                 GLib.idle_add(self.output_buffer.set_text, traceback.format_exc())
+            finally:
+                # New ISOs the batch never reached would show up empty in the Ventoy menu
+                for name, f in reserved.items():
+                    f.close()
+                    os.remove(os.path.join(ventoy_volume.mountpoint, name))
+                GLib.idle_add(self.active_targets.difference_update, targets)
+                self.resume_slides(transfer_reason)
 
         threading.Thread(target=download_and_copy, daemon=True).start()
 
+    def copy_iso(self, entry, ventoy_volume, verify_sample, device, record=None, reserved=None):
+        """Download, verify and journal one ISO on the stick; returns (copied, message).
+
+        reserved is the target already opened by open_reserved_files(), if any.
+        """
+        iso_file = self.sanitize_filename(entry.file)
+        source = HISTORY.order(sources.with_mirrors(SOURCE, self.iso_catalog.mirrors_for(entry)))
+        key = record.key if record else journal.new_key()
+        succeeded = False
+        try:
+            ventoy_mount = ventoy_volume.mountpoint
+            iso_usb_path = os.path.join(ventoy_mount, iso_file)
+            if record is None:
+                JOURNAL.submitted(key, ventoy_volume.disk, (entry.file,), "download")
+
+            # ✅ Checksum handling (fetched first so the download can hash as it goes)
+            algorithm, checksum_value = catalog.preferred_digest(entry)
+            checksum_error = None
+            if checksum_value is None and entry.checksum_file:
+                try:
+                    checksum_value = self.fetch_checksum_from_file(entry.checksum_file)
+                except sources.SourceError as e:
+                    checksum_error = f"{entry.checksum_file}: {e}"
+                algorithm = verify.algorithm_for_digest(checksum_value) if checksum_value else None
+            # Every published digest (e.g. MD5 and SHA-256) comes out of the same pass
+            expected = {a: d for a, d in entry.digests.items() if a in hashlib.algorithms_available}
+            if not expected and algorithm:
+                expected = {algorithm: checksum_value}
+            algorithms = tuple(expected) or ("sha256",)
+            recorder = verify.DigestRecorder(algorithms)
+
+            def show_write_progress(downloaded, total):
+                if total > 0:
+                    percent = (downloaded / total) * 100
+                    GLib.idle_add(
+                        self.output_buffer.set_text,
+                        f"Writing {iso_file} to Ventoy USB... {percent:.2f}%"
+                    )
+
+            # Back off one byte so a file that was complete still has a range to fetch
+            offset = max(0, journal.resume_offset(record, iso_usb_path) - 1)
+            if offset:
+                # ✅ Pick up after the last byte known to be on the stick; the
+                # recorder re-reads that part so the checksum still covers it
+                hashing.feed_file(iso_usb_path, [recorder], uncached=True, length=offset)
+                stream, variant = transfer.open_resumable(source, entry.file, offset), entry.file
+            else:
+                # Compressed variants are decompressed on the fly; the recorder
+                # hashes the decompressed bytes that land on the stick
+                stream, variant = transfer.open_variant(source, catalog.variants(entry))
+            compression = transfer.compression_of(variant)
+            expected_size = entry.size or (None if compression else stream.size)
+            if reserved is None:
+                # ✅ Check and reserve the space first, so a stick that is too full fails now
+                reserved = preflight.open_reserved(iso_usb_path, expected_size, offset=offset)
+            with stream, reserved as f:
+                checkpoint = journal.Checkpoint(JOURNAL, key, iso_usb_path, f, offset)
+
+                def update(data):
+                    recorder.update(data)
+                    checkpoint(data)
+
+                started = time.monotonic()
+                try:
+                    written = offset + transfer.copy(
+                        stream, f.write, compression, update=update,
+                        progress=lambda read, size: show_write_progress(offset + read, size)
+                    )
+                    f.truncate()
+                    checkpoint.commit()
+                except Exception as e:
+                    HISTORY.record(history.DOWNLOAD, stream.position - stream.offset,
+                                   time.monotonic() - started, ok=False, error=e,
+                                   mirror=history.mirror_key(stream.source), iso=entry.file, **device)
+                    raise
+                HISTORY.record(history.DOWNLOAD, stream.position - stream.offset,
+                               time.monotonic() - started,
+                               mirror=history.mirror_key(stream.source), iso=entry.file, **device)
+            total_size = expected_size or written
+            recorder.finish()
+
+            def show_verify_progress(checked, to_check):
+                GLib.idle_add(
+                    self.output_buffer.set_text,
+                    f"Verifying {iso_file} on USB... {checked / max(to_check, 1) * 100:.1f}%"
+                )
+
+            def show_repair_progress(done, count):
+                GLib.idle_add(
+                    self.output_buffer.set_text,
+                    f"Re-fetching damaged chunks of {iso_file}... {done}/{count}"
+                )
+
+            written_size = os.path.getsize(iso_usb_path)
+            digest_ok = recorder.matches(expected)
+            if written_size != total_size or not digest_ok:
+                # ✅ Re-fetch only the damaged chunks instead of the whole ISO
+                manifest = chunks.for_entry(entry, source)
+                if manifest is None:
+                    if written_size != total_size:
+                        return False, f"⚠ File size mismatch: {written_size} vs expected {total_size}\n"
+                    return False, f"⚠ Checksum mismatch for {iso_file}: the download is corrupt\n"
+
+                GLib.idle_add(self.output_buffer.set_text, f"Checking {iso_file} chunk by chunk...")
+                bad = chunks.check(iso_usb_path, manifest, uncached=True)
+                bad = chunks.repair(iso_usb_path, manifest, source, entry.file, bad,
+                                    progress=show_repair_progress)
+                if bad:
+                    return False, f"⚠ {len(bad)} chunks of {iso_file} are still corrupt after re-fetching\n"
+
+                # What was hashed on the way in was the damaged stream, so hash the
+                # repaired copy from the stick; that doubles as the read-back
+                recorder = verify.record_file(iso_usb_path, algorithms,
+                                              progress=show_verify_progress)
+                if not recorder.matches(expected):
+                    return False, f"⚠ Checksum mismatch for {iso_file}: the download is corrupt\n"
+                result = verify.VerifyResult(True, recorder.size, [])
+            else:
+                # ✅ Read back from the stick itself, not the page cache
+                started = time.monotonic()
+                result = verify.verify_file(iso_usb_path, recorder, sample=verify_sample,
+                                            progress=show_verify_progress)
+                HISTORY.record(history.VERIFY, result.bytes_checked, time.monotonic() - started,
+                               ok=result.ok, iso=entry.file, **device)
+                if result.bad_blocks:
+                    # A marginal stick: rewrite just the blocks that read back wrong
+                    bad = chunks.repair(iso_usb_path, chunks.from_recorder(recorder), source,
+                                        entry.file, result.bad_blocks, progress=show_repair_progress)
+                    result = verify.VerifyResult(not bad, result.bytes_checked, bad)
+
+            succeeded = result.ok
+            if succeeded:
+                JOURNAL.verified(key, iso_usb_path, 0, recorder.size)
+
+            if not result.ok:
+                msg = f"⚠ Read-back mismatch for {iso_file} on the USB stick\n"
+            elif checksum_value:
+                msg = f"✅ ISO verified & copied to {iso_usb_path}\n"
+            else:
+                msg = f"✅ ISO copied and read back from {iso_usb_path}\n"
+                if checksum_error:
+                    msg += f"⚠ Not checked against the published checksum ({checksum_error})\n"
+            return succeeded, msg
+        finally:
+            # Only a crash or reboot leaves the job open for the next start
+            JOURNAL.finished(key, succeeded)
+
+
+def render_slide(path, width, height):
+    return GdkPixbuf.Pixbuf.new_from_file_at_scale(path, width, height, True)
+
 
 def main():
+    if SERVE_CACHE:
+        server.serve_in_background()
     win = AltimaUSBInstaller()
     win.connect("destroy", Gtk.main_quit)
     win.show_all()
@@ -5,13 +5,8 @@
 import sys
 import os
 import subprocess
-import traceback
-import requests
 import zipfile
 import glob
-import shutil
-import threading
-import time
 
 from PySide6.QtWidgets import (
     QApplication, QWidget, QVBoxLayout, QHBoxLayout, QLabel, QPushButton,
@@ -20,11 +15,18 @@ from PySide6.QtWidgets import (
 from PySide6.QtGui import QPixmap, QIcon
 from PySide6.QtCore import Qt, QTimer
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+from altima_usb_installer import catalog, history, preflight, qtworkers, sources, transfer
+
 # --- App Constants ---
 APP_VERSION = "2.1.4"
-ALTIMA_ISO_LIST = "https://download.altimalinux.com/altima-iso-list.json"
+# --source DIR|URL or ALTIMA_SOURCE points at a local mirror
+SOURCE = sources.configured(sys.argv)
+# Past transfer speeds, for mirror order and time estimates
+HISTORY = history.History()
 VENTOY_WIN_URL = "https://download.altimalinux.com/ventoy.zip"
 VENTOY_DEST = "ventoy"
+COPY_CHUNK = 1024 * 1024
 
 LOGO_ICO = "altima-logo-100.ico"
 LOGO_PNG = "altima-logo-100.png"
@@ -54,6 +56,9 @@ class AltimaUSBInstaller(QWidget):
 
         self.selected_usb = None
         self.current_message = 0
+        self.ventoy_worker = None
+        self.iso_worker = None
+        self.iso_catalog = catalog.Catalog([])
 
         # Main layout (Left 1/3, Right 2/3)
         main_layout = QHBoxLayout()
@@ -128,44 +133,54 @@ class AltimaUSBInstaller(QWidget):
         self.ventoy_button.clicked.connect(self.download_and_prepare_ventoy)
         self.left_panel.addWidget(self.ventoy_button)
 
+        self.ventoy_cancel_button = QPushButton("Cancel")
+        self.ventoy_cancel_button.setEnabled(False)
+        self.ventoy_cancel_button.clicked.connect(self.cancel_ventoy)
+        self.left_panel.addWidget(self.ventoy_cancel_button)
+
     def scan_usb_devices(self):
         self.usb_output.setPlainText("Scanning for USB devices... please wait.")
         self.usb_list.clear()
+        self.scan_button.setEnabled(False)
 
-        def scan():
+        def scan(worker):
             try:
-                output_lines = []
-                try:
-                    si = subprocess.STARTUPINFO()
-                    si.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-                    si.wShowWindow = 0
-                    raw = subprocess.check_output(
-                        [
-                            "powershell", "-NoLogo", "-NoProfile",
-                            "-Command",
-                            "(Get-Disk | Where-Object {$_.BusType -eq 'USB'}) "
-                            "| ForEach-Object {\"$($_.Number) | $($_.FriendlyName) | $([math]::Round($_.Size/1GB))GB\"}"
-                        ],
-                        text=True, startupinfo=si
-                    )
-                    output_lines = [l.strip() for l in raw.splitlines() if l.strip()]
-                except Exception as e:
-                    print(f"USB scan error: {e}")
-                    output_lines = []
-
-                if not output_lines:
-                    output_lines = ["No USB devices detected."]
-
-                self.usb_output.setPlainText("\n".join(output_lines))
-                if output_lines and "No USB" not in output_lines[0]:
-                    self.usb_list.addItems(output_lines)
-                    self.ventoy_button.setEnabled(True)
-                else:
-                    self.ventoy_button.setEnabled(False)
-            except Exception:
-                self.usb_output.setPlainText(traceback.format_exc())
+                si = subprocess.STARTUPINFO()
+                si.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+                si.wShowWindow = 0
+                raw = subprocess.check_output(
+                    [
+                        "powershell", "-NoLogo", "-NoProfile",
+                        "-Command",
+                        "(Get-Disk | Where-Object {$_.BusType -eq 'USB'}) "
+                        "| ForEach-Object {\"$($_.Number) | $($_.FriendlyName) | $([math]::Round($_.Size/1GB))GB\"}"
+                    ],
+                    text=True, startupinfo=si
+                )
+                return [l.strip() for l in raw.splitlines() if l.strip()]
+            except Exception as e:
+                print(f"USB scan error: {e}")
+                return []
+
+        self.scan_worker = qtworkers.Worker(scan)
+        self.scan_worker.signals.result.connect(self.on_scan_result)
+        self.scan_worker.signals.error.connect(self.usb_output.setPlainText)
+        self.scan_worker.signals.finished.connect(self.on_scan_finished)
+        qtworkers.start(self.scan_worker)
+
+    def on_scan_result(self, output_lines):
+        if not output_lines:
+            output_lines = ["No USB devices detected."]
+
+        self.usb_output.setPlainText("\n".join(output_lines))
+        if output_lines and "No USB" not in output_lines[0]:
+            self.usb_list.addItems(output_lines)
+            self.ventoy_button.setEnabled(True)
+        else:
+            self.ventoy_button.setEnabled(False)
 
-        threading.Thread(target=scan, daemon=True).start()
+    def on_scan_finished(self):
+        self.scan_button.setEnabled(True)
 
     # -----------------------------
     # Remaining methods (Ventoy & ISO Download) unchanged from v2.1.3
@@ -178,48 +193,78 @@ class AltimaUSBInstaller(QWidget):
 
         self.selected_usb = selected.text()
         self.usb_output.setPlainText(f"Selected: {self.selected_usb}\nDownloading Ventoy...")
+        self.ventoy_button.setEnabled(False)
 
-        def download_and_run():
-            try:
-                os.makedirs(VENTOY_DEST, exist_ok=True)
-                ventoy_zip_path = os.path.join(VENTOY_DEST, "ventoy.zip")
+        def download_and_run(worker):
+            os.makedirs(VENTOY_DEST, exist_ok=True)
+            ventoy_zip_path = os.path.join(VENTOY_DEST, "ventoy.zip")
 
-                with requests.get(VENTOY_WIN_URL, stream=True) as r:
-                    r.raise_for_status()
-                    total = int(r.headers.get("content-length", 0))
-                    downloaded = 0
-                    with open(ventoy_zip_path, "wb") as f:
-                        for chunk in r.iter_content(chunk_size=8192):
-                            if chunk:
-                                f.write(chunk)
-                                downloaded += len(chunk)
-                                if total > 0:
-                                    percent = (downloaded / total) * 100
-                                    self.usb_output.setPlainText(
-                                        f"Downloading Ventoy... {percent:.1f}%"
-                                    )
-
-                with zipfile.ZipFile(ventoy_zip_path, "r") as zip_ref:
-                    zip_ref.extractall(VENTOY_DEST)
-
-                self.usb_output.setPlainText("✅ Ventoy downloaded. Running Ventoy2Disk...")
-                ventoy_folders = glob.glob(os.path.join(VENTOY_DEST, "ventoy-*"))
-                if ventoy_folders:
-                    ventoy_exe = os.path.join(ventoy_folders[0], "Ventoy2Disk.exe")
-                    if os.path.exists(ventoy_exe):
-                        subprocess.run(
-                            ["powershell", "Start-Process", ventoy_exe, "-Verb", "runAs"],
-                            check=True
-                        )
-                        self.goto_iso_screen()
-                    else:
-                        self.usb_output.setPlainText("❌ Ventoy2Disk.exe not found.")
+            def show_progress(downloaded, total):
+                if total > 0:
+                    percent = (downloaded / total) * 100
+                    worker.report(percent, f"Downloading Ventoy... {percent:.1f}%")
                 else:
-                    self.usb_output.setPlainText("❌ Ventoy folder not found.")
-            except Exception:
-                self.usb_output.setPlainText(traceback.format_exc())
+                    worker.check_cancelled()
 
-        threading.Thread(target=download_and_run, daemon=True).start()
+            try:
+                with transfer.open_resumable(SOURCE, VENTOY_WIN_URL) as stream:
+                    with open(ventoy_zip_path, "wb") as f:
+                        transfer.copy(stream, f.write, progress=show_progress)
+            except qtworkers.Cancelled:
+                os.remove(ventoy_zip_path)
+                raise
+
+            with zipfile.ZipFile(ventoy_zip_path, "r") as zip_ref:
+                zip_ref.extractall(VENTOY_DEST)
+
+            worker.report(100, "✅ Ventoy downloaded. Running Ventoy2Disk...", force=True)
+            ventoy_folders = glob.glob(os.path.join(VENTOY_DEST, "ventoy-*"))
+            if not ventoy_folders:
+                return "❌ Ventoy folder not found."
+            ventoy_exe = os.path.join(ventoy_folders[0], "Ventoy2Disk.exe")
+            if not os.path.exists(ventoy_exe):
+                return "❌ Ventoy2Disk.exe not found."
+            subprocess.run(
+                ["powershell", "Start-Process", ventoy_exe, "-Verb", "runAs"],
+                check=True
+            )
+            return None
+
+        self.ventoy_cancel_button.setEnabled(True)
+        self.ventoy_worker = qtworkers.Worker(download_and_run)
+        self.ventoy_worker.signals.progress.connect(self.on_ventoy_progress)
+        self.ventoy_worker.signals.result.connect(self.on_ventoy_result)
+        self.ventoy_worker.signals.error.connect(self.on_ventoy_error)
+        self.ventoy_worker.signals.cancelled.connect(self.on_ventoy_cancelled)
+        qtworkers.start(self.ventoy_worker)
+
+    def cancel_ventoy(self):
+        if self.ventoy_worker is not None:
+            self.ventoy_worker.cancel()
+            self.ventoy_cancel_button.setEnabled(False)
+
+    def _ventoy_finished(self):
+        # Called before goto_iso_screen() deletes the buttons
+        self.ventoy_worker = None
+        self.ventoy_cancel_button.setEnabled(False)
+
+    def on_ventoy_progress(self, percent, message):
+        self.usb_output.setPlainText(message)
+
+    def on_ventoy_result(self, error):
+        if error:
+            self.on_ventoy_error(error)
+        else:
+            self._ventoy_finished()
+            self.goto_iso_screen()
+
+    def on_ventoy_error(self, message):
+        self._ventoy_finished()
+        self.usb_output.setPlainText(message)
+        self.ventoy_button.setEnabled(True)
+
+    def on_ventoy_cancelled(self):
+        self.on_ventoy_error("Ventoy download cancelled.")
 
     def goto_iso_screen(self):
         for i in reversed(range(self.left_panel.count())):
@@ -248,26 +293,30 @@ class AltimaUSBInstaller(QWidget):
         self.download_button.clicked.connect(self.download_iso)
         self.left_panel.addWidget(self.download_button)
 
+        self.cancel_button = QPushButton("Cancel")
+        self.cancel_button.setEnabled(False)
+        self.cancel_button.clicked.connect(self.cancel_download)
+        self.left_panel.addWidget(self.cancel_button)
+
         self.load_iso_list()
 
     def load_iso_list(self):
         self.iso_output.setPlainText("Fetching ISO list...")
 
-        def fetch_list():
-            try:
-                response = requests.get(ALTIMA_ISO_LIST, timeout=5)
-                data = response.json() if response.status_code == 200 else {}
-                isos = data.get("isos", [
-                    {"name": "Altima Linux Minimal (Fallback)", "file": "altima-minimal-1.0.iso"},
-                    {"name": "Altima Linux Full (Fallback)", "file": "altima-full-1.0.iso"}
-                ])
-                self.iso_list.clear()
-                for iso in isos:
-                    self.iso_list.addItem(f"{iso['name']} ({iso['file']})")
-            except Exception:
-                self.iso_output.setPlainText(traceback.format_exc())
+        def fetch_list(worker):
+            return catalog.fetch(SOURCE)
+
+        self.list_worker = qtworkers.Worker(fetch_list)
+        self.list_worker.signals.result.connect(self.on_iso_list)
+        self.list_worker.signals.error.connect(self.iso_output.setPlainText)
+        qtworkers.start(self.list_worker)
 
-        threading.Thread(target=fetch_list, daemon=True).start()
+    def on_iso_list(self, iso_catalog):
+        self.iso_catalog = iso_catalog
+        self.iso_list.clear()
+        for iso in iso_catalog.current():
+            self.iso_list.addItem(f"{iso.name} ({iso.file})")
+        self.iso_output.clear()
 
     def download_iso(self):
         selected = self.iso_list.currentItem()
@@ -277,63 +326,98 @@ class AltimaUSBInstaller(QWidget):
 
         iso_text = selected.text()
         iso_file = iso_text.split("(")[-1].strip(")")
+        entry = self.iso_catalog.get(iso_file)
+        source = HISTORY.order(
+            sources.with_mirrors(SOURCE, self.iso_catalog.mirrors_for(entry) if entry else ())
+        )
+        eject_when_done = self.eject_checkbox.isChecked()
         self.iso_output.setPlainText(f"Downloading {iso_file}...")
 
-        def download_and_copy():
+        def download_and_copy(worker):
+            def show_progress(downloaded, total):
+                if total > 0:
+                    percent = downloaded / total
+                    worker.report(percent * 50, f"Downloading {iso_file}... {percent:.1%}")
+
+            # Downloads land in the shared cache; a local mirror is copied from in place
+            iso_path = sources.fetch_to_cache(source, iso_file, show_progress,
+                                              variants=entry.compressed if entry else (),
+                                              size=entry.size if entry else None,
+                                              digests=entry.digests if entry else None,
+                                              history=HISTORY)
+
             try:
-                iso_url = ALTIMA_ISO_LIST.replace("altima-iso-list.json", iso_file)
-                iso_path = os.path.join(os.getcwd(), iso_file)
-
-                with requests.get(iso_url, stream=True) as r:
-                    r.raise_for_status()
-                    total = int(r.headers.get("content-length", 0))
-                    downloaded = 0
-                    with open(iso_path, "wb") as f:
-                        for chunk in r.iter_content(chunk_size=8192):
-                            if chunk:
-                                f.write(chunk)
-                                downloaded += len(chunk)
-                                if total > 0:
-                                    percent = downloaded / total
-                                    self.progress_bar.setValue(int(percent * 50))
-
-                copied_path = None
-                try:
-                    si = subprocess.STARTUPINFO()
-                    si.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-                    si.wShowWindow = 0
-                    drive_letter = subprocess.check_output(
-                        [
-                            "powershell", "-NoLogo", "-NoProfile",
-                            "-Command",
-                            "(Get-Volume | Where-Object {$_.FileSystemLabel -eq 'Ventoy'}).DriveLetter"
-                        ],
-                        text=True, startupinfo=si
-                    ).strip()
-                    if drive_letter:
-                        copied_path = f"{drive_letter}:\\{iso_file}"
-                        shutil.copy(iso_path, copied_path)
-                        self.progress_bar.setValue(100)
-                        self.iso_output.setPlainText(
-                            f"✅ ISO copied to {copied_path}\nYour USB is ready to boot!"
-                        )
-                        if self.eject_checkbox.isChecked():
-                            subprocess.run(
-                                [
-                                    "powershell", "-NoLogo", "-NoProfile",
-                                    f"Remove-Volume -DriveLetter {drive_letter} -Confirm:$false"
-                                ]
-                            )
-                            self.iso_output.append("✅ USB ejected safely.")
-                except Exception:
-                    self.iso_output.append(f"✅ ISO downloaded to {iso_path}\nCopy manually if needed.")
+                si = subprocess.STARTUPINFO()
+                si.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+                si.wShowWindow = 0
+                drive_letter = subprocess.check_output(
+                    [
+                        "powershell", "-NoLogo", "-NoProfile",
+                        "-Command",
+                        "(Get-Volume | Where-Object {$_.FileSystemLabel -eq 'Ventoy'}).DriveLetter"
+                    ],
+                    text=True, startupinfo=si
+                ).strip()
             except Exception:
-                self.iso_output.setPlainText(traceback.format_exc())
-            finally:
-                time.sleep(1)
-                self.progress_bar.setValue(0)
+                drive_letter = ""
+            if not drive_letter:
+                return f"✅ ISO downloaded to {iso_path}\nCopy manually if needed."
 
-        threading.Thread(target=download_and_copy, daemon=True).start()
+            copied_path = f"{drive_letter}:\\{iso_file}"
+            size = os.path.getsize(iso_path)
+            copied = 0
+            try:
+                # Raises NoSpaceError before the first byte if the stick is too full
+                with open(iso_path, "rb") as src, preflight.open_reserved(copied_path, size) as dst:
+                    for chunk in iter(lambda: src.read(COPY_CHUNK), b""):
+                        dst.write(chunk)
+                        copied += len(chunk)
+                        fraction = copied / max(size, 1)
+                        worker.report(50 + fraction * 50, f"Copying {iso_file} to {drive_letter}:... {fraction:.1%}")
+            except qtworkers.Cancelled:
+                os.remove(copied_path)
+                raise
+            worker.report(100, "", force=True)
+
+            message = f"✅ ISO copied to {copied_path}\nYour USB is ready to boot!"
+            if eject_when_done:
+                subprocess.run(
+                    [
+                        "powershell", "-NoLogo", "-NoProfile",
+                        f"Remove-Volume -DriveLetter {drive_letter} -Confirm:$false"
+                    ]
+                )
+                message += "\n✅ USB ejected safely."
+            return message
+
+        self.download_button.setEnabled(False)
+        self.cancel_button.setEnabled(True)
+        self.iso_worker = qtworkers.Worker(download_and_copy)
+        self.iso_worker.signals.progress.connect(self.on_iso_progress)
+        self.iso_worker.signals.result.connect(self.iso_output.setPlainText)
+        self.iso_worker.signals.error.connect(self.iso_output.setPlainText)
+        self.iso_worker.signals.cancelled.connect(self.on_iso_cancelled)
+        self.iso_worker.signals.finished.connect(self.on_iso_finished)
+        qtworkers.start(self.iso_worker)
+
+    def cancel_download(self):
+        if self.iso_worker is not None:
+            self.iso_worker.cancel()
+            self.cancel_button.setEnabled(False)
+
+    def on_iso_progress(self, percent, message):
+        self.progress_bar.setValue(percent)
+        if message:
+            self.iso_output.setPlainText(message)
+
+    def on_iso_cancelled(self):
+        self.iso_output.setPlainText("Download cancelled.")
+
+    def on_iso_finished(self):
+        self.iso_worker = None
+        self.download_button.setEnabled(True)
+        self.cancel_button.setEnabled(False)
+        QTimer.singleShot(1000, lambda: self.progress_bar.setValue(0))
 
 
 def main():
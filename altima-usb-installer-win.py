@@ -3,11 +3,8 @@
 
 import sys
 import subprocess
-import requests
 import zipfile
 import os
-import shutil
-import threading
 import traceback
 from PySide6.QtWidgets import (
     QApplication, QWidget, QLabel, QPushButton, QTextEdit, QVBoxLayout,
@@ -16,8 +13,14 @@ from PySide6.QtWidgets import (
 from PySide6.QtCore import Qt, QTimer
 from PySide6.QtGui import QFont, QPixmap, QIcon
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+from altima_usb_installer import catalog, history, qtworkers, sources, transfer
+
 VENTOY_URL = "https://downloads.altimalinux.com/ventoy.zip"
-ISO_LIST_URL = "https://downloads.altimalinux.com/altima-iso-list.json"
+# --source DIR|URL or ALTIMA_SOURCE points at a local mirror
+SOURCE = sources.configured(sys.argv)
+# Past transfer speeds, for mirror order
+HISTORY = history.History()
 ICON_PATH = "altima-logo-100.png"
 
 class AltimaInstaller(QWidget):
@@ -72,6 +75,12 @@ class AltimaInstaller(QWidget):
         self.progress.setValue(0)
         self.left_panel.addWidget(self.progress)
 
+        self.cancel_btn = QPushButton("Cancel")
+        self.cancel_btn.setEnabled(False)
+        self.cancel_btn.clicked.connect(self.cancel_worker)
+        self.left_panel.addWidget(self.cancel_btn)
+        self.worker = None
+
         self.left_panel.addStretch()
         self.layout.addLayout(self.left_panel, 1)
         self.layout.addLayout(self.right_panel, 2)
@@ -108,33 +117,58 @@ class AltimaInstaller(QWidget):
 
     def download_and_install_ventoy(self):
         self.text_display.setPlainText("Downloading Ventoy...")
-        threading.Thread(target=self._download_and_extract_zip, args=(VENTOY_URL, "ventoy"), daemon=True).start()
+        self._start_worker(self._download_and_extract_zip, VENTOY_URL, "ventoy")
 
-    def _download_and_extract_zip(self, url, dest):
+    def _start_worker(self, fn, *args):
+        self.download_btn.setEnabled(False)
+        self.iso_btn.setEnabled(False)
+        self.cancel_btn.setEnabled(True)
+        self.worker = qtworkers.Worker(fn, *args)
+        self.worker.signals.progress.connect(self._on_progress)
+        self.worker.signals.result.connect(self.text_display.setPlainText)
+        self.worker.signals.error.connect(self.text_display.setPlainText)
+        self.worker.signals.cancelled.connect(self._on_cancelled)
+        self.worker.signals.finished.connect(self._on_finished)
+        qtworkers.start(self.worker)
+
+    def cancel_worker(self):
+        if self.worker is not None:
+            self.worker.cancel()
+            self.cancel_btn.setEnabled(False)
+
+    def _on_progress(self, percent, message):
+        self.progress.setValue(percent)
+        if message:
+            self.text_display.setPlainText(message)
+
+    def _on_cancelled(self):
+        self.text_display.setPlainText("Cancelled.")
+
+    def _on_finished(self):
+        self.worker = None
+        self.progress.setValue(0)
+        self.cancel_btn.setEnabled(False)
+        self.enable_buttons()
+
+    def _download(self, worker, url, path, source=SOURCE):
         try:
-            os.makedirs(dest, exist_ok=True)
-            zip_path = os.path.join(dest, "ventoy.zip")
-            with requests.get(url, stream=True) as r:
-                r.raise_for_status()
-                total = int(r.headers.get('content-length', 0))
-                with open(zip_path, "wb") as f:
-                    downloaded = 0
-                    for chunk in r.iter_content(chunk_size=8192):
-                        if chunk:
-                            f.write(chunk)
-                            downloaded += len(chunk)
-                            percent = int((downloaded / total) * 100) if total else 0
-                            self.progress.setValue(percent)
-            with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-                zip_ref.extractall(dest)
-            exe_path = self._find_ventoy_exe(dest)
-            if exe_path:
-                subprocess.run([exe_path], shell=True)
-            self.text_display.setPlainText("✅ Ventoy installed.")
-        except Exception:
-            self.text_display.setPlainText(traceback.format_exc())
-        finally:
-            self.progress.setValue(0)
+            with transfer.open_resumable(source, url) as stream, open(path, "wb") as f:
+                transfer.copy(stream, f.write, progress=lambda downloaded, total: worker.report(
+                    int((downloaded / total) * 100) if total else 0))
+        except qtworkers.Cancelled:
+            os.remove(path)
+            raise
+
+    def _download_and_extract_zip(self, worker, url, dest):
+        os.makedirs(dest, exist_ok=True)
+        zip_path = os.path.join(dest, "ventoy.zip")
+        self._download(worker, url, zip_path)
+        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+            zip_ref.extractall(dest)
+        exe_path = self._find_ventoy_exe(dest)
+        if exe_path:
+            subprocess.run([exe_path], shell=True)
+        return "✅ Ventoy installed."
 
     def _find_ventoy_exe(self, folder):
         for root, _, files in os.walk(folder):
@@ -145,40 +179,23 @@ class AltimaInstaller(QWidget):
 
     def download_and_copy_iso(self):
         self.text_display.setPlainText("Fetching ISO list...")
-        threading.Thread(target=self._download_iso_thread, daemon=True).start()
-
-    def _download_iso_thread(self):
-        try:
-            response = requests.get(ISO_LIST_URL)
-            response.raise_for_status()
-            data = response.json()
-            iso_url = data["isos"][0]["url"]
-            iso_path = os.path.join("iso", os.path.basename(iso_url))
+        self._start_worker(self._download_iso_thread, self.usb_combo.currentText())
+
+    def _download_iso_thread(self, worker, target):
+        iso_catalog = catalog.fetch(SOURCE, fallback=False)
+        entry = iso_catalog.current()[0]
+        source = HISTORY.order(sources.with_mirrors(SOURCE, iso_catalog.mirrors_for(entry)))
+        iso_path = source.local_path(entry.file)
+        if iso_path is None:
+            iso_path = os.path.join("iso", entry.file)
             os.makedirs("iso", exist_ok=True)
-            self.text_display.setPlainText("Downloading ISO...")
-
-            with requests.get(iso_url, stream=True) as r:
-                r.raise_for_status()
-                total = int(r.headers.get('content-length', 0))
-                with open(iso_path, "wb") as f:
-                    downloaded = 0
-                    for chunk in r.iter_content(chunk_size=8192):
-                        if chunk:
-                            f.write(chunk)
-                            downloaded += len(chunk)
-                            percent = int((downloaded / total) * 100) if total else 0
-                            self.progress.setValue(percent)
-
-            target = self.usb_combo.currentText()
-            if target:
-                subprocess.run(["xcopy", iso_path, target], shell=True)
-                self.text_display.setPlainText("✅ ISO copied to USB.")
-            else:
-                self.text_display.setPlainText("❌ No USB selected.")
-        except Exception:
-            self.text_display.setPlainText(traceback.format_exc())
-        finally:
-            self.progress.setValue(0)
+            worker.report(0, "Downloading ISO...", force=True)
+            self._download(worker, entry.file, iso_path, source)
+
+        if target:
+            subprocess.run(["xcopy", iso_path, target], shell=True)
+            return "✅ ISO copied to USB."
+        return "❌ No USB selected."
 
 def main():
     app = QApplication(sys.argv)
@@ -1,7 +1,6 @@
 import sys
 import subprocess
 import traceback
-import requests
 import zipfile
 import os
 import glob
@@ -13,12 +12,15 @@ from PySide6.QtWidgets import (
 from PySide6.QtGui import QFont, QPixmap, QIcon
 from PySide6.QtCore import Qt, QTimer
 
+from altima_usb_installer import qtworkers, slideshow, sources, transfer
+
 # --- Base Path for Bundled Resources ---
 BASE_DIR = getattr(sys, "_MEIPASS", os.path.abspath("."))
 
 # --- App Constants ---
 ALTIMA_LOGO_PATH = os.path.join(BASE_DIR, "altima-logo-100.ico")
-ALTIMA_ISO_LIST = "https://download.altimalinux.com/"
+# --source DIR|URL or ALTIMA_SOURCE points at a local mirror
+SOURCE = sources.configured(sys.argv)
 VENTOY_WIN_URL = "https://download.altimalinux.com/ventoy.zip"
 VENTOY_DEST = "ventoy"
 
@@ -36,8 +38,8 @@ class AltimaUSBInstaller(QWidget):
         self.setGeometry(200, 200, 800, 500)
         self.setWindowIcon(QIcon(ALTIMA_LOGO_PATH))
 
-        self.current_slide = 0
         self.selected_usb = None
+        self.ventoy_worker = None
         self.init_usb_screen()
 
     # =========================
@@ -68,6 +70,11 @@ class AltimaUSBInstaller(QWidget):
         self.ok_button.setEnabled(False)
         self.left_layout.addWidget(self.ok_button)
 
+        self.cancel_button = QPushButton("Cancel")
+        self.cancel_button.setEnabled(False)
+        self.cancel_button.clicked.connect(self.cancel_ventoy)
+        self.left_layout.addWidget(self.cancel_button)
+
         self.layout.addLayout(self.left_layout)
 
         # Right panel (Static slideshow)
@@ -80,33 +87,39 @@ class AltimaUSBInstaller(QWidget):
 
     def start_slideshow(self):
         if SLIDESHOW_IMAGES:
-            self.update_slide()
+            # Slides are decoded and scaled once, then swapped from a small cache
+            self.slideshow = slideshow.Slideshow(
+                SLIDESHOW_IMAGES, render_slide, self.slide_label.setPixmap
+            )
+            self.slideshow.set_size(380, 380)
             self.timer = QTimer()
             self.timer.timeout.connect(self.next_slide)
             self.timer.start(5000)
 
-    def update_slide(self):
-        if os.path.exists(SLIDESHOW_IMAGES[self.current_slide]):
-            pixmap = QPixmap(SLIDESHOW_IMAGES[self.current_slide])
-            self.slide_label.setPixmap(pixmap.scaled(380, 380, Qt.KeepAspectRatio))
-
     def next_slide(self):
-        self.current_slide = (self.current_slide + 1) % len(SLIDESHOW_IMAGES)
-        self.update_slide()
+        self.slideshow.tick(self.isVisible() and not self.isMinimized())
+
+    def pause_slides(self, reason):
+        """Hold the slides still while reason (a transfer) runs."""
+        if SLIDESHOW_IMAGES:
+            self.slideshow.pause(reason)
+
+    def resume_slides(self, reason):
+        if SLIDESHOW_IMAGES:
+            self.slideshow.resume(reason)
 
     def scan_usb_devices(self):
         self.output_area.setPlainText("Scanning for USB devices... please wait.")
-        QApplication.processEvents()
         self.usb_list.clear()
+        self.scan_button.setEnabled(False)
 
-        try:
-            output = ""
+        def scan(worker):
             if sys.platform.startswith("win"):
                 si = subprocess.STARTUPINFO()
                 si.dwFlags |= subprocess.STARTF_USESHOWWINDOW
                 si.wShowWindow = 0
                 try:
-                    output = subprocess.check_output(
+                    return subprocess.check_output(
                         [
                             "powershell",
                             "-NoLogo", "-NoProfile",
@@ -119,7 +132,7 @@ class AltimaUSBInstaller(QWidget):
                         startupinfo=si
                     )
                 except Exception:
-                    output = subprocess.check_output(
+                    return subprocess.check_output(
                         [
                             "wmic", "diskdrive", "where", "InterfaceType='USB'",
                             "get", "Caption,DeviceID,Size"
@@ -128,24 +141,34 @@ class AltimaUSBInstaller(QWidget):
                         startupinfo=si
                     )
             elif sys.platform.startswith("linux"):
-                output = subprocess.check_output(
+                return subprocess.check_output(
                     ["lsblk", "-o", "NAME,SIZE,MODEL,TRAN"], text=True
                 )
-            else:
-                output = "Unsupported platform."
+            return "Unsupported platform."
+
+        self.scan_worker = qtworkers.Worker(scan)
+        self.scan_worker.signals.result.connect(self.on_scan_result)
+        self.scan_worker.signals.error.connect(self.on_scan_error)
+        self.scan_worker.signals.finished.connect(self.on_scan_finished)
+        qtworkers.start(self.scan_worker)
 
-            self.output_area.setPlainText(output.strip())
+    def on_scan_result(self, output):
+        self.output_area.setPlainText(output.strip())
 
-            # ✅ Populate USB list
-            lines = output.splitlines()
-            for line in lines:
-                if "USB" in line or "usb" in line.lower():
-                    self.usb_list.addItem(line.strip())
+        # ✅ Populate USB list
+        lines = output.splitlines()
+        for line in lines:
+            if "USB" in line or "usb" in line.lower():
+                self.usb_list.addItem(line.strip())
 
-            if self.usb_list.count() > 0:
-                self.ok_button.setEnabled(True)
-        except Exception:
-            self.output_area.setPlainText(f"Error scanning USB devices:\n{traceback.format_exc()}")
+        if self.usb_list.count() > 0:
+            self.ok_button.setEnabled(True)
+
+    def on_scan_error(self, error):
+        self.output_area.setPlainText(f"Error scanning USB devices:\n{error}")
+
+    def on_scan_finished(self):
+        self.scan_button.setEnabled(True)
 
     # =========================
     # SCREEN 2: Ventoy Download & Install
@@ -157,48 +180,85 @@ class AltimaUSBInstaller(QWidget):
 
         self.selected_usb = self.usb_list.currentItem().text()
         self.output_area.setPlainText(f"Selected: {self.selected_usb}\nDownloading Ventoy...")
-        QApplication.processEvents()
+        self.ok_button.setEnabled(False)
 
-        try:
+        def download_and_run(worker):
             os.makedirs(VENTOY_DEST, exist_ok=True)
             ventoy_zip_path = os.path.join(VENTOY_DEST, "ventoy.zip")
 
-            with requests.get(VENTOY_WIN_URL, stream=True) as r:
-                r.raise_for_status()
-                total = int(r.headers.get('content-length', 0))
-                downloaded = 0
-                with open(ventoy_zip_path, "wb") as f:
-                    for chunk in r.iter_content(chunk_size=8192):
-                        if chunk:
-                            f.write(chunk)
-                            downloaded += len(chunk)
-                            if total > 0:
-                                percent = (downloaded / total) * 100
-                                self.output_area.setPlainText(f"Downloading Ventoy... {percent:.2f}%")
-                                QApplication.processEvents()
+            def show_progress(downloaded, total):
+                if total > 0:
+                    percent = (downloaded / total) * 100
+                    worker.report(percent, f"Downloading Ventoy... {percent:.2f}%")
+                else:
+                    worker.check_cancelled()
+
+            try:
+                with transfer.open_resumable(SOURCE, VENTOY_WIN_URL) as stream:
+                    with open(ventoy_zip_path, "wb") as f:
+                        transfer.copy(stream, f.write, progress=show_progress)
+            except qtworkers.Cancelled:
+                os.remove(ventoy_zip_path)
+                raise
 
             with zipfile.ZipFile(ventoy_zip_path, "r") as zip_ref:
                 zip_ref.extractall(VENTOY_DEST)
 
-            self.output_area.setPlainText("✅ Ventoy downloaded. Running Ventoy2Disk (admin)...")
-            QApplication.processEvents()
+            worker.report(100, "✅ Ventoy downloaded. Running Ventoy2Disk (admin)...", force=True)
 
             # ✅ Find Ventoy2Disk.exe dynamically & run with UAC
             ventoy_folders = glob.glob(os.path.join(VENTOY_DEST, "ventoy-*"))
-            if ventoy_folders:
-                ventoy_exe = os.path.join(ventoy_folders[0], "Ventoy2Disk.exe")
-                if os.path.exists(ventoy_exe):
-                    subprocess.run([
-                        "powershell",
-                        "Start-Process", ventoy_exe, "-Verb", "runAs"
-                    ], check=True)
-                    self.goto_iso_screen()
-                else:
-                    self.output_area.setPlainText("❌ Ventoy2Disk.exe not found after extraction.")
-            else:
-                self.output_area.setPlainText("❌ Ventoy folder not found after extraction.")
-        except Exception:
-            self.output_area.setPlainText(f"Error preparing Ventoy:\n{traceback.format_exc()}")
+            if not ventoy_folders:
+                return "❌ Ventoy folder not found after extraction."
+            ventoy_exe = os.path.join(ventoy_folders[0], "Ventoy2Disk.exe")
+            if not os.path.exists(ventoy_exe):
+                return "❌ Ventoy2Disk.exe not found after extraction."
+            subprocess.run([
+                "powershell",
+                "Start-Process", ventoy_exe, "-Verb", "runAs"
+            ], check=True)
+            return None
+
+        self.cancel_button.setEnabled(True)
+        self.pause_slides("ventoy")
+        self.ventoy_worker = qtworkers.Worker(download_and_run)
+        self.ventoy_worker.signals.progress.connect(self.on_ventoy_progress)
+        self.ventoy_worker.signals.result.connect(self.on_ventoy_result)
+        self.ventoy_worker.signals.error.connect(self.on_ventoy_error)
+        self.ventoy_worker.signals.cancelled.connect(self.on_ventoy_cancelled)
+        qtworkers.start(self.ventoy_worker)
+
+    def cancel_ventoy(self):
+        if self.ventoy_worker is not None:
+            self.ventoy_worker.cancel()
+            self.cancel_button.setEnabled(False)
+
+    def _ventoy_finished(self):
+        # Called before goto_iso_screen() deletes the buttons
+        self.ventoy_worker = None
+        self.cancel_button.setEnabled(False)
+        self.resume_slides("ventoy")
+
+    def on_ventoy_progress(self, percent, message):
+        self.output_area.setPlainText(message)
+
+    def on_ventoy_result(self, error):
+        self._ventoy_finished()
+        if error:
+            self.output_area.setPlainText(error)
+            self.ok_button.setEnabled(True)
+        else:
+            self.goto_iso_screen()
+
+    def on_ventoy_error(self, error):
+        self._ventoy_finished()
+        self.output_area.setPlainText(f"Error preparing Ventoy:\n{error}")
+        self.ok_button.setEnabled(True)
+
+    def on_ventoy_cancelled(self):
+        self._ventoy_finished()
+        self.output_area.setPlainText("Ventoy download cancelled.")
+        self.ok_button.setEnabled(True)
 
     # =========================
     # SCREEN 3: ISO Download
@@ -214,7 +274,7 @@ class AltimaUSBInstaller(QWidget):
         title.setAlignment(Qt.AlignCenter)
         self.left_layout.addWidget(title)
 
-        iso_url_label = QLabel(f"Available ISOs: {ALTIMA_ISO_LIST}")
+        iso_url_label = QLabel(f"Available ISOs: {SOURCE.upstream.url('')}")
         iso_url_label.setAlignment(Qt.AlignCenter)
         self.left_layout.addWidget(iso_url_label)
 
@@ -231,6 +291,10 @@ class AltimaUSBInstaller(QWidget):
         # Placeholder for ISO download & copy
 
 
+def render_slide(path, width, height):
+    return QPixmap(path).scaled(width, height, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+
+
 def main():
     app = QApplication(sys.argv)
     app.setWindowIcon(QIcon(ALTIMA_LOGO_PATH))
@@ -0,0 +1,273 @@
+"""The ISO catalog (altima-iso-list.json) and its loader.
+
+Schema 2 describes each image fully, so clients can preallocate, check
+free space, pick mirrors and verify without extra round trips:
+
+    {
+      "schema": 2,
+      "mirrors": ["https://mirror.example.org/altima/"],
+      "isos": [{
+        "id": "altima-vanuatu",
+        "name": "Altima Linux Vanuatu",
+        "file": "altima-vanuatu.iso",
+        "compressed": ["altima-vanuatu.iso.zst", "altima-vanuatu.iso.xz"],
+        "size": 2147483648,
+        "digests": {"sha256": "<hex>", "md5": "<hex>"},
+        "checksum_file": "altima-vanuatu.md5",
+        "mirrors": ["https://other.example.org/"],
+        "chunks": {"size": 4194304, "algorithm": "blake2b", "digests": ["<hex>", ...]},
+        "released": "2025-06-01",
+        "superseded_by": "altima-vanuatu-2"
+      }]
+    }
+
+Everything but name and file is optional. size, digests and chunks
+describe the plain ISO, even when a compressed variant is downloaded; a
+file ending in .gz/.xz/.zst is taken as the only, compressed, variant. Schema 1 lists (no "schema"
+key) are still accepted: their "sha256" field may hold either a digest or
+the name of a checksum file, and a "url" key stands in for file plus a
+mirror. Published schema 2 lists keep that "sha256" field next to digests
+and checksum_file for clients that predate schema 2; it is read only
+where those two leave a gap. load() compiles either form into an indexed
+Catalog.
+"""
+import json
+import posixpath
+from collections import namedtuple
+from urllib.parse import urlparse
+
+from altima_usb_installer import hedged, transfer
+
+SCHEMA_VERSION = 2
+
+DIGEST_LENGTHS = {32: "md5", 40: "sha1", 64: "sha256", 128: "sha512"}
+# Strongest first; the first one an entry carries is the one to check
+DIGEST_PREFERENCE = ("sha512", "sha256", "sha1", "md5")
+
+Entry = namedtuple(
+    "Entry",
+    "id name file compressed size digests checksum_file mirrors chunk_size chunk_algorithm chunks "
+    "released superseded_by"
+)
+
+FALLBACK = {
+    "schema": SCHEMA_VERSION,
+    "isos": [
+        {"name": "Altima Linux Minimal (Fallback)", "file": "altima-minimal-1.0.iso"},
+        {"name": "Altima Linux Full (Fallback)", "file": "altima-full-1.0.iso"},
+    ],
+}
+
+
+class CatalogError(ValueError):
+    pass
+
+
+def _is_hex(value):
+    return len(value) in DIGEST_LENGTHS and all(c in "0123456789abcdefABCDEF" for c in value)
+
+
+def _mirror_list(value, where):
+    if value is None:
+        return ()
+    if isinstance(value, str):
+        value = [value]
+    if not isinstance(value, (list, tuple)) or not all(isinstance(m, str) for m in value):
+        raise CatalogError(f"{where}: mirrors must be a list of URLs")
+    return tuple(m if m.endswith("/") else m + "/" for m in value)
+
+
+def _entry_v1(raw):
+    file = raw.get("file")
+    mirrors = ()
+    url = raw.get("url")
+    if url:
+        parsed = urlparse(url)
+        file = file or posixpath.basename(parsed.path)
+        mirrors = (url[:len(url) - len(posixpath.basename(parsed.path))],)
+
+    digests = {}
+    checksum_file = None
+    checksum = raw.get("sha256")
+    if checksum:
+        if _is_hex(checksum):
+            digests[DIGEST_LENGTHS[len(checksum)]] = checksum.lower()
+        else:
+            # Schema 1 lists put the name of a .md5/.sha256 file here
+            checksum_file = checksum
+    return dict(raw, file=file, digests=digests, checksum_file=checksum_file, mirrors=mirrors)
+
+
+def _compile(raw, index, schema):
+    where = f"isos[{index}]"
+    if not isinstance(raw, dict):
+        raise CatalogError(f"{where}: expected an object")
+    if schema < 2:
+        raw = _entry_v1(raw)
+    elif raw.get("sha256"):
+        legacy = _entry_v1(dict(raw, url=None))
+        raw = dict(raw, digests=raw.get("digests") or legacy["digests"],
+                   checksum_file=raw.get("checksum_file") or legacy["checksum_file"])
+
+    file = raw.get("file")
+    if not isinstance(file, str) or not file or file != posixpath.basename(file):
+        raise CatalogError(f"{where}: file must be a plain file name")
+    name = raw.get("name") or file
+
+    compressed = raw.get("compressed") or []
+    if (not isinstance(compressed, list)
+            or not all(isinstance(c, str) and c == posixpath.basename(c) for c in compressed)):
+        raise CatalogError(f"{where}: compressed must be a list of file names")
+    if transfer.compression_of(file):
+        compressed = [file] + compressed
+        file = transfer.strip_compression(file)
+
+    size = raw.get("size")
+    if size is not None and (not isinstance(size, int) or size < 0):
+        raise CatalogError(f"{where}: size must be a byte count")
+
+    raw_digests = raw.get("digests") or {}
+    if not isinstance(raw_digests, dict):
+        raise CatalogError(f"{where}: digests must map algorithms to hex digests")
+    digests = {}
+    for algorithm, value in raw_digests.items():
+        algorithm = algorithm.lower()
+        if not isinstance(value, str) or not _is_hex(value):
+            raise CatalogError(f"{where}: {algorithm} digest is not hex")
+        if DIGEST_LENGTHS.get(len(value)) != algorithm and algorithm in DIGEST_LENGTHS.values():
+            raise CatalogError(f"{where}: {algorithm} digest has the wrong length")
+        digests[algorithm] = value.lower()
+
+    chunk_size = chunk_algorithm = None
+    chunks = ()
+    spec = raw.get("chunks")
+    if spec:
+        if not isinstance(spec, dict):
+            raise CatalogError(f"{where}: chunks must be an object")
+        chunk_size = spec.get("size")
+        chunk_algorithm = spec.get("algorithm", "blake2b")
+        if not isinstance(chunk_size, int) or chunk_size <= 0:
+            raise CatalogError(f"{where}: chunks.size must be a positive byte count")
+        if not isinstance(chunk_algorithm, str):
+            raise CatalogError(f"{where}: chunks.algorithm must be a name")
+        if not isinstance(spec.get("digests", []), list):
+            raise CatalogError(f"{where}: chunks.digests must be a list of hex strings")
+        try:
+            chunks = tuple(bytes.fromhex(d) for d in spec.get("digests", []))
+        except (TypeError, ValueError):
+            raise CatalogError(f"{where}: chunks.digests must be hex strings") from None
+        if size is not None and chunks and len(chunks) != -(-size // chunk_size):
+            raise CatalogError(f"{where}: {len(chunks)} chunk digests do not cover {size} bytes")
+
+    return Entry(
+        id=raw.get("id") or file.rsplit(".", 1)[0],
+        name=name,
+        file=file,
+        compressed=tuple(compressed),
+        size=size,
+        digests=digests,
+        checksum_file=raw.get("checksum_file"),
+        mirrors=_mirror_list(raw.get("mirrors"), where),
+        chunk_size=chunk_size,
+        chunk_algorithm=chunk_algorithm,
+        chunks=chunks,
+        released=raw.get("released"),
+        superseded_by=raw.get("superseded_by"),
+    )
+
+
+class Catalog:
+    """Compiled catalog: entries in published order, indexed by id and file."""
+
+    def __init__(self, entries, mirrors=(), schema=SCHEMA_VERSION):
+        self.entries = list(entries)
+        self.mirrors = tuple(mirrors)
+        self.schema = schema
+        self.by_id = {}
+        self.by_file = {}
+        for entry in self.entries:
+            if entry.id in self.by_id:
+                raise CatalogError(f"duplicate id {entry.id!r}")
+            self.by_id[entry.id] = entry
+            self.by_file[entry.file] = entry
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def get(self, key):
+        """Look an entry up by id or file name."""
+        return self.by_id.get(key) or self.by_file.get(key)
+
+    def latest(self, key):
+        """Follow superseded_by links to the newest entry; stops on cycles."""
+        entry = self.get(key)
+        seen = set()
+        while entry is not None and entry.superseded_by and entry.id not in seen:
+            seen.add(entry.id)
+            newer = self.by_id.get(entry.superseded_by)
+            if newer is None:
+                break
+            entry = newer
+        return entry
+
+    def current(self):
+        """Entries that nothing in the catalog supersedes."""
+        return [e for e in self.entries if not (e.superseded_by and e.superseded_by in self.by_id)]
+
+    def mirrors_for(self, entry):
+        """Entry mirrors first, then catalog-wide ones, without repeats."""
+        return tuple(dict.fromkeys(entry.mirrors + self.mirrors))
+
+
+def variants(entry):
+    """Files to try for an entry: compressed variants first, then the plain ISO."""
+    return entry.compressed + (entry.file,)
+
+
+def preferred_digest(entry):
+    """Return (algorithm, hexdigest) of the strongest inline digest, or (None, None)."""
+    for algorithm in DIGEST_PREFERENCE:
+        if algorithm in entry.digests:
+            return algorithm, entry.digests[algorithm]
+    for algorithm, value in entry.digests.items():
+        return algorithm, value
+    return None, None
+
+
+def load(data):
+    """Compile a parsed catalog of any schema version."""
+    if not isinstance(data, dict):
+        raise CatalogError("catalog must be a JSON object")
+    schema = data.get("schema", 1)
+    if not isinstance(schema, int) or schema > SCHEMA_VERSION:
+        raise CatalogError(f"unsupported catalog schema {schema!r}")
+    isos = data.get("isos")
+    if not isinstance(isos, list):
+        raise CatalogError("catalog has no isos list")
+    entries = [_compile(raw, i, schema) for i, raw in enumerate(isos)]
+    return Catalog(entries, _mirror_list(data.get("mirrors"), "mirrors"), schema)
+
+
+def loads(text):
+    try:
+        return load(json.loads(text))
+    except json.JSONDecodeError as e:
+        raise CatalogError(f"catalog is not valid JSON: {e}") from None
+
+
+def fetch(source, fallback=True):
+    """Fetch and compile the catalog from a source.
+
+    With fallback, an unreachable or broken catalog yields FALLBACK so the
+    frontends still have something to list. The fetch is hedged (hedged.py)
+    so one slow mirror does not hold up the UI.
+    """
+    try:
+        return load(hedged.fetch_catalog(source))
+    except (OSError, ValueError):
+        if not fallback:
+            raise
+        return load(FALLBACK)
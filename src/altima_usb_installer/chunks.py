@@ -0,0 +1,221 @@
+"""Chunk-level integrity: find the damaged ranges of a file and re-fetch only those.
+
+A Manifest lists one digest per fixed-size chunk. It comes from the catalog
+entry, from a "<file>.chunks" sidecar next to the ISO, or from the
+DigestRecorder that hashed the data while it was written. check() hashes
+chunks on a thread pool, each thread reading into its own reusable buffer
+(hashlib releases the GIL on large buffers, so this spreads across cores),
+and repair() fetches only the failing ranges with
+Range requests, rewrites them in place and checks them again.
+
+Mirror operators can publish sidecars with:
+
+    python -m altima_usb_installer.chunks make FILE.iso [...]
+"""
+import hashlib
+import json
+import os
+import sys
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from altima_usb_installer import hashing, hedged, transfer, verify
+
+SIDECAR_SUFFIX = ".chunks"
+DEFAULT_CHUNK_SIZE = verify.BLOCK_SIZE
+DEFAULT_ALGORITHM = verify.BLOCK_ALGORITHM
+DEFAULT_DIGEST_SIZE = 16
+MAX_ROUNDS = 3
+
+Manifest = namedtuple("Manifest", "size chunk_size algorithm digests")
+
+
+def chunk_hash(algorithm, digest_size):
+    if algorithm in ("blake2b", "blake2s"):
+        return hashlib.new(algorithm, digest_size=digest_size)
+    return hashlib.new(algorithm)
+
+
+def chunk_span(manifest, index):
+    start = index * manifest.chunk_size
+    return start, min(manifest.chunk_size, manifest.size - start)
+
+
+def from_entry(entry):
+    """Manifest from a catalog entry, or None if it carries no usable chunk list."""
+    if not entry.chunks or entry.size is None:
+        return None
+    return Manifest(entry.size, entry.chunk_size, entry.chunk_algorithm, tuple(entry.chunks))
+
+
+def from_recorder(recorder):
+    """Manifest of what was actually written, for checking the copy on the stick."""
+    return Manifest(recorder.size, recorder.block_size, verify.BLOCK_ALGORITHM,
+                    tuple(recorder.block_digests))
+
+
+def loads(text):
+    data = json.loads(text)
+    try:
+        manifest = Manifest(
+            int(data["size"]), int(data["chunk_size"]), data.get("algorithm", DEFAULT_ALGORITHM),
+            tuple(bytes.fromhex(d) for d in data["digests"])
+        )
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError(f"bad chunk manifest: {e}") from None
+    if manifest.chunk_size <= 0 or len(manifest.digests) != -(-manifest.size // manifest.chunk_size):
+        raise ValueError("bad chunk manifest: digests do not cover the file")
+    return manifest
+
+
+def dumps(manifest):
+    return json.dumps({
+        "size": manifest.size,
+        "chunk_size": manifest.chunk_size,
+        "algorithm": manifest.algorithm,
+        "digests": [d.hex() for d in manifest.digests],
+    }, indent=1)
+
+
+def fetch_sidecar(source, name):
+    try:
+        return loads(hedged.fetch_bytes(source, name + SIDECAR_SUFFIX))
+    except (OSError, ValueError):
+        return None
+
+
+def for_entry(entry, source):
+    """The catalog's chunk list, else the sidecar published next to the file."""
+    return from_entry(entry) or fetch_sidecar(source, entry.file)
+
+
+class _Buffers(threading.local):
+    """One reusable read buffer per pool thread."""
+
+    def get(self, size):
+        buf = getattr(self, "buf", None)
+        if buf is None or len(buf) < size:
+            buf = self.buf = bytearray(size)
+        return buf
+
+
+def _digest(fd, buffers, algorithm, digest_size, start, length):
+    buf = buffers.get(length)
+    n = hashing.read_block(fd, memoryview(buf)[:length], start)
+    h = chunk_hash(algorithm, digest_size)
+    h.update(memoryview(buf)[:n])
+    return h.digest()
+
+
+def make(path, chunk_size=DEFAULT_CHUNK_SIZE, algorithm=DEFAULT_ALGORITHM,
+         digest_size=DEFAULT_DIGEST_SIZE, workers=None):
+    """Hash path into a Manifest, chunks in parallel."""
+    size = os.path.getsize(path)
+    fd = os.open(path, os.O_RDONLY)
+    buffers = _Buffers()
+
+    def digest(index):
+        start = index * chunk_size
+        return _digest(fd, buffers, algorithm, digest_size, start, min(chunk_size, size - start))
+
+    try:
+        with ThreadPoolExecutor(workers or os.cpu_count()) as pool:
+            digests = tuple(pool.map(digest, range(-(-size // chunk_size))))
+    finally:
+        os.close(fd)
+    return Manifest(size, chunk_size, algorithm, digests)
+
+
+def check(path, manifest, indices=None, workers=None, uncached=False, progress=None):
+    """Return the sorted indices of chunks whose data does not match the manifest.
+
+    With uncached the file's cached pages are dropped first, so a copy on a
+    USB stick is read back from the stick. progress is called as
+    progress(chunks_checked, chunks_to_check).
+    """
+    if indices is None:
+        indices = range(len(manifest.digests))
+    indices = list(indices)
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        if uncached:
+            hashing.drop_cache(fd)
+        size = os.fstat(fd).st_size
+        buffers = _Buffers()
+
+        def matches(index):
+            start, length = chunk_span(manifest, index)
+            if start + length > size:
+                return False
+            expected = manifest.digests[index]
+            return _digest(fd, buffers, manifest.algorithm, len(expected), start, length) == expected
+
+        bad = []
+        with ThreadPoolExecutor(workers or os.cpu_count()) as pool:
+            for done, (index, ok) in enumerate(zip(indices, pool.map(matches, indices)), 1):
+                if not ok:
+                    bad.append(index)
+                if progress:
+                    progress(done, len(indices))
+    finally:
+        os.close(fd)
+    return sorted(bad)
+
+
+def repair(path, manifest, source, name, bad, rounds=MAX_ROUNDS, progress=None):
+    """Re-fetch the bad chunks of path from source and rewrite them in place.
+
+    Each round fetches every chunk still failing with a Range request and
+    checks it again from the device. Returns the indices still bad after
+    the last round (empty on success). progress is called as
+    progress(chunks_fetched, chunks_to_fetch).
+    """
+    bad = sorted(bad)
+    fd = os.open(path, os.O_RDWR)
+    try:
+        if os.fstat(fd).st_size != manifest.size:
+            os.ftruncate(fd, manifest.size)
+        for _ in range(rounds):
+            if not bad:
+                break
+            for done, index in enumerate(bad, 1):
+                start, length = chunk_span(manifest, index)
+                try:
+                    with transfer.open_resumable(source, name, start, length) as stream:
+                        pos = start
+                        for data in stream.iter_chunks():
+                            data = data[:start + length - pos]
+                            view = memoryview(data)
+                            while view:
+                                n = os.pwrite(fd, view, pos)
+                                view = view[n:]
+                                pos += n
+                            if pos >= start + length:
+                                break
+                except OSError:
+                    # Left bad; the next round or the caller deals with it
+                    pass
+                if progress:
+                    progress(done, len(bad))
+            os.fsync(fd)
+            bad = check(path, manifest, bad, uncached=True)
+    finally:
+        os.close(fd)
+    return bad
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) < 2 or argv[0] != "make":
+        print("usage: python -m altima_usb_installer.chunks make FILE [FILE ...]", file=sys.stderr)
+        return 2
+    for path in argv[1:]:
+        with open(path + SIDECAR_SUFFIX, "w") as f:
+            f.write(dumps(make(path)))
+        print(f"{path}{SIDECAR_SUFFIX}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
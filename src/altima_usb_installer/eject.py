@@ -0,0 +1,236 @@
+"""Flush, unmount and power off USB sticks on Linux.
+
+Ejecting goes through UDisks2 over D-Bus when GObject introspection is
+available and falls back to umount2(2), the BLKFLSBUF ioctl and the SCSI
+sysfs "delete" knob otherwise. eject_all() releases a batch of sticks
+concurrently, so each stick only waits for its own dirty data.
+unmount_disk() does the unmounting alone, for writers that need the disk
+to themselves.
+"""
+import ctypes
+import ctypes.util
+import os
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Windows; flushing and ejecting are Linux-only
+
+from altima_usb_installer import mounts
+
+try:
+    from gi.repository import Gio, GLib
+except ImportError:
+    Gio = None
+
+MEMINFO = "/proc/meminfo"
+BLKFLSBUF = 0x1261
+
+UDISKS_BUS = "org.freedesktop.UDisks2"
+UDISKS_BLOCK_PATH = "/org/freedesktop/UDisks2/block_devices/"
+
+EjectResult = namedtuple("EjectResult", "target disk ok method error")
+
+_libc = None
+
+
+def _get_libc():
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    return _libc
+
+
+def read_dirty_kb(path=MEMINFO):
+    """Return Dirty + Writeback from /proc/meminfo in kB."""
+    total = 0
+    with open(path) as f:
+        for line in f:
+            if line.startswith(("Dirty:", "Writeback:")):
+                total += int(line.split()[1])
+    return total
+
+
+def read_write_stats(disk, sys_block=mounts.SYS_BLOCK):
+    """Return (sectors written, requests in flight) from /sys/block/<disk>/stat."""
+    try:
+        with open(os.path.join(sys_block, disk, "stat")) as f:
+            fields = f.read().split()
+        return int(fields[6]), int(fields[8])
+    except (OSError, IndexError, ValueError):
+        return 0, 0
+
+
+def _syncfs(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        libc = _get_libc()
+        if libc.syncfs(fd) != 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+    finally:
+        os.close(fd)
+
+
+def flush_disk(disk, mountpoints, progress=None, interval=0.25):
+    """Write back everything cached for the given mounts, reporting progress.
+
+    The dirty counters in /proc/meminfo are system wide, so when several
+    sticks flush at once each one reports the shared remainder.
+    """
+    done = threading.Event()
+    errors = []
+
+    def run():
+        try:
+            for mountpoint in mountpoints:
+                _syncfs(mountpoint)
+        except OSError as e:
+            errors.append(e)
+        finally:
+            done.set()
+
+    threading.Thread(target=run, daemon=True).start()
+
+    start_dirty = max(read_dirty_kb(), 1)
+    start_sectors, _ = read_write_stats(disk)
+    while not done.wait(interval):
+        if progress:
+            dirty = read_dirty_kb()
+            sectors, inflight = read_write_stats(disk)
+            fraction = min(max(1 - dirty / start_dirty, 0.0), 0.99)
+            written_mb = (sectors - start_sectors) * 512 / (1024 * 1024)
+            progress(disk, fraction,
+                     f"Flushing {disk}... {written_mb:.0f} MB written, "
+                     f"{dirty // 1024} MB pending, {inflight} requests in flight")
+    if errors:
+        raise errors[0]
+    if progress:
+        progress(disk, 1.0, f"{disk} flushed")
+
+
+def _udisks_object_path(name):
+    # UDisks2 escapes every byte outside [A-Za-z0-9] as _xx
+    escaped = "".join(c if c.isascii() and c.isalnum() else f"_{ord(c):02x}" for c in name)
+    return UDISKS_BLOCK_PATH + escaped
+
+
+def _udisks_call(bus, object_path, interface, method, args):
+    return bus.call_sync(
+        UDISKS_BUS, object_path, interface, method, args,
+        None, Gio.DBusCallFlags.NONE, -1, None
+    )
+
+
+def _unmount_udisks(bus, entries):
+    for entry in entries:
+        name = mounts.block_name(entry.devnum, entry.source)
+        _udisks_call(
+            bus, _udisks_object_path(name), "org.freedesktop.UDisks2.Filesystem",
+            "Unmount", GLib.Variant("(a{sv})", ({},))
+        )
+
+
+def _unmount_direct(entries):
+    libc = _get_libc()
+    for entry in sorted(entries, key=lambda e: len(e.mountpoint), reverse=True):
+        if libc.umount2(os.fsencode(entry.mountpoint), 0) != 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), entry.mountpoint)
+
+
+def _eject_udisks(disk, entries):
+    bus = Gio.bus_get_sync(Gio.BusType.SYSTEM, None)
+    _unmount_udisks(bus, entries)
+    reply = _udisks_call(
+        bus, _udisks_object_path(disk), "org.freedesktop.DBus.Properties",
+        "Get", GLib.Variant("(ss)", ("org.freedesktop.UDisks2.Block", "Drive"))
+    )
+    drive = reply.unpack()[0]
+    if drive == "/":
+        raise OSError(f"UDisks2 has no drive object for {disk}")
+    _udisks_call(
+        bus, drive, "org.freedesktop.UDisks2.Drive",
+        "PowerOff", GLib.Variant("(a{sv})", ({},))
+    )
+
+
+def _eject_direct(disk, entries, sys_block=mounts.SYS_BLOCK):
+    _unmount_direct(entries)
+
+    fd = os.open(f"/dev/{disk}", os.O_RDONLY)
+    try:
+        os.fsync(fd)
+        fcntl.ioctl(fd, BLKFLSBUF)
+    finally:
+        os.close(fd)
+
+    with open(os.path.join(sys_block, disk, "device", "delete"), "w") as f:
+        f.write("1")
+
+
+def eject_disk(target, progress=None):
+    """Flush, unmount and power off the disk behind target.
+
+    target may be a device node, a disk name, a scan row or any path on
+    the mounted stick. Raises OSError if the stick could not be released.
+    """
+    disk = mounts.disk_for_target(target)
+    if not disk:
+        raise OSError(f"Cannot resolve a block device for {target}")
+
+    entries = mounts.disk_mounts(disk)
+    flush_disk(disk, [e.mountpoint for e in entries], progress)
+
+    if Gio is not None:
+        try:
+            _eject_udisks(disk, entries)
+            return EjectResult(target, disk, True, "udisks", None)
+        except (GLib.Error, OSError):
+            # Fall through to the direct path, e.g. without a system bus or
+            # for a stick UDisks2 has no drive object for
+            entries = mounts.disk_mounts(disk)
+
+    _eject_direct(disk, entries)
+    return EjectResult(target, disk, True, "direct", None)
+
+
+def unmount_disk(target):
+    """Unmount every partition of the disk behind target, leaving it powered.
+
+    UDisks2 lets a desktop user unmount what the desktop mounted, so it is
+    tried first. Returns the disk name; raises OSError if anything stays
+    mounted.
+    """
+    disk = mounts.disk_for_target(target)
+    if not disk:
+        raise OSError(f"Cannot resolve a block device for {target}")
+    entries = mounts.disk_mounts(disk)
+    if entries and Gio is not None:
+        try:
+            _unmount_udisks(Gio.bus_get_sync(Gio.BusType.SYSTEM, None), entries)
+        except GLib.Error:
+            pass
+        entries = mounts.disk_mounts(disk)
+    if entries:
+        _unmount_direct(entries)
+    return disk
+
+
+def eject_all(targets, progress=None, max_workers=None):
+    """Eject several sticks concurrently; returns EjectResults in input order."""
+    targets = list(targets)
+    if not targets:
+        return []
+
+    def run(target):
+        try:
+            return eject_disk(target, progress)
+        except Exception as e:
+            return EjectResult(target, mounts.disk_for_target(target), False, None, str(e))
+
+    with ThreadPoolExecutor(max_workers=max_workers or len(targets)) as pool:
+        return list(pool.map(run, targets))
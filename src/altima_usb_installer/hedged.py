@@ -0,0 +1,223 @@
+"""Hedged fetches for small resources: the catalog, checksum files, sidecars.
+
+A small fetch that has not answered within the usual time is most likely
+stuck behind a slow mirror or a dead connection rather than still coming.
+Instead of waiting out the whole timeout, a duplicate request goes to the
+next source in the chain (or, with a single mirror, to the same one over a
+new connection) once the first has taken longer than the HEDGE_PERCENTILE
+latency of recent fetches. Whichever answers first wins; the others are
+cancelled. A source that fails outright is replaced at once, as in
+SourceList.
+
+stats() reports how often requests were hedged and which attempt won.
+
+    python -m altima_usb_installer.hedged [--repeat N] [NAME ...]
+"""
+import argparse
+import json
+import queue
+import sys
+import threading
+import time
+from collections import deque, namedtuple
+
+import requests
+
+from altima_usb_installer import sources
+
+HEDGE_PERCENTILE = 0.95
+LATENCY_WINDOW = 100
+# Until this many fetches have been timed, hedge after DEFAULT_DELAY
+MIN_SAMPLES = 8
+DEFAULT_DELAY = 1.0
+MIN_DELAY = 0.05
+MAX_HEDGES = 2
+READ_SIZE = 64 * 1024
+
+HedgeStats = namedtuple(
+    "HedgeStats", "requests hedged hedge_rate primary_wins hedge_wins failures delay"
+)
+
+
+class Hedger:
+    """Runs attempts at one resource, adding hedges as they overrun; thread-safe."""
+
+    def __init__(self, percentile=HEDGE_PERCENTILE, window=LATENCY_WINDOW, max_hedges=MAX_HEDGES):
+        self.percentile = percentile
+        self.max_hedges = max_hedges
+        self.latencies = deque(maxlen=window)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.hedged = 0
+        self.primary_wins = 0
+        self.hedge_wins = 0
+        self.failures = 0
+
+    def delay(self):
+        """Seconds to wait for an attempt before hedging it."""
+        with self.lock:
+            samples = sorted(self.latencies)
+        if len(samples) < MIN_SAMPLES:
+            return DEFAULT_DELAY
+        return max(MIN_DELAY, samples[min(len(samples) - 1, int(len(samples) * self.percentile))])
+
+    def _record(self, hedges, won_by_hedge=None, latency=None):
+        with self.lock:
+            self.requests += 1
+            self.hedged += bool(hedges)
+            if won_by_hedge is None:
+                self.failures += 1
+            elif won_by_hedge:
+                self.hedge_wins += 1
+            else:
+                self.primary_wins += 1
+            if latency is not None:
+                self.latencies.append(latency)
+
+    def run(self, attempts):
+        """Return the first successful result of attempts, a list of (label, fn).
+
+        fn(cancelled) does one attempt and should give up once the
+        threading.Event cancelled is set. Raises SourceError listing every
+        failure if no attempt succeeds.
+        """
+        if not attempts:
+            raise sources.SourceError("No sources configured")
+        results = queue.Queue()
+        cancelled = threading.Event()
+        errors = []
+        hedges = set()
+        launched = running = 0
+
+        def launch():
+            nonlocal launched, running
+            index = launched
+            label, fn = attempts[index]
+            started = time.monotonic()
+            launched += 1
+            running += 1
+
+            def work():
+                try:
+                    results.put((index, started, None, fn(cancelled)))
+                except (OSError, ValueError, requests.RequestException) as e:
+                    results.put((index, started, e, None))
+
+            threading.Thread(target=work, daemon=True).start()
+
+        launch()
+        try:
+            while running:
+                spare = len(hedges) < self.max_hedges and launched < len(attempts)
+                try:
+                    index, started, error, value = results.get(timeout=self.delay() if spare else None)
+                except queue.Empty:
+                    hedges.add(launched)
+                    launch()
+                    continue
+                running -= 1
+                if error is None:
+                    self._record(hedges, index in hedges, time.monotonic() - started)
+                    return value
+                errors.append(f"{attempts[index][0]}: {error}")
+                if launched < len(attempts):
+                    launch()
+        finally:
+            cancelled.set()
+        self._record(hedges)
+        raise sources.SourceError("; ".join(errors))
+
+    def stats(self):
+        with self.lock:
+            requests_, hedged = self.requests, self.hedged
+            primary_wins, hedge_wins, failures = self.primary_wins, self.hedge_wins, self.failures
+        return HedgeStats(
+            requests=requests_,
+            hedged=hedged,
+            hedge_rate=hedged / requests_ if requests_ else 0.0,
+            primary_wins=primary_wins,
+            hedge_wins=hedge_wins,
+            failures=failures,
+            delay=self.delay(),
+        )
+
+
+HEDGER = Hedger()
+
+
+def _get(source, name, timeout, cancelled):
+    """Fetch name from an HttpSource, dropping the connection once cancelled."""
+    r = source.session.get(source.url(name), stream=True, timeout=timeout)
+    with r:
+        r.raise_for_status()
+        body = bytearray()
+        for chunk in r.iter_content(READ_SIZE):
+            if cancelled.is_set():
+                raise sources.SourceError(f"{source.url(name)}: cancelled")
+            body += chunk
+    return bytes(body)
+
+
+def _attempts(source, name, timeout, catalog):
+    chain = list(source.sources) if isinstance(source, sources.SourceList) else [source]
+    remote = [s for s in chain if isinstance(s, sources.HttpSource)]
+    if len(remote) == 1:
+        # A single mirror: hedge on a second connection to it
+        chain.append(sources.HttpSource(remote[0].base_url))
+
+    def attempt(s):
+        if not isinstance(s, sources.HttpSource):
+            if catalog:
+                return lambda cancelled: s.fetch_catalog(timeout)
+            return lambda cancelled: s.fetch_bytes(name, timeout)
+        if catalog:
+            return lambda cancelled: json.loads(_get(s, name, timeout, cancelled))
+        return lambda cancelled: _get(s, name, timeout, cancelled)
+
+    return [(repr(s), attempt(s)) for s in chain]
+
+
+def fetch_bytes(source, name, timeout=5, hedger=None):
+    """source.fetch_bytes(name), hedged across the source's chain."""
+    return (hedger or HEDGER).run(_attempts(source, name, timeout, catalog=False))
+
+
+def fetch_catalog(source, timeout=5, hedger=None):
+    """source.fetch_catalog(), hedged across the source's chain."""
+    return (hedger or HEDGER).run(_attempts(source, sources.CATALOG_NAME, timeout, catalog=True))
+
+
+def stats():
+    return HEDGER.stats()
+
+
+def format_stats(stats):
+    return (f"{stats.requests} small fetches, {stats.hedge_rate:.0%} hedged; "
+            f"wins: {stats.primary_wins} first try, {stats.hedge_wins} hedge; "
+            f"{stats.failures} failed; hedging after {stats.delay * 1000:.0f} ms")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m altima_usb_installer.hedged")
+    parser.add_argument("names", nargs="*", metavar="NAME",
+                        help="files to fetch (default: the catalog)")
+    parser.add_argument("--repeat", type=int, default=1)
+    args, rest = parser.parse_known_args(argv)
+    source = sources.configured(rest)
+    status = 0
+    for _ in range(args.repeat):
+        for name in args.names or [sources.CATALOG_NAME]:
+            try:
+                if name == sources.CATALOG_NAME:
+                    fetch_catalog(source)
+                else:
+                    fetch_bytes(source, name)
+            except sources.SourceError as e:
+                print(f"{name}: {e}", file=sys.stderr)
+                status = 1
+    print(format_stats(stats()))
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
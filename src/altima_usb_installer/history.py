@@ -0,0 +1,249 @@
+"""Local performance history: how fast each mirror, stick and host has been.
+
+Every download, write and verify is logged to history.db (SQLite, in the
+state directory) with the mirror, ISO, stick model and serial, and host it
+involved, its size, duration and whether it failed. The installer uses the
+log to try the mirrors that have been fastest here first, to estimate how
+long a job will take before it starts, and how long a batch of sticks
+will take at a station.
+
+    python -m altima_usb_installer.history [--by mirror|iso|model|serial|host] [--kind KIND]
+    python -m altima_usb_installer.history --eta SIZE_MIB [--mirror URL] [--model MODEL]
+                                           [--sticks N] [--workers N]
+"""
+import argparse
+import math
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+from collections import namedtuple
+
+from altima_usb_installer import sources
+
+DB_NAME = "history.db"
+# Rates are worked out from this many of the latest successful transfers
+RECENT = 20
+
+DOWNLOAD = "download"
+WRITE = "write"
+VERIFY = "verify"
+
+GROUPS = {"mirror": "mirror", "iso": "iso", "model": "device_model",
+          "serial": "device_serial", "host": "host"}
+
+Summary = namedtuple("Summary", "key count failures bytes seconds throughput")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS transfers (
+    id INTEGER PRIMARY KEY,
+    started REAL NOT NULL,
+    kind TEXT NOT NULL,
+    mirror TEXT,
+    iso TEXT,
+    device_model TEXT,
+    device_serial TEXT,
+    host TEXT NOT NULL,
+    bytes INTEGER NOT NULL,
+    seconds REAL NOT NULL,
+    ok INTEGER NOT NULL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS transfers_mirror ON transfers (kind, mirror);
+CREATE INDEX IF NOT EXISTS transfers_device ON transfers (kind, device_model);
+"""
+
+
+def db_path():
+    return os.path.join(sources.state_dir(), DB_NAME)
+
+
+def mirror_key(source):
+    """How a source is named in the history: its base URL."""
+    return source.url("") if source is not None else None
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return "unknown"
+    minutes, seconds = divmod(int(seconds + 0.5), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m" if hours else f"{minutes}m{seconds:02d}s"
+
+
+class History:
+    """The transfer log; safe to share between threads."""
+
+    def __init__(self, path=None):
+        self.path = path or db_path()
+        self.lock = threading.Lock()
+        self.host = socket.gethostname()
+        self.db = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+        with self.lock, self.db:
+            self.db.executescript(SCHEMA)
+
+    def record(self, kind, size, seconds, ok=True, error=None, mirror=None, iso=None,
+               device_model=None, device_serial=None):
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT INTO transfers (started, kind, mirror, iso, device_model, device_serial,"
+                " host, bytes, seconds, ok, error) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (time.time() - seconds, kind, mirror, iso, device_model, device_serial,
+                 self.host, size, seconds, int(ok), str(error) if error else None),
+            )
+
+    def timed(self, kind, **keys):
+        """Context manager logging one transfer; set .bytes on it as data moves."""
+        return _Timed(self, kind, keys)
+
+    def rate(self, kind, **keys):
+        """Bytes per second over the latest successful matching transfers, or None.
+
+        keys narrow the match (mirror=, iso=, device_model=, device_serial=,
+        host=); None values are ignored.
+        """
+        where = ["kind = ?", "ok = 1", "seconds > 0"]
+        args = [kind]
+        for column, value in keys.items():
+            if value is not None:
+                where.append(f"{column} = ?")
+                args.append(value)
+        with self.lock:
+            rows = self.db.execute(
+                f"SELECT bytes, seconds FROM transfers WHERE {' AND '.join(where)}"
+                " ORDER BY started DESC LIMIT ?", args + [RECENT],
+            ).fetchall()
+        seconds = sum(s for _, s in rows)
+        return sum(b for b, _ in rows) / seconds if seconds else None
+
+    def best_rate(self, kind, **keys):
+        """rate() for the most specific keys that have history, dropping them
+        from the right until something matches."""
+        items = list(keys.items())
+        while True:
+            rate = self.rate(kind, **dict(items))
+            if rate is not None or not items:
+                return rate
+            items.pop()
+
+    def reliability(self, kind, mirror):
+        """Share of the latest matching transfers that succeeded, or None."""
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT ok FROM transfers WHERE kind = ? AND mirror = ?"
+                " ORDER BY started DESC LIMIT ?", (kind, mirror, RECENT),
+            ).fetchall()
+        return sum(ok for ok, in rows) / len(rows) if rows else None
+
+    def summary(self, by="mirror", kind=None):
+        column = GROUPS[by]
+        where, args = ("WHERE kind = ?", [kind]) if kind else ("", [])
+        with self.lock:
+            rows = self.db.execute(
+                f"SELECT {column}, COUNT(*), SUM(1 - ok), SUM(bytes * ok), SUM(seconds * ok)"
+                f" FROM transfers {where} GROUP BY {column} ORDER BY {column}", args,
+            ).fetchall()
+        return [Summary(key, count, failures, size or 0, seconds or 0.0,
+                        size / seconds if seconds else None)
+                for key, count, failures, size, seconds in rows]
+
+    def order(self, source):
+        """source with its mirrors that have download history fastest first.
+
+        A mirror's rate is scaled by how often it succeeded. Sources without
+        history keep their place, so the cache and LAN peers stay in front;
+        a source that is not a chain comes back as is.
+        """
+        if not isinstance(source, sources.SourceList):
+            return source
+        rates = {}
+        for s in source.sources:
+            if isinstance(s, sources.HttpSource):
+                rate = self.rate(DOWNLOAD, mirror=mirror_key(s))
+                if rate is not None:
+                    rates[id(s)] = rate * self.reliability(DOWNLOAD, mirror_key(s))
+        known = [s for s in source.sources if rates.get(id(s)) is not None]
+        ranked = iter(sorted(known, key=lambda s: rates[id(s)], reverse=True))
+        return sources.SourceList(
+            next(ranked) if rates.get(id(s)) is not None else s for s in source.sources
+        )
+
+    def eta(self, size, kinds=(DOWNLOAD,), mirror=None, iso=None, device_model=None):
+        """Seconds to move size bytes through each of kinds in turn, or None
+        if one of them has no history at all."""
+        total = 0.0
+        for kind in kinds:
+            if kind == DOWNLOAD:
+                rate = self.best_rate(kind, mirror=mirror, device_model=device_model, iso=iso)
+            else:
+                rate = self.best_rate(kind, device_model=device_model)
+            if not rate:
+                return None
+            total += size / rate
+        return total
+
+    def batch_eta(self, size, sticks, workers, kinds=(WRITE, VERIFY), device_model=None):
+        """Seconds for sticks sticks of size bytes each, workers at a time.
+
+        Assumes each stick moves at its model's usual rate however many run
+        at once, so shared hubs make the real time longer.
+        """
+        per_stick = self.eta(size, kinds, device_model=device_model)
+        if per_stick is None or not sticks:
+            return None
+        return math.ceil(sticks / max(1, min(workers, sticks))) * per_stick
+
+    def close(self):
+        self.db.close()
+
+
+class _Timed:
+    def __init__(self, history, kind, keys):
+        self.history = history
+        self.kind = kind
+        self.keys = keys
+        self.bytes = 0
+
+    def __enter__(self):
+        self.started = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.history.record(self.kind, self.bytes, time.monotonic() - self.started,
+                            ok=exc_type is None, error=exc, **self.keys)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m altima_usb_installer.history")
+    parser.add_argument("--by", choices=sorted(GROUPS), default="mirror")
+    parser.add_argument("--kind", choices=(DOWNLOAD, WRITE, VERIFY))
+    parser.add_argument("--eta", type=float, metavar="SIZE_MIB",
+                        help="estimate a job of this size instead of listing")
+    parser.add_argument("--mirror")
+    parser.add_argument("--model")
+    parser.add_argument("--sticks", type=int, default=1)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args(argv)
+    history = History()
+    try:
+        if args.eta is not None:
+            size = int(args.eta * 2**20)
+            download = history.eta(size, (DOWNLOAD,), mirror=args.mirror, device_model=args.model)
+            per_stick = history.eta(size, (WRITE, VERIFY), device_model=args.model)
+            batch = history.batch_eta(size, args.sticks, args.workers, device_model=args.model)
+            print(f"download:  {format_duration(download)}")
+            print(f"per stick: {format_duration(per_stick)} (write and verify)")
+            print(f"{args.sticks} sticks, {args.workers} at a time: {format_duration(batch)}")
+            return 0
+        for s in history.summary(args.by, args.kind):
+            rate = f"{s.throughput / 1e6:8.1f} MB/s" if s.throughput else "       - MB/s"
+            print(f"{rate}  {s.count:5d} runs  {s.failures:3d} failed  {s.key or '-'}")
+    finally:
+        history.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
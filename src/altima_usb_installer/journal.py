@@ -0,0 +1,177 @@
+"""Crash-safe job journal: pick interrupted work up from the last durable byte.
+
+An append-only JSON-lines file (journal.jsonl in sources.state_dir()) gets
+one fsynced record per event: a job submitted, a stage started, bytes of a
+target committed (logged only after the target itself was fsynced), byte
+ranges of a target verified, the job finished. Replaying it after a crash
+or reboot gives every unfinished job with its stage and how far each
+target got, so the work resumes there instead of starting over. A torn
+last line from a crash mid-append is skipped, and compact() rewrites the
+file with just the unfinished jobs.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from collections import namedtuple
+
+from altima_usb_installer import sources
+
+JOURNAL_NAME = "journal.jsonl"
+# fsync the target and log progress after this many new bytes
+COMMIT_INTERVAL = 64 * 1024 * 1024
+
+JobRecord = namedtuple("JobRecord", "key device isos mode stage stage_name committed verified")
+
+
+def journal_path():
+    return os.path.join(sources.state_dir(), JOURNAL_NAME)
+
+
+def new_key():
+    return uuid.uuid4().hex
+
+
+def _merge(ranges, start, end):
+    """Add [start, end) to a sorted list of disjoint ranges."""
+    merged = []
+    for a, b in sorted(ranges + [[start, end]]):
+        if merged and a <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], b)
+        else:
+            merged.append([a, b])
+    return merged
+
+
+def replay(path):
+    """Return the unfinished jobs recorded in path, oldest first."""
+    jobs = {}
+    try:
+        f = open(path, encoding="utf-8")
+    except FileNotFoundError:
+        return []
+    with f:
+        for line in f:
+            try:
+                record = json.loads(line)
+                key = record["job"]
+                event = record["event"]
+            except (ValueError, KeyError, TypeError):
+                # A crash mid-append leaves at most one torn line
+                continue
+            if event == "submit":
+                jobs[key] = {
+                    "device": record["device"], "isos": tuple(record["isos"]),
+                    "mode": record["mode"], "stage": 0, "stage_name": None,
+                    "committed": {}, "verified": {},
+                }
+            elif key not in jobs:
+                continue
+            elif event == "stage":
+                jobs[key]["stage"] = record["index"]
+                jobs[key]["stage_name"] = record.get("name")
+            elif event == "commit":
+                jobs[key]["committed"][record["target"]] = record["offset"]
+            elif event == "verify":
+                verified = jobs[key]["verified"]
+                verified[record["target"]] = _merge(verified.get(record["target"], []),
+                                                    record["start"], record["end"])
+            elif event == "end":
+                del jobs[key]
+    return [JobRecord(key, **job) for key, job in jobs.items()]
+
+
+class Journal:
+    """Appends durable records; safe to share between worker threads."""
+
+    def __init__(self, path=None):
+        self.path = path or journal_path()
+        self.lock = threading.Lock()
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def _append(self, key, event, **fields):
+        line = json.dumps(dict(fields, job=key, event=event, time=time.time())) + "\n"
+        with self.lock:
+            os.write(self._fd, line.encode("utf-8"))
+            os.fsync(self._fd)
+
+    def submitted(self, key, device, isos, mode):
+        self._append(key, "submit", device=device, isos=list(isos), mode=mode)
+
+    def stage(self, key, index, name):
+        self._append(key, "stage", index=index, name=name)
+
+    def committed(self, key, target, offset):
+        self._append(key, "commit", target=target, offset=offset)
+
+    def verified(self, key, target, start, end):
+        self._append(key, "verify", target=target, start=start, end=end)
+
+    def finished(self, key, ok, error=None):
+        self._append(key, "end", ok=ok, error=error)
+
+    def unfinished(self):
+        with self.lock:
+            return replay(self.path)
+
+    def compact(self):
+        """Rewrite the journal with only the unfinished jobs' current state."""
+        with self.lock:
+            records = replay(self.path)
+            part = self.path + ".part"
+            with open(part, "w", encoding="utf-8") as f:
+                for r in records:
+                    lines = [dict(event="submit", device=r.device, isos=list(r.isos), mode=r.mode),
+                             dict(event="stage", index=r.stage, name=r.stage_name)]
+                    lines += [dict(event="commit", target=t, offset=o) for t, o in r.committed.items()]
+                    lines += [dict(event="verify", target=t, start=a, end=b)
+                              for t, ranges in r.verified.items() for a, b in ranges]
+                    for line in lines:
+                        f.write(json.dumps(dict(line, job=r.key)) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(part, self.path)
+            os.close(self._fd)
+            self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def close(self):
+        os.close(self._fd)
+
+
+class Checkpoint:
+    """update() callback that makes a target's progress durable as it is written.
+
+    Every COMMIT_INTERVAL bytes the file is flushed and fsynced, then the
+    offset is journalled, so a logged offset is always on the device.
+    """
+
+    def __init__(self, journal, key, target, f, offset=0, interval=COMMIT_INTERVAL):
+        self.journal = journal
+        self.key = key
+        self.target = target
+        self.f = f
+        self.offset = offset
+        self.interval = interval
+        self._last = offset
+
+    def __call__(self, data):
+        self.offset += len(data)
+        if self.offset - self._last >= self.interval:
+            self.commit()
+
+    def commit(self):
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self._last = self.offset
+        if self.journal is not None:
+            self.journal.committed(self.key, self.target, self.offset)
+
+
+def resume_offset(record, target):
+    """Bytes of target known to be on the device, or 0 if it cannot be trusted."""
+    offset = record.committed.get(target, 0) if record else 0
+    try:
+        return offset if offset and os.path.getsize(target) >= offset else 0
+    except OSError:
+        return 0
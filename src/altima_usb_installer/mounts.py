@@ -0,0 +1,212 @@
+"""Resolve Ventoy data partitions and their mountpoints on Linux.
+
+Everything here is answered from /proc/self/mountinfo, /sys/class/block and
+the /dev/disk/by-* symlinks, so a lookup costs O(mounts + partitions) and
+never touches the files on a mounted stick.
+"""
+import os
+import re
+from collections import namedtuple
+
+MOUNTINFO = "/proc/self/mountinfo"
+SYS_BLOCK = "/sys/class/block"
+SYS_DEV_BLOCK = "/sys/dev/block"
+DEV_DISK = "/dev/disk"
+
+VENTOY_LABEL = "Ventoy"
+VENTOY_EFI_LABEL = "VTOYEFI"
+
+MountEntry = namedtuple("MountEntry", "mount_id devnum root mountpoint fstype source")
+VentoyVolume = namedtuple("VentoyVolume", "disk partition label uuid mountpoint fstype")
+
+_OCTAL_ESCAPE = re.compile(r"\\([0-7]{3})")
+_HEX_ESCAPE = re.compile(r"\\x([0-9a-fA-F]{2})")
+_DISK_NAME = re.compile(r"[a-z]+[a-z0-9]*")
+
+
+def _unescape_mountinfo(field):
+    # The kernel escapes space, tab, newline and backslash as \ooo
+    return _OCTAL_ESCAPE.sub(lambda m: chr(int(m.group(1), 8)), field)
+
+
+def _unescape_udev(name):
+    # udev escapes unsafe label characters as \xHH
+    return _HEX_ESCAPE.sub(lambda m: chr(int(m.group(1), 16)), name)
+
+
+def read_mountinfo(path=MOUNTINFO):
+    entries = []
+    with open(path, "r", encoding="utf-8", errors="surrogateescape") as f:
+        for line in f:
+            fields = line.split()
+            try:
+                sep = fields.index("-", 6)
+            except ValueError:
+                continue
+            entries.append(MountEntry(
+                mount_id=int(fields[0]),
+                devnum=fields[2],
+                root=_unescape_mountinfo(fields[3]),
+                mountpoint=_unescape_mountinfo(fields[4]),
+                fstype=fields[sep + 1],
+                source=_unescape_mountinfo(fields[sep + 2]),
+            ))
+    return entries
+
+
+def read_disk_links(kind, dev_disk=DEV_DISK):
+    """Map kernel device names to their by-<kind> value (label, uuid, ...)."""
+    links = {}
+    base = os.path.join(dev_disk, f"by-{kind}")
+    try:
+        names = os.listdir(base)
+    except OSError:
+        return links
+    for name in names:
+        target = os.readlink(os.path.join(base, name))
+        links[os.path.basename(target)] = _unescape_udev(name)
+    return links
+
+
+def device_number(name, sys_block=SYS_BLOCK):
+    try:
+        with open(os.path.join(sys_block, name, "dev")) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def parent_disk(name, sys_block=SYS_BLOCK):
+    """Return the whole-disk name for a partition (sdb1 -> sdb)."""
+    path = os.path.join(sys_block, name)
+    if not os.path.exists(os.path.join(path, "partition")):
+        return name
+    return os.path.basename(os.path.dirname(os.path.realpath(path)))
+
+
+def disk_partitions(disk, sys_block=SYS_BLOCK):
+    """Return the partitions of a disk ordered by partition number."""
+    path = os.path.join(sys_block, disk)
+    parts = []
+    try:
+        names = os.listdir(path)
+    except OSError:
+        return parts
+    for name in names:
+        try:
+            with open(os.path.join(path, name, "partition")) as f:
+                parts.append((int(f.read().strip()), name))
+        except (OSError, ValueError):
+            continue
+    return [name for _, name in sorted(parts)]
+
+
+def disk_from_usb_line(line):
+    """Extract the kernel disk name from a scan row.
+
+    Accepts both our "sdb | Model | 15G" rows and raw lsblk lines with
+    tree drawing characters.
+    """
+    if not line:
+        return None
+    first = line.split("|")[0].split()
+    if not first:
+        return None
+    match = _DISK_NAME.search(first[0])
+    if not match:
+        return None
+    name = os.path.basename(match.group(0))
+    return parent_disk(name)
+
+
+def block_name(devnum, source=None, sys_dev_block=SYS_DEV_BLOCK):
+    """Return the kernel name for a major:minor, falling back to the mount source."""
+    path = os.path.join(sys_dev_block, devnum)
+    if os.path.exists(path):
+        return os.path.basename(os.path.realpath(path))
+    if source and source.startswith("/dev/"):
+        return os.path.basename(os.path.realpath(source))
+    return None
+
+
+def mount_for_path(path, entries=None):
+    """Return the mount entry with the longest mountpoint containing path."""
+    path = os.path.realpath(path)
+    best = None
+    for entry in entries if entries is not None else read_mountinfo():
+        prefix = entry.mountpoint.rstrip("/") + "/"
+        if path == entry.mountpoint or path.startswith(prefix):
+            if best is None or len(entry.mountpoint) > len(best.mountpoint):
+                best = entry
+    return best
+
+
+def disk_for_target(target):
+    """Resolve /dev/sdb1, sdb, a scan row or a file on a mounted stick to a disk name."""
+    if not target:
+        return None
+    if target.startswith("/dev/"):
+        return parent_disk(os.path.basename(os.path.realpath(target)))
+    if os.path.isabs(target):
+        if not os.path.exists(target):
+            return None
+        entry = mount_for_path(target)
+        name = entry and block_name(entry.devnum, entry.source)
+        return parent_disk(name) if name else None
+    return disk_from_usb_line(target)
+
+
+def disk_mounts(disk, entries=None, sys_block=SYS_BLOCK):
+    """Return every mount entry backed by the disk or one of its partitions."""
+    names = [disk] + disk_partitions(disk, sys_block)
+    devnums = {device_number(name, sys_block) for name in names} - {None}
+    return [e for e in (entries if entries is not None else read_mountinfo()) if e.devnum in devnums]
+
+
+def mounts_by_devnum(entries):
+    """Index mount entries by major:minor, keeping the first mount of each."""
+    index = {}
+    for entry in sorted(entries, key=lambda e: e.mount_id):
+        if entry.root == "/":
+            index.setdefault(entry.devnum, entry)
+    return index
+
+
+def find_ventoy_volumes(disks=None, mountinfo=MOUNTINFO, sys_block=SYS_BLOCK, dev_disk=DEV_DISK):
+    """Map each disk to the VentoyVolume holding its ISO data partition.
+
+    A disk counts as Ventoy when it carries a VTOYEFI partition (partition 1
+    is then the data partition, whatever its label) or a partition labelled
+    "Ventoy". With ``disks=None`` every block device is considered.
+    """
+    labels = read_disk_links("label", dev_disk)
+    uuids = read_disk_links("uuid", dev_disk)
+    mounted = mounts_by_devnum(read_mountinfo(mountinfo))
+
+    if disks is None:
+        disks = sorted({parent_disk(name, sys_block) for name in labels})
+
+    volumes = {}
+    for disk in disks:
+        parts = disk_partitions(disk, sys_block)
+        data_part = None
+        if any(labels.get(p) == VENTOY_EFI_LABEL for p in parts):
+            data_part = parts[0]
+        else:
+            for p in parts:
+                if labels.get(p, "").lower() == VENTOY_LABEL.lower():
+                    data_part = p
+                    break
+        if not data_part:
+            continue
+
+        entry = mounted.get(device_number(data_part, sys_block))
+        volumes[disk] = VentoyVolume(
+            disk=disk,
+            partition=data_part,
+            label=labels.get(data_part),
+            uuid=uuids.get(data_part),
+            mountpoint=entry.mountpoint if entry else None,
+            fstype=entry.fstype if entry else None,
+        )
+    return volumes
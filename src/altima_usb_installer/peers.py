@@ -0,0 +1,82 @@
+"""Find installer cache servers on the local network.
+
+A client broadcasts a small UDP probe and every serve-mode instance
+(server.py) answers with the port its HTTP server listens on. Answers are
+collected for a fraction of a second, so startup is not held up when the
+room has no server.
+"""
+import socket
+import threading
+import time
+
+DISCOVERY_PORT = 38471
+DISCOVERY_TIMEOUT = 0.5
+PROBE = b"ALTIMA-CACHE?"
+REPLY = b"ALTIMA-CACHE "
+
+
+def discover(timeout=DISCOVERY_TIMEOUT, port=DISCOVERY_PORT):
+    """Return base URLs of the cache servers that answered, in reply order."""
+    found = []
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        sent = False
+        # Broadcasts do not loop back everywhere, so ask this host directly too
+        for host in ("<broadcast>", "127.0.0.1"):
+            try:
+                sock.sendto(PROBE, (host, port))
+                sent = True
+            except OSError:
+                pass
+        deadline = time.monotonic() + timeout
+        while sent:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            sock.settimeout(remaining)
+            try:
+                data, (host, _) = sock.recvfrom(256)
+            except OSError:
+                break
+            if not data.startswith(REPLY):
+                continue
+            try:
+                http_port = int(data[len(REPLY):])
+            except ValueError:
+                continue
+            url = f"http://{host}:{http_port}/"
+            if url not in found:
+                found.append(url)
+    finally:
+        sock.close()
+    return found
+
+
+class Responder(threading.Thread):
+    """Answer discovery probes with http_port until stop() is called."""
+
+    def __init__(self, http_port, port=DISCOVERY_PORT):
+        super().__init__(daemon=True)
+        self.http_port = http_port
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(("", port))
+        self._halt = threading.Event()
+
+    def run(self):
+        reply = REPLY + str(self.http_port).encode()
+        while not self._halt.is_set():
+            try:
+                data, addr = self.sock.recvfrom(256)
+            except OSError:
+                break
+            if data == PROBE:
+                try:
+                    self.sock.sendto(reply, addr)
+                except OSError:
+                    pass
+
+    def stop(self):
+        self._halt.set()
+        self.sock.close()
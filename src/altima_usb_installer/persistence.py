@@ -0,0 +1,199 @@
+"""Ventoy persistence images, created in seconds instead of minutes.
+
+Ventoy's CreatePersistentImg.sh writes zeros over the whole image before
+formatting it, so a 4 GiB image costs 4 GiB of writes to a slow stick.
+create_image() instead allocates the file with fallocate(2), or just sets
+its length where the filesystem has no fallocate, and runs mkfs.ext4 with
+discards and the inode table and journal zeroing deferred, so only the
+filesystem metadata is written. The image carries the persistence.conf
+Debian's live-boot looks for, added by mke2fs -d without mounting anything.
+
+That takes seconds where extending a file leaves the new range unwritten:
+ext4, XFS, Btrfs, and exFAT from Linux 6.8, whose driver keeps a valid
+data length. FAT, and exFAT on older kernels, zero-fill the whole range
+when the file grows, which no choice of system call avoids; zero_fills()
+says when that will happen, so callers can warn that it takes minutes.
+
+set_persistence() then points the ISO at the image in the stick's
+ventoy/ventoy.json, keeping every other plugin setting.
+
+    python -m altima_usb_installer.persistence [--size GIB] [--label LABEL] [--force] TARGET ISO
+"""
+import argparse
+import itertools
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from altima_usb_installer import mounts, preflight
+
+DEFAULT_SIZE = 4 * 1024 ** 3
+# live-boot only mounts filesystems with this label as persistence
+LABEL = "persistence"
+PERSISTENCE_CONF = "/ union\n"
+CONFIG_PATH = os.path.join("ventoy", "ventoy.json")
+# Filesystems that write zeros over every byte a file is extended by
+ZERO_FILLING = ("vfat", "msdos")
+# The exFAT driver gained a valid data length, and stopped zero-filling, in Linux 6.8
+EXFAT_LAZY_KERNEL = (6, 8)
+MKFS_OPTIONS = ["-E", "nodiscard,lazy_itable_init=1,lazy_journal_init=1,root_owner=0:0", "-m", "0"]
+
+
+class ConfigError(ValueError):
+    """The stick's ventoy.json cannot be read, so it is left as it is."""
+
+
+def image_name(iso_file):
+    """The image file name used for an ISO: one image per ISO on the stick."""
+    return os.path.splitext(os.path.basename(iso_file))[0] + "-persistence.dat"
+
+
+def _kernel_version(release=None):
+    release = release or os.uname().release
+    parts = []
+    for part in release.split("-")[0].split(".")[:2]:
+        digits = "".join(itertools.takewhile(str.isdigit, part))
+        parts.append(int(digits or 0))
+    return tuple(parts)
+
+
+def zero_fills(directory):
+    """Why an image created in directory gets zero-filled, or None if it does not.
+
+    Only known for Linux mounts; elsewhere the answer is None.
+    """
+    if not sys.platform.startswith("linux"):
+        return None
+    entry = mounts.mount_for_path(directory)
+    fstype = entry.fstype if entry else None
+    if fstype in ZERO_FILLING:
+        return f"{fstype} zero-fills the whole image"
+    if fstype == "exfat" and _kernel_version() < EXFAT_LAZY_KERNEL:
+        return "exFAT zero-fills the whole image before Linux 6.8"
+    return None
+
+
+def _mkfs():
+    for name in ("mkfs.ext4", "mke2fs"):
+        path = shutil.which(name) or shutil.which(name, path="/usr/sbin:/sbin")
+        if path:
+            return [path] if name == "mkfs.ext4" else [path, "-t", "ext4"]
+    raise FileNotFoundError("mkfs.ext4 not found; install e2fsprogs")
+
+
+def create_image(path, size=DEFAULT_SIZE, label=LABEL, force=False):
+    """Create an ext4 persistence image of size bytes at path.
+
+    Takes minutes rather than seconds where zero_fills() says so.
+    Raises NoSpaceError before anything is written if the stick cannot hold
+    it, and FileExistsError for an existing image unless force, since
+    replacing one throws away everything saved in it.
+    """
+    if os.path.exists(path) and not force:
+        raise FileExistsError(f"{path} already exists")
+    command = _mkfs()
+    with preflight.open_reserved(path, size) as f:
+        # The reserved blocks become the file's contents without being written
+        f.truncate(size)
+    try:
+        with tempfile.TemporaryDirectory() as root:
+            with open(os.path.join(root, "persistence.conf"), "w") as conf:
+                conf.write(PERSISTENCE_CONF)
+            subprocess.run(
+                command + ["-F", "-q", "-L", label, *MKFS_OPTIONS, "-d", root, path],
+                check=True, capture_output=True, text=True,
+            )
+    except subprocess.CalledProcessError as e:
+        os.remove(path)
+        raise OSError(f"mkfs.ext4 failed on {path}: {e.stderr.strip()}") from None
+    except BaseException:
+        os.remove(path)
+        raise
+
+
+def _ventoy_path(mountpoint, path):
+    """path as ventoy.json names it: absolute from the partition root."""
+    return "/" + os.path.relpath(path, mountpoint).replace(os.sep, "/")
+
+
+def set_persistence(mountpoint, iso_path, image_path):
+    """Point iso_path at image_path in ventoy.json, replacing any earlier entry.
+
+    Raises ConfigError, without touching the file, if it is not valid JSON
+    or its persistence setting is not a list of objects.
+    """
+    config_path = os.path.join(mountpoint, CONFIG_PATH)
+    try:
+        with open(config_path) as f:
+            config = json.load(f)
+    except FileNotFoundError:
+        config = {}
+    except ValueError as e:
+        raise ConfigError(f"{config_path} is not valid JSON: {e}") from None
+    existing = config.get("persistence", []) if isinstance(config, dict) else None
+    if not isinstance(existing, list) or not all(isinstance(e, dict) for e in existing):
+        raise ConfigError(f"{config_path} has no usable persistence list")
+    image = _ventoy_path(mountpoint, iso_path)
+    entries = [e for e in existing if e.get("image") != image]
+    entries.append({"image": image, "backend": _ventoy_path(mountpoint, image_path), "autosel": 1})
+    config["persistence"] = entries
+    os.makedirs(os.path.dirname(config_path), exist_ok=True)
+    with open(config_path + ".part", "w") as f:
+        json.dump(config, f, indent=4)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(config_path + ".part", config_path)
+
+
+def add_persistence(mountpoint, iso_file, size=DEFAULT_SIZE, label=LABEL, force=False):
+    """Create the image for iso_file (a name on the stick) and wire it up.
+
+    An image that already exists is kept, not recreated, unless force.
+    Returns the image path.
+    """
+    image_path = os.path.join(mountpoint, image_name(iso_file))
+    if force or not os.path.exists(image_path):
+        create_image(image_path, size, label, force)
+    set_persistence(mountpoint, os.path.join(mountpoint, iso_file), image_path)
+    return image_path
+
+
+def _mountpoint(target):
+    if os.path.isdir(target):
+        return target
+    disk = mounts.disk_for_target(target) or target
+    volume = mounts.find_ventoy_volumes([disk]).get(disk)
+    if volume is None or not volume.mountpoint:
+        raise OSError(f"{target} has no mounted Ventoy partition")
+    return volume.mountpoint
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m altima_usb_installer.persistence")
+    parser.add_argument("target", metavar="TARGET", help="Ventoy mountpoint or disk")
+    parser.add_argument("iso", metavar="ISO", help="ISO file name on the stick")
+    parser.add_argument("--size", type=float, default=DEFAULT_SIZE / 1024 ** 3, metavar="GIB")
+    parser.add_argument("--label", default=LABEL)
+    parser.add_argument("--force", action="store_true", help="replace an existing image")
+    args = parser.parse_args(argv)
+    size = int(args.size * 1024 ** 3)
+    started = time.monotonic()
+    try:
+        mountpoint = _mountpoint(args.target)
+        slow = zero_fills(mountpoint)
+        if slow:
+            print(f"{mountpoint}: {slow}; this takes minutes", file=sys.stderr)
+        path = add_persistence(mountpoint, args.iso, size, args.label, args.force)
+    except (OSError, ConfigError) as e:
+        print(e, file=sys.stderr)
+        return 1
+    print(f"{path}: {preflight.format_size(os.path.getsize(path))} in {time.monotonic() - started:.1f} s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,180 @@
+"""Free-space preflight and up-front allocation for files written to a stick.
+
+check() compares the free space on the target filesystem (statvfs, through
+shutil.disk_usage) with the bytes a job needs, crediting the file it is
+about to overwrite, so a doomed job fails before the first write instead
+of with ENOSPC minutes in. open_reserved() then claims every block at once
+with fallocate(2): a wrong estimate still fails in milliseconds, and the
+filesystem can lay the ISO out in as few extents as it has. Filesystems
+without fallocate (exFAT on older kernels, macOS, Windows) only get the
+check; glibc's posix_fallocate() emulation is avoided on purpose, since it
+would write to every block of the stick. open_reserved_files() does the
+same for a batch of ISOs bound for one stick, all before the first write.
+"""
+import ctypes
+import ctypes.util
+import errno
+import os
+import shutil
+from collections import namedtuple
+
+FALLOC_FL_KEEP_SIZE = 0x01
+
+Space = namedtuple("Space", "required available reclaimable")
+
+
+class NoSpaceError(OSError):
+    """The target filesystem cannot hold the file."""
+
+    def __init__(self, path, required, available):
+        super().__init__(
+            errno.ENOSPC,
+            f"{format_size(required)} needed but only {format_size(available)} free",
+            path,
+        )
+        self.required = required
+        self.available = available
+
+
+_libc = None
+
+
+def _get_libc():
+    global _libc
+    if _libc is None:
+        name = ctypes.util.find_library("c")
+        _libc = ctypes.CDLL(name, use_errno=True) if name else False
+    return _libc
+
+
+def format_size(n):
+    for unit in ("bytes", "KiB", "MiB", "GiB"):
+        if n < 1024 or unit == "GiB":
+            return f"{n} {unit}" if unit == "bytes" else f"{n:.1f} {unit}"
+        n /= 1024
+
+
+def free_space(path):
+    """Bytes an unprivileged user may still write on path's filesystem."""
+    directory = path if os.path.isdir(path) else os.path.dirname(os.path.abspath(path))
+    return shutil.disk_usage(directory).free
+
+
+def reclaimable(path):
+    """Space given back when path is truncated or replaced; 0 if it does not exist."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return 0
+    if hasattr(st, "st_blocks"):
+        return st.st_blocks * 512
+    return st.st_size
+
+
+def check(path, required, replacing=True):
+    """Return a Space for writing required bytes to path, or raise NoSpaceError.
+
+    replacing credits the current file at path, for callers that truncate it
+    before writing; a download that is renamed over it afterwards needs
+    both copies at once and passes replacing=False.
+    """
+    space = Space(required, free_space(path), reclaimable(path) if replacing else 0)
+    if required > space.available + space.reclaimable:
+        raise NoSpaceError(path, required, space.available + space.reclaimable)
+    return space
+
+
+def check_files(directory, sizes):
+    """check() for several files written into one directory, e.g. a batch of ISOs.
+
+    sizes maps file names to byte counts; existing files of those names are
+    credited as they are overwritten in place.
+    """
+    required = sum(sizes.values())
+    space = Space(required, free_space(directory),
+                  sum(reclaimable(os.path.join(directory, name)) for name in sizes))
+    if required > space.available + space.reclaimable:
+        raise NoSpaceError(directory, required, space.available + space.reclaimable)
+    return space
+
+
+def reserve(fd, size):
+    """Allocate size bytes for fd without changing its length.
+
+    Returns False where the filesystem or platform has no fallocate(2);
+    raises OSError (ENOSPC included) for real failures. The file keeps its
+    length, so a short write leaves no run of zeros behind; truncate()
+    after writing hands back whatever was reserved and not used.
+    """
+    libc = _get_libc()
+    fallocate = getattr(libc, "fallocate64", None) or getattr(libc, "fallocate", None)
+    if fallocate is None or not size:
+        return False
+    fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64]
+    if fallocate(fd, FALLOC_FL_KEEP_SIZE, 0, size) == 0:
+        return True
+    err = ctypes.get_errno()
+    if err in (errno.EOPNOTSUPP, errno.ENOSYS, errno.EINVAL):
+        return False
+    raise OSError(err, os.strerror(err))
+
+
+def open_reserved(path, size, replacing=True, offset=0):
+    """Open path for writing ("wb") with size bytes checked and reserved.
+
+    size may be None when it is not known up front; the file is then opened
+    without a preflight. With offset the first offset bytes of an existing
+    file are kept and writing continues after them, for resumed copies.
+    Raises NoSpaceError before anything is written if the file cannot fit.
+    """
+    if size:
+        space = check(path, size, replacing)
+    if offset:
+        f = open(path, "r+b")
+        f.seek(offset)
+        f.truncate()
+    else:
+        f = open(path, "wb")
+    if size:
+        try:
+            reserve(f.fileno(), size)
+        except OSError as e:
+            f.close()
+            if not offset:
+                os.remove(path)
+            if e.errno == errno.ENOSPC:
+                raise NoSpaceError(path, size, space.available + space.reclaimable) from None
+            raise
+    return f
+
+
+def open_reserved_files(directory, sizes):
+    """open_reserved() for a batch of files in one directory, allocated together.
+
+    The batch is checked as one with check_files(), then every new file is
+    created and reserved in the order of sizes before any is written, so
+    each lands in its own long run of blocks instead of the files
+    fragmenting each other as they grow. Files that already exist are left
+    untouched for open_reserved() when their turn comes, so a batch that
+    stops short cannot cost an ISO that was already good. Returns
+    {name: file} for the files it created. Raises NoSpaceError, removing
+    what it created, if they cannot all fit.
+    """
+    space = check_files(directory, sizes)
+    files = {}
+    try:
+        for name, size in sizes.items():
+            path = os.path.join(directory, name)
+            if os.path.exists(path):
+                continue
+            f = files[name] = open(path, "xb")
+            reserve(f.fileno(), size)
+    except OSError as e:
+        for name, f in files.items():
+            f.close()
+            os.remove(os.path.join(directory, name))
+        if e.errno == errno.ENOSPC:
+            raise NoSpaceError(directory, space.required,
+                               space.available + space.reclaimable) from None
+        raise
+    return files
@@ -0,0 +1,334 @@
+"""Per-stick probes: sustained write/read speed and real capacity.
+
+measure_speed() times large O_DIRECT writes and reads. On a mounted stick it
+uses a scratch file; on a raw device it backs up a region in the middle,
+times reading it and writing it over, and puts the original back.
+
+check_capacity() catches counterfeit sticks that report more space than
+they have. It writes signed blocks (a keyed hash of a per-run nonce and the
+block's own offset) at sample offsets across the whole address space,
+including the power-of-two sizes fakes like to claim, and reads them back.
+Past the real capacity such sticks drop writes or wrap them onto lower
+addresses, so the wrong signatures show up. Every sampled block is backed up
+first and restored afterwards, highest offset first, so a wrapped write
+cannot clobber the real data below it. It needs the raw device, unmounted.
+
+Results are cached by USB vendor, product, serial and reported size in
+probes.json in the state directory, so each stick is probed once.
+
+    python -m altima_usb_installer.probe [--force] [--no-capacity] DISK [DISK ...]
+"""
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import sys
+import time
+from collections import namedtuple
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Windows; probing is Linux-only
+
+from altima_usb_installer import eject, hashing, mounts, rawwrite, sources
+
+PROBE_BLOCK = 4 * 1024 * 1024
+SPEED_BYTES = 64 * 1024 * 1024
+CAPACITY_BLOCK = 64 * 1024
+CAPACITY_SAMPLES = 64
+SCRATCH_NAME = ".altima-probe"
+CACHE_NAME = "probes.json"
+
+StickId = namedtuple("StickId", "disk serial vendor product model size")
+SpeedResult = namedtuple("SpeedResult", "write_speed read_speed bytes")
+CapacityResult = namedtuple("CapacityResult", "reported real bad_offsets")
+ProbeResult = namedtuple(
+    "ProbeResult", "key model reported_size write_speed read_speed real_capacity fake probed_at"
+)
+
+
+def _read(path, name):
+    try:
+        with open(os.path.join(path, name)) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def identify(disk, sys_block=mounts.SYS_BLOCK):
+    """Read a disk's USB serial, ids, model and reported size from sysfs."""
+    path = os.path.realpath(os.path.join(sys_block, disk, "device"))
+    model = _read(path, "model")
+    # The USB device directory is the nearest ancestor carrying idVendor
+    while path != os.sep and not os.path.exists(os.path.join(path, "idVendor")):
+        path = os.path.dirname(path)
+    sectors = _read(os.path.join(sys_block, disk), "size")
+    return StickId(
+        disk=disk,
+        serial=_read(path, "serial"),
+        vendor=_read(path, "idVendor"),
+        product=_read(path, "idProduct"),
+        model=model or _read(path, "product"),
+        size=int(sectors) * 512 if sectors and sectors.isdigit() else None,
+    )
+
+
+def cache_key(stick):
+    """None for sticks without a serial; they cannot be told apart."""
+    if not stick.serial:
+        return None
+    return f"{stick.vendor}:{stick.product}:{stick.serial}:{stick.size}"
+
+
+def _aligned(size):
+    return mmap.mmap(-1, size)
+
+
+def _write_all(fd, view, offset):
+    while view:
+        n = os.pwrite(fd, view, offset)
+        view = view[n:]
+        offset += n
+
+
+def _speed_file(path, length, block):
+    buf = _aligned(block)
+    buf.write(os.urandom(block))
+    flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC
+    try:
+        fd = os.open(path, flags | getattr(os, "O_DIRECT", 0), 0o600)
+    except OSError:
+        fd = os.open(path, flags, 0o600)
+    try:
+        started = time.monotonic()
+        for offset in range(0, length, block):
+            _write_all(fd, memoryview(buf), offset)
+        os.fsync(fd)
+        write_time = time.monotonic() - started
+        os.close(fd)
+
+        fd, direct = hashing.open_uncached(path, direct=True)
+        started = time.monotonic()
+        for offset in range(0, length, block):
+            hashing.read_block(fd, buf, offset, direct)
+        read_time = time.monotonic() - started
+    finally:
+        os.close(fd)
+        buf.close()
+        os.remove(path)
+    return SpeedResult(length / write_time, length / read_time, length)
+
+
+def _speed_device(device, length, block):
+    fd = os.open(device, os.O_RDWR | os.O_EXCL | getattr(os, "O_DIRECT", 0))
+    backup = _aligned(length)
+    try:
+        size = rawwrite.device_size(fd)
+        length = min(length, size // 2 // block * block)
+        start = size // 2 // block * block
+        view = memoryview(backup)
+
+        started = time.monotonic()
+        for offset in range(0, length, block):
+            hashing.read_block(fd, view[offset:offset + block], start + offset, True)
+        read_time = time.monotonic() - started
+
+        data = _aligned(block)
+        data.write(os.urandom(block))
+        try:
+            started = time.monotonic()
+            for offset in range(0, length, block):
+                _write_all(fd, memoryview(data), start + offset)
+            os.fsync(fd)
+            write_time = time.monotonic() - started
+        finally:
+            for offset in range(0, length, block):
+                _write_all(fd, view[offset:offset + block], start + offset)
+            os.fsync(fd)
+            data.close()
+        view.release()
+    finally:
+        os.close(fd)
+        backup.close()
+    return SpeedResult(length / write_time, length / read_time, length)
+
+
+def measure_speed(target, length=SPEED_BYTES, block=PROBE_BLOCK):
+    """Sustained sequential write and read speed in bytes per second.
+
+    target is a mountpoint (a scratch file is used) or a raw device node.
+    """
+    if os.path.isdir(target):
+        return _speed_file(os.path.join(target, SCRATCH_NAME), length, block)
+    return _speed_device(target, length, block)
+
+
+def sample_offsets(size, block=CAPACITY_BLOCK, samples=CAPACITY_SAMPLES):
+    """Evenly spread block offsets plus the ones just below each power-of-two size."""
+    last = (size - block) // block * block
+    offsets = {i * last // (samples - 1) // block * block for i in range(samples)}
+    boundary = 1024 * 1024 * 1024
+    while boundary < size:
+        offsets.add(boundary - block)
+        offsets.add(boundary)
+        boundary *= 2
+    return sorted(o for o in offsets if 0 <= o <= last)
+
+
+def _signature(nonce, offset, block):
+    digest = hashlib.blake2b(offset.to_bytes(8, "little"), key=nonce, digest_size=64).digest()
+    return digest * (block // len(digest))
+
+
+def check_capacity(device, block=CAPACITY_BLOCK, samples=CAPACITY_SAMPLES, progress=None):
+    """Return a CapacityResult for a raw, unmounted device.
+
+    real is the lowest offset whose signed block did not read back, i.e. the
+    most the stick can be trusted with, or the reported size if all did.
+    progress is called as progress(steps_done, steps_total).
+    """
+    fd = os.open(device, os.O_RDWR | os.O_EXCL | getattr(os, "O_DIRECT", 0))
+    buf = _aligned(block)
+    try:
+        size = rawwrite.device_size(fd)
+        offsets = sample_offsets(size, block, samples)
+        steps = len(offsets) * 3
+        nonce = os.urandom(16)
+        backups = {}
+        bad = []
+        try:
+            for i, offset in enumerate(offsets):
+                hashing.read_block(fd, buf, offset, True)
+                backups[offset] = bytes(buf)
+                buf[:] = _signature(nonce, offset, block)
+                _write_all(fd, memoryview(buf), offset)
+                if progress:
+                    progress(i + 1, steps)
+            os.fsync(fd)
+            # Make sure the reads below come from the stick, not the buffer cache
+            fcntl.ioctl(fd, eject.BLKFLSBUF)
+            for i, offset in enumerate(offsets):
+                n = hashing.read_block(fd, buf, offset, True)
+                if n < block or buf[:] != _signature(nonce, offset, block):
+                    bad.append(offset)
+                if progress:
+                    progress(len(offsets) + i + 1, steps)
+        finally:
+            # Highest first: a wrapped write must not undo a lower block's restore
+            for i, offset in enumerate(sorted(backups, reverse=True)):
+                buf[:] = backups[offset]
+                _write_all(fd, memoryview(buf), offset)
+                if progress:
+                    progress(2 * len(offsets) + i + 1, steps)
+            os.fsync(fd)
+    finally:
+        os.close(fd)
+        buf.close()
+    return CapacityResult(size, min(bad) if bad else size, bad)
+
+
+def cache_path():
+    return os.path.join(sources.state_dir(), CACHE_NAME)
+
+
+def load_cache(path=None):
+    try:
+        with open(path or cache_path()) as f:
+            return {k: ProbeResult(**v) for k, v in json.load(f).items()}
+    except (OSError, ValueError, TypeError):
+        return {}
+
+
+def save_cache(results, path=None):
+    path = path or cache_path()
+    with open(path + ".part", "w") as f:
+        json.dump({k: r._asdict() for k, r in results.items()}, f, indent=1)
+    os.replace(path + ".part", path)
+
+
+def cached(disk):
+    """The stored ProbeResult for the stick in disk, or None."""
+    key = cache_key(identify(disk))
+    return load_cache().get(key) if key else None
+
+
+def probe(disk, speed=True, capacity=True, force=False, progress=None):
+    """Probe a stick (or return the cached result) and store what was measured.
+
+    The capacity check is skipped while the stick is mounted; a mounted
+    stick's speed is measured through a scratch file on its first mount.
+    A cached result is only reused for what it covers: a stick probed for
+    speed alone gets its capacity checked when that is asked for.
+    """
+    stick = identify(disk)
+    key = cache_key(stick)
+    results = load_cache()
+    previous = results.get(key) if key else None
+    device = "/dev/" + disk
+    mounted = [m.mountpoint for m in mounts.disk_mounts(disk)]
+    write_speed = read_speed = real = None
+    if previous is not None and not force:
+        write_speed, read_speed, real = previous.write_speed, previous.read_speed, previous.real_capacity
+        speed = speed and write_speed is None
+        capacity = capacity and real is None
+        if not speed and (not capacity or mounted):
+            return previous
+
+    if speed:
+        measured = measure_speed(mounted[0] if mounted else device)
+        write_speed, read_speed = measured.write_speed, measured.read_speed
+    if capacity and not mounted:
+        real = check_capacity(device, progress=progress).real
+    result = ProbeResult(
+        key=key,
+        model=stick.model,
+        reported_size=stick.size,
+        write_speed=write_speed,
+        read_speed=read_speed,
+        real_capacity=real,
+        fake=real is not None and stick.size is not None and real < stick.size,
+        probed_at=time.time(),
+    )
+    if key:
+        results[key] = result
+        save_cache(results)
+    return result
+
+
+def describe(result):
+    parts = [result.model or "unknown stick"]
+    if result.write_speed:
+        parts.append(f"write {result.write_speed / 1e6:.1f} MB/s, read {result.read_speed / 1e6:.1f} MB/s")
+    if result.fake:
+        parts.append(f"FAKE: reports {result.reported_size / 1e9:.1f} GB, "
+                     f"holds about {result.real_capacity / 1e9:.1f} GB")
+    elif result.real_capacity is not None:
+        parts.append(f"capacity {result.real_capacity / 1e9:.1f} GB checked")
+    return ", ".join(parts)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m altima_usb_installer.probe")
+    parser.add_argument("disks", nargs="+", metavar="DISK")
+    parser.add_argument("--force", action="store_true", help="probe again even if cached")
+    parser.add_argument("--no-capacity", action="store_true", help="skip the fake-capacity check")
+    args = parser.parse_args(argv)
+    status = 0
+    for target in args.disks:
+        disk = mounts.disk_for_target(target) or target
+        try:
+            result = probe(disk, capacity=not args.no_capacity, force=args.force)
+        except OSError as e:
+            print(f"{disk}: {e}", file=sys.stderr)
+            status = 1
+            continue
+        print(f"{disk}: {describe(result)}")
+        if result.fake:
+            status = 1
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
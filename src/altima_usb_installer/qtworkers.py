@@ -0,0 +1,78 @@
+"""QThreadPool workers for the PySide6 frontends.
+
+Widgets must only be touched from the GUI thread, so a Worker runs its
+function on the global QThreadPool and hands everything back through
+WorkerSignals. Progress is batched: report() emits at most every
+PROGRESS_INTERVAL seconds and the latest value wins. Long loops call
+report() or check_cancelled(), which raise Cancelled once cancel() has
+been requested.
+"""
+import threading
+import time
+import traceback
+
+from PySide6.QtCore import QObject, QRunnable, QThreadPool, Signal, Slot
+
+PROGRESS_INTERVAL = 0.1
+
+
+class Cancelled(Exception):
+    pass
+
+
+class WorkerSignals(QObject):
+    progress = Signal(int, str)
+    result = Signal(object)
+    error = Signal(str)
+    cancelled = Signal()
+    finished = Signal()
+
+
+class Worker(QRunnable):
+    """Run fn(worker, *args, **kwargs) on the thread pool."""
+
+    def __init__(self, fn, *args, **kwargs):
+        super().__init__()
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = WorkerSignals()
+        self._cancel = threading.Event()
+        self._last_emit = 0.0
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def is_cancelled(self):
+        return self._cancel.is_set()
+
+    def check_cancelled(self):
+        if self._cancel.is_set():
+            raise Cancelled()
+
+    def report(self, percent, message="", force=False):
+        self.check_cancelled()
+        now = time.monotonic()
+        if force or now - self._last_emit >= PROGRESS_INTERVAL:
+            self._last_emit = now
+            self.signals.progress.emit(int(percent), message)
+
+    @Slot()
+    def run(self):
+        try:
+            result = self.fn(self, *self.args, **self.kwargs)
+        except Cancelled:
+            self.signals.cancelled.emit()
+        except Exception:
+            self.signals.error.emit(traceback.format_exc())
+        else:
+            self.signals.result.emit(result)
+        finally:
+            self.signals.finished.emit()
+
+
+def start(worker):
+    """Queue a worker on the global pool; connect its signals before calling this."""
+    QThreadPool.globalInstance().start(worker)
+    return worker
@@ -0,0 +1,392 @@
+"""Write a hybrid ISO straight to whole block devices, dd style.
+
+The source is read once into a small pool of page-aligned buffers and each
+buffer is handed to one writer thread per device, so N sticks cost a single
+read of the image. Writes are large and aligned, optionally O_DIRECT, and
+each device gets its own throughput numbers and a final fsync. With
+on_commit, each device is also fsynced every COMMIT_INTERVAL bytes and the
+offset reported, so an interrupted write can carry on from there (offset).
+
+write_sticks() is the entry point for sticks a desktop session has
+mounted: it unmounts them and runs the write as root through pkexec, via
+this module's command line.
+
+    python -m altima_usb_installer.rawwrite [--direct] [--discard] [--skip-zeros] [--offset BYTES]
+                                            IMAGE DEVICE ...
+"""
+import argparse
+import json
+import mmap
+import os
+import queue
+import struct
+import subprocess
+import sys
+import threading
+import time
+from collections import namedtuple
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Windows; raw writes are Linux-only
+
+from altima_usb_installer import eject, ventoy
+
+BLOCK_SIZE = 4 * 1024 * 1024
+BUFFERS = 8
+PROGRESS_INTERVAL = 0.5
+# fsync each device and report the offset after this many new bytes
+COMMIT_INTERVAL = 64 * 1024 * 1024
+# Resume offsets are rounded down to this, for O_DIRECT
+ALIGNMENT = 4096
+# Blocks read back after a discard to see whether the stick zeroes them
+ZERO_SAMPLES = 32
+ZERO_SAMPLE_SIZE = 64 * 1024
+
+BLKGETSIZE64 = 0x80081272
+BLKDISCARD = 0x1277
+
+WriteResult = namedtuple("WriteResult", "device ok bytes_written bytes_skipped seconds error")
+
+
+def device_size(fd):
+    buf = fcntl.ioctl(fd, BLKGETSIZE64, b"\0" * 8)
+    return struct.unpack("Q", buf)[0]
+
+
+def discard(fd, length):
+    """Ask the device to drop every block; returns False if unsupported."""
+    try:
+        fcntl.ioctl(fd, BLKDISCARD, struct.pack("QQ", 0, length))
+        return True
+    except OSError:
+        return False
+
+
+def reads_zeros(device, size, samples=ZERO_SAMPLES, length=ZERO_SAMPLE_SIZE):
+    """Whether blocks sampled across a freshly discarded device read back as zeros.
+
+    Not every stick zeroes what it discards, and skipping the image's zero
+    blocks on one that does not would leave old data in their place.
+    """
+    fd = os.open(device, os.O_RDONLY | getattr(os, "O_CLOEXEC", 0))
+    try:
+        last = max(0, size - length)
+        for i in range(samples):
+            data = os.pread(fd, length, last * i // max(1, samples - 1) // 4096 * 4096)
+            if data.count(0) != len(data):
+                return False
+        return True
+    finally:
+        os.close(fd)
+
+
+class _Block:
+    __slots__ = ("buf", "offset", "length", "zero", "refs")
+
+    def __init__(self, buf, offset, length, zero, refs):
+        self.buf = buf
+        self.offset = offset
+        self.length = length
+        self.zero = zero
+        self.refs = refs
+
+
+class _Target:
+    def __init__(self, device, fd, direct, skip_zeros, depth, offset=0):
+        self.device = device
+        self.fd = fd
+        self.direct = direct
+        self.skip_zeros = skip_zeros
+        self.queue = queue.Queue(maxsize=depth)
+        self.offset = offset
+        self.written = 0
+        self.skipped = 0
+        self.error = None
+        self.started = time.monotonic()
+        self.finished = None
+
+
+def _is_zero(buf, length):
+    # Cheap rejection first; the full compare runs at memcmp speed
+    if buf[0] or buf[length - 1]:
+        return False
+    return buf[:length] == bytes(length)
+
+
+def _open_target(device, image_size, direct, do_discard, skip_zeros, depth, offset=0):
+    flags = os.O_WRONLY | os.O_EXCL | getattr(os, "O_CLOEXEC", 0)
+    if direct:
+        flags |= os.O_DIRECT
+    # O_EXCL on a block device fails with EBUSY while it is mounted
+    fd = os.open(device, flags)
+    try:
+        size = device_size(fd)
+        if size < image_size:
+            raise OSError(f"{device} holds {size} bytes, the image needs {image_size}")
+        discarded = do_discard and discard(fd, size)
+        zeroed = discarded and skip_zeros and reads_zeros(device, size)
+    except Exception:
+        os.close(fd)
+        raise
+    return _Target(device, fd, direct, zeroed, depth, offset)
+
+
+def _write_all(target, view, offset):
+    while view:
+        n = os.pwrite(target.fd, view, offset)
+        view = view[n:]
+        offset += n
+
+
+def _commit(target, on_commit):
+    os.fsync(target.fd)
+    on_commit(target.device, target.offset + target.written + target.skipped)
+
+
+def _writer(target, total, release, progress, on_commit=None, commit_interval=COMMIT_INTERVAL):
+    last_report = 0.0
+    last_commit = 0
+    while True:
+        block = target.queue.get()
+        if block is None:
+            break
+        try:
+            if target.error is not None:
+                continue
+            if block.zero and target.skip_zeros:
+                target.skipped += block.length
+            else:
+                if target.direct and block.length % 4096:
+                    # O_DIRECT needs aligned lengths; the tail goes through the cache
+                    flags = fcntl.fcntl(target.fd, fcntl.F_GETFL)
+                    fcntl.fcntl(target.fd, fcntl.F_SETFL, flags & ~os.O_DIRECT)
+                    target.direct = False
+                _write_all(target, memoryview(block.buf)[:block.length], block.offset)
+                target.written += block.length
+            moved = target.written + target.skipped
+            if on_commit and moved - last_commit >= commit_interval:
+                _commit(target, on_commit)
+                last_commit = moved
+        except OSError as e:
+            target.error = e
+        finally:
+            release(block)
+
+        now = time.monotonic()
+        if progress and now - last_report >= PROGRESS_INTERVAL:
+            last_report = now
+            moved = target.written + target.skipped
+            progress(target.device, target.offset + moved, total,
+                     moved / max(now - target.started, 1e-6))
+
+    if target.error is None:
+        try:
+            if on_commit:
+                _commit(target, on_commit)
+            else:
+                os.fsync(target.fd)
+        except OSError as e:
+            target.error = e
+    os.close(target.fd)
+    target.finished = time.monotonic()
+    if progress and target.error is None:
+        moved = target.written + target.skipped
+        progress(target.device, target.offset + moved, total,
+                 moved / max(target.finished - target.started, 1e-6))
+
+
+def write_image(source, devices, block_size=BLOCK_SIZE, direct=False, discard_first=False,
+                skip_zeros=False, progress=None, buffers=BUFFERS, offset=0, on_commit=None,
+                commit_interval=COMMIT_INTERVAL):
+    """Write source to every device concurrently from a single read.
+
+    With discard_first the devices are BLKDISCARDed up front, and with
+    skip_zeros all-zero blocks are then left unwritten on the devices that
+    took the discard and whose discarded blocks sample as zeros
+    (reads_zeros()); the rest get every block. The devices must not be
+    mounted; see write_sticks(). progress is
+    called as progress(device, bytes_done, total_bytes, bytes_per_second).
+
+    offset resumes an interrupted write: the first offset bytes (rounded
+    down to ALIGNMENT) are taken as already on every device, and nothing
+    is discarded. on_commit(device, offset) is called, from the device's
+    writer thread, whenever everything before offset has been fsynced.
+    Returns one WriteResult per device, in the order given.
+    """
+    total = os.path.getsize(source)
+    offset = min(offset, total) // ALIGNMENT * ALIGNMENT
+    if offset:
+        # The discard would throw away what is being resumed
+        discard_first = False
+    targets = []
+    results = {}
+    for device in devices:
+        try:
+            targets.append(_open_target(device, total, direct, discard_first, skip_zeros, buffers,
+                                        offset))
+        except OSError as e:
+            results[device] = WriteResult(device, False, 0, 0, 0.0, str(e))
+
+    if targets:
+        free = queue.Queue()
+        for _ in range(buffers):
+            free.put(mmap.mmap(-1, block_size))
+        lock = threading.Lock()
+
+        def release(block):
+            with lock:
+                block.refs -= 1
+                if block.refs == 0:
+                    free.put(block.buf)
+
+        threads = [
+            threading.Thread(target=_writer, args=(t, total, release, progress, on_commit,
+                                                   commit_interval), daemon=True)
+            for t in targets
+        ]
+        for thread in threads:
+            thread.start()
+
+        check_zero = any(t.skip_zeros for t in targets)
+        try:
+            with open(source, "rb", buffering=0) as f:
+                f.seek(offset)
+                while offset < total:
+                    buf = free.get()
+                    view = memoryview(buf)
+                    length = 0
+                    while length < block_size:
+                        n = f.readinto(view[length:])
+                        if not n:
+                            break
+                        length += n
+                    view.release()
+                    if not length:
+                        free.put(buf)
+                        break
+                    block = _Block(buf, offset, length,
+                                   check_zero and _is_zero(buf, length), len(targets))
+                    for target in targets:
+                        target.queue.put(block)
+                    offset += length
+        except OSError as e:
+            for target in targets:
+                target.error = target.error or e
+        finally:
+            for target in targets:
+                target.queue.put(None)
+            for thread in threads:
+                thread.join()
+
+        for target in targets:
+            seconds = (target.finished or time.monotonic()) - target.started
+            results[target.device] = WriteResult(
+                target.device, target.error is None, target.written, target.skipped,
+                seconds, str(target.error) if target.error else None
+            )
+
+    return [results[device] for device in devices]
+
+
+def _write_elevated(source, devices, progress, on_commit, options):
+    """Run write_image() as root through pkexec and relay what it reports."""
+    package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    # pkexec clears the environment, PYTHONPATH included
+    code = (f"import sys; sys.path.insert(0, {package_root!r}); "
+            "from altima_usb_installer import rawwrite; sys.exit(rawwrite.main())")
+    flags = [flag for flag, on in (("--direct", options.get("direct")),
+                                   ("--discard", options.get("discard_first")),
+                                   ("--skip-zeros", options.get("skip_zeros"))) if on]
+    if options.get("offset"):
+        flags += ["--offset", str(options["offset"])]
+    cmd = ventoy.privilege_prefix() + [
+        sys.executable, "-c", code, "--json", *flags, os.path.abspath(source), *devices
+    ]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    results = {}
+    for line in proc.stdout:
+        try:
+            message = json.loads(line)
+        except ValueError:
+            continue
+        if "progress" in message and progress:
+            progress(*message["progress"])
+        elif "commit" in message and on_commit:
+            on_commit(*message["commit"])
+        elif "result" in message:
+            result = WriteResult(**message["result"])
+            results[result.device] = result
+    error = proc.stderr.read().strip()
+    returncode = proc.wait()
+    if returncode in (126, 127) and not results:
+        error = "authorization was refused" if returncode == 126 else error
+    return [results.get(d) or WriteResult(d, False, 0, 0, 0.0, error or f"exit status {returncode}")
+            for d in devices]
+
+
+def write_sticks(source, devices, progress=None, on_commit=None, **options):
+    """write_image() for sticks as the desktop has them: mounted, and owned by root.
+
+    Every partition of each device is unmounted first (eject.unmount_disk()),
+    since O_EXCL fails on a mounted disk; then the write runs as root through
+    the same pkexec helper as the Ventoy install, unless we are root already.
+    on_commit and options are write_image()'s. Returns one WriteResult per device.
+    """
+    results = {}
+    ready = []
+    for device in devices:
+        try:
+            eject.unmount_disk(device)
+            ready.append(device)
+        except OSError as e:
+            results[device] = WriteResult(device, False, 0, 0, 0.0, f"could not unmount: {e}")
+    if ready:
+        if os.geteuid() == 0:
+            written = write_image(source, ready, progress=progress, on_commit=on_commit, **options)
+        else:
+            written = _write_elevated(source, ready, progress, on_commit, options)
+        results.update((r.device, r) for r in written)
+    return [results[device] for device in devices]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m altima_usb_installer.rawwrite")
+    parser.add_argument("image")
+    parser.add_argument("devices", nargs="+", metavar="DEVICE")
+    parser.add_argument("--direct", action="store_true", help="write with O_DIRECT")
+    parser.add_argument("--discard", action="store_true", help="discard each device first")
+    parser.add_argument("--skip-zeros", action="store_true",
+                        help="after a discard, leave zero blocks unwritten where that is safe")
+    parser.add_argument("--offset", type=int, default=0, metavar="BYTES",
+                        help="resume a write that is known to have got this far")
+    parser.add_argument("--json", action="store_true",
+                        help="report progress, commits and results as JSON lines")
+    args = parser.parse_args(argv)
+
+    def progress(device, done, total, rate):
+        if args.json:
+            print(json.dumps({"progress": [device, done, total, rate]}), flush=True)
+        else:
+            print(f"{device}: {done / total:.1%} at {rate / 2**20:.1f} MiB/s", flush=True)
+
+    def commit(device, offset):
+        print(json.dumps({"commit": [device, offset]}), flush=True)
+
+    results = write_sticks(args.image, args.devices, progress, commit if args.json else None,
+                           direct=args.direct, discard_first=args.discard,
+                           skip_zeros=args.skip_zeros, offset=args.offset)
+    for r in results:
+        if args.json:
+            print(json.dumps({"result": r._asdict()}), flush=True)
+        elif r.ok:
+            print(f"{r.device}: {r.bytes_written} bytes written, {r.bytes_skipped} skipped "
+                  f"in {r.seconds:.1f} s")
+        else:
+            print(f"{r.device}: {r.error}", file=sys.stderr)
+    return 0 if all(r.ok for r in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
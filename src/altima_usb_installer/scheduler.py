@@ -0,0 +1,551 @@
+"""Duplication-station scheduling: a queue of (device, ISO set, mode) jobs.
+
+Each mode is a pipeline of stages: copy, verify and eject for Ventoy sticks,
+write, verify and eject for raw images. A pool of workers takes the next
+runnable (job, stage). Stages that move bulk data only start while the
+stick's root port and bus are below the writer caps from topology.py, so
+sticks behind a saturated hub wait while sticks elsewhere keep going, and
+verifying stick A overlaps writing stick B. Jobs further down the pipeline
+go first so finished sticks come off the station at a steady rate.
+
+With a Journal (journal.py) every job, stage change and committed offset
+is made durable; resume() requeues whatever a crash or reboot interrupted
+at the stage it was in, found by name, and Ventoy copies and raw writes
+continue from the last fsynced byte.
+
+    python -m altima_usb_installer.scheduler [--mode ventoy|raw] [--workers N] [--probe] [--no-resume]
+                                             [--iso NAME ... DISK ...]
+"""
+import argparse
+import itertools
+import os
+import sys
+import threading
+import time
+from collections import namedtuple
+
+from altima_usb_installer import (
+    eject, hashing, history, journal, mounts, preflight, probe, rawwrite, sources, topology,
+    transfer, verify
+)
+
+DEFAULT_WORKERS = 4
+STATUS_INTERVAL = 5.0
+
+# Stages logged to the history database, and as what
+HISTORY_KINDS = {"copy": history.WRITE, "write": history.WRITE, "verify": history.VERIFY}
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+Stage = namedtuple("Stage", "name run uses_bus")
+
+# Digests of raw images by (path, size, mtime), shared by every job writing one
+_image_digests = {}
+_image_locks = {}
+_image_lock = threading.Lock()
+Metrics = namedtuple(
+    "Metrics", "queued running done failed queue_depth utilization jobs_per_hour elapsed"
+)
+
+
+class Job:
+    """One stick's trip through a pipeline; stages share results through data."""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, device, isos, mode, record=None, stage=0):
+        self.id = next(Job._ids)
+        self.key = record.key if record else journal.new_key()
+        # The journal's view of an interrupted run this job resumes, if any
+        self.record = record
+        self.journal = None
+        self.device = device
+        self.disk = mounts.disk_for_target(device) or os.path.basename(device)
+        self.isos = tuple(isos)
+        self.mode = mode
+        self.stage = stage
+        self.state = QUEUED
+        self.error = None
+        self.links = []
+        self.data = {}
+        self.progress = (0, 0)
+        self.submitted = time.monotonic()
+        self.finished = None
+
+    def __repr__(self):
+        return f"Job({self.id}, {self.device!r}, {self.mode!r}, {self.state})"
+
+
+class Scheduler:
+    """Run jobs through their mode's stages on a fixed pool of worker threads.
+
+    pipelines maps a mode to its list of Stages; each stage is called as
+    run(job, progress) with progress(done, total) and raises on failure.
+    on_change(job) is called from the worker after every state change.
+    With a history.History, copy, write and verify stages are logged to it.
+    """
+
+    def __init__(self, pipelines, workers=DEFAULT_WORKERS, on_change=None, locate=topology.locate,
+                 journal=None, history=None):
+        self.pipelines = pipelines
+        self.journal = journal
+        self.history = history
+        self.workers = workers
+        self.on_change = on_change
+        self.locate = locate
+        self.jobs = []
+        self.active = {}
+        self.cond = threading.Condition()
+        self.closed = False
+        self.stopping = False
+        self.busy = [0.0] * workers
+        # (record, error) for journalled jobs resume() could not place
+        self.rejected = []
+        self.started = None
+        self.threads = []
+
+    def submit(self, device, isos, mode, record=None):
+        if mode not in self.pipelines:
+            raise ValueError(f"unknown mode {mode!r}")
+        job = Job(device, isos, mode, record, self._resume_stage(record) if record else 0)
+        job.journal = self.journal
+        job.links = topology.link_limits(self.locate(job.disk))
+        with self.cond:
+            if self.closed:
+                raise RuntimeError("scheduler no longer accepts jobs")
+            if self.journal is not None and record is None:
+                self.journal.submitted(job.key, device, job.isos, mode)
+            self.jobs.append(job)
+            self.cond.notify_all()
+        return job
+
+    def _resume_stage(self, record):
+        """Index in this run's pipeline of the stage record was interrupted in.
+
+        Stages are matched by name, since indexes shift when the pipeline
+        differs between runs (e.g. with and without --probe). Raises
+        ValueError for a stage this pipeline does not have.
+        """
+        names = [stage.name for stage in self.pipelines[record.mode]]
+        if record.stage_name is None and record.stage == 0:
+            # Submitted but never started
+            return 0
+        if record.stage_name not in names:
+            raise ValueError(f"stopped in stage {record.stage_name or record.stage!r}, "
+                             f"which this {record.mode} pipeline does not have")
+        return names.index(record.stage_name)
+
+    def resume(self):
+        """Requeue the journal's unfinished jobs; returns the new Jobs.
+
+        Jobs that do not fit the current pipelines are closed in the journal
+        as failed and listed in rejected.
+        """
+        if self.journal is None:
+            return []
+        jobs = []
+        for r in self.journal.unfinished():
+            if r.mode not in self.pipelines:
+                continue
+            try:
+                jobs.append(self.submit(r.device, r.isos, r.mode, r))
+            except ValueError as e:
+                self.rejected.append((r, e))
+                self.journal.finished(r.key, False, str(e))
+        return jobs
+
+    def start(self):
+        self.started = time.monotonic()
+        self.threads = [
+            threading.Thread(target=self._work, args=(i,), name=f"station-{i}", daemon=True)
+            for i in range(self.workers)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def close(self):
+        """Take no more jobs; workers exit once everything queued has finished."""
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def stop(self):
+        """Let running stages finish but start no new ones."""
+        with self.cond:
+            self.closed = self.stopping = True
+            self.cond.notify_all()
+
+    def wait(self, timeout=None):
+        """Close the queue and wait for the workers; False if timeout ran out first."""
+        self.close()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in self.threads:
+            thread.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+        return not any(thread.is_alive() for thread in self.threads)
+
+    def _admissible(self, job):
+        stage = self.pipelines[job.mode][job.stage]
+        return not stage.uses_bus or all(self.active.get(k, 0) < limit for k, limit in job.links)
+
+    def _pick(self):
+        waiting = [j for j in self.jobs if j.state == QUEUED]
+        # Later stages first, then submission order
+        for job in sorted(waiting, key=lambda j: -j.stage):
+            if self._admissible(job):
+                return job
+        return None
+
+    def _pending(self):
+        return any(j.state in (QUEUED, RUNNING) for j in self.jobs)
+
+    def _work(self, index):
+        while True:
+            with self.cond:
+                job = None
+                while not self.stopping:
+                    job = self._pick()
+                    if job is not None or (self.closed and not self._pending()):
+                        break
+                    self.cond.wait()
+                if job is None:
+                    return
+                stage = self.pipelines[job.mode][job.stage]
+                job.state = RUNNING
+                job.progress = (0, 0)
+                if stage.uses_bus:
+                    for key, _ in job.links:
+                        self.active[key] = self.active.get(key, 0) + 1
+            if self.journal is not None:
+                self.journal.stage(job.key, job.stage, stage.name)
+            self._notify(job)
+
+            def progress(done, total, job=job):
+                job.progress = (done, total)
+
+            began = time.monotonic()
+            error = None
+            try:
+                stage.run(job, progress)
+            except Exception as e:
+                error = e
+            if self.history is not None and stage.name in HISTORY_KINDS and job.record is None:
+                self._log(job, stage, time.monotonic() - began, error)
+            with self.cond:
+                self.busy[index] += time.monotonic() - began
+                if stage.uses_bus:
+                    for key, _ in job.links:
+                        self.active[key] -= 1
+                if error is not None:
+                    job.state = FAILED
+                    job.error = error
+                elif job.stage + 1 < len(self.pipelines[job.mode]):
+                    job.stage += 1
+                    job.state = QUEUED
+                else:
+                    job.state = DONE
+                if job.state in (DONE, FAILED):
+                    job.finished = time.monotonic()
+                self.cond.notify_all()
+            if self.journal is not None and job.state in (DONE, FAILED):
+                self.journal.finished(job.key, job.state == DONE, str(error) if error else None)
+            self._notify(job)
+
+    def _log(self, job, stage, seconds, error):
+        stick = job.data.get("stick") or probe.identify(job.disk)
+        job.data["stick"] = stick
+        isos = job.isos[:1] if job.mode == "raw" else job.isos
+        size = job.progress[1] or sum(os.path.getsize(p) for p in isos)
+        self.history.record(HISTORY_KINDS[stage.name], size, seconds, ok=error is None, error=error,
+                            iso=",".join(os.path.basename(p) for p in isos),
+                            device_model=stick.model, device_serial=stick.serial)
+
+    def _notify(self, job):
+        if self.on_change:
+            self.on_change(job)
+
+    def stage_name(self, job):
+        return self.pipelines[job.mode][job.stage].name
+
+    def metrics(self):
+        with self.cond:
+            elapsed = time.monotonic() - self.started if self.started else 0.0
+            counts = {state: 0 for state in (QUEUED, RUNNING, DONE, FAILED)}
+            depth = {}
+            for job in self.jobs:
+                counts[job.state] += 1
+                if job.state == QUEUED:
+                    name = self.stage_name(job)
+                    depth[name] = depth.get(name, 0) + 1
+            return Metrics(
+                queued=counts[QUEUED],
+                running=counts[RUNNING],
+                done=counts[DONE],
+                failed=counts[FAILED],
+                queue_depth=depth,
+                utilization=[b / elapsed if elapsed else 0.0 for b in self.busy],
+                jobs_per_hour=counts[DONE] * 3600 / elapsed if elapsed else 0.0,
+                elapsed=elapsed,
+            )
+
+
+def _device_node(job):
+    return job.device if job.device.startswith("/dev/") else "/dev/" + job.disk
+
+
+def _ventoy_mount(job):
+    volume = mounts.find_ventoy_volumes([job.disk]).get(job.disk)
+    if volume is None or not volume.mountpoint:
+        raise OSError(f"{job.disk} has no mounted Ventoy partition")
+    return volume.mountpoint
+
+
+def copy_to_ventoy(job, progress):
+    """Copy the job's ISOs onto the Ventoy partition, hashing them on the way.
+
+    The ISOs go on back to back, largest first; a fresh job checks space
+    for all of them and reserves the new ones before the first write, so
+    each gets one long run. A
+    resumed job re-hashes the committed part of each target from the stick
+    and copies only the rest. The stick is flushed once, by eject_stick.
+    """
+    mount = _ventoy_mount(job)
+    paths = sorted(job.isos, key=os.path.getsize, reverse=True)
+    sizes = {os.path.basename(p): os.path.getsize(p) for p in paths}
+    if job.record is None:
+        reserved = preflight.open_reserved_files(mount, sizes)
+    else:
+        preflight.check_files(mount, sizes)
+        reserved = {}
+    total = sum(sizes.values())
+    recorders = job.data["recorders"] = {}
+    stats = job.data["pipeline"] = transfer.PipelineStats()
+    # One stick and one source for every ISO: later copies start where the last settled
+    tuner = transfer.Tuner()
+    done = 0
+    try:
+        for path in paths:
+            name = os.path.basename(path)
+            dest = os.path.join(mount, name)
+            recorder = verify.DigestRecorder()
+            base = done
+            offset = journal.resume_offset(job.record, dest)
+            if offset:
+                hashing.feed_file(dest, [recorder], uncached=True, length=offset)
+            f = reserved.pop(name, None) or preflight.open_reserved(dest, sizes[name], offset=offset)
+            with sources.FileStream(path, offset) as stream, f:
+                checkpoint = journal.Checkpoint(job.journal, job.key, dest, f, offset)
+
+                def update(data):
+                    recorder.update(data)
+                    checkpoint(data)
+
+                transfer.copy(stream, f.write, update=update, stats=stats, tuner=tuner,
+                              progress=lambda read, size: progress(base + offset + read, total))
+                checkpoint.commit()
+            recorders[dest] = recorder.finish()
+            done += sizes[name]
+    finally:
+        # Only files this job created are left; empty, they would show up in the Ventoy menu
+        for name, f in reserved.items():
+            f.close()
+            os.remove(os.path.join(mount, name))
+
+
+def verify_ventoy(job, progress):
+    recorders = job.data.get("recorders")
+    if recorders is None:
+        # Resumed at this stage: the source ISOs say what the stick should hold
+        recorders = {
+            os.path.join(_ventoy_mount(job), os.path.basename(p)): verify.record_file(p)
+            for p in job.isos
+        }
+    verified = job.record.verified if job.record else {}
+    total = sum(r.size for r in recorders.values())
+    done = 0
+    for dest, recorder in recorders.items():
+        base = done
+        done += recorder.size
+        if verified.get(dest) == [[0, recorder.size]]:
+            continue
+        result = verify.verify_file(dest, recorder,
+                                    progress=lambda checked, _: progress(base + checked, total))
+        if not result.ok:
+            raise OSError(f"{dest} reads back wrong")
+        if job.journal is not None:
+            job.journal.verified(job.key, dest, 0, recorder.size)
+
+
+def write_raw(job, progress):
+    """dd the image to the stick, journalling each fsynced offset.
+
+    A resumed job carries on from the last offset it journalled for the
+    device node.
+    """
+    image = job.isos[0]
+    device = _device_node(job)
+    offset = job.record.committed.get(device, 0) if job.record else 0
+
+    def committed(_, offset):
+        if job.journal is not None:
+            job.journal.committed(job.key, device, offset)
+
+    result = rawwrite.write_sticks(
+        image, [device], progress=lambda _, done, total, rate: progress(done, total),
+        on_commit=committed, offset=offset
+    )[0]
+    if not result.ok:
+        raise OSError(result.error)
+
+
+def image_digests(image):
+    """hashing.hash_file(image).digests, computed once per version of the image.
+
+    Jobs verifying the same image at the same time wait for one hash
+    instead of each reading it again.
+    """
+    st = os.stat(image)
+    key = (os.path.abspath(image), st.st_size, st.st_mtime_ns)
+    with _image_lock:
+        lock = _image_locks.setdefault(key, threading.Lock())
+    with lock:
+        if key not in _image_digests:
+            _image_digests[key] = hashing.hash_file(image).digests
+        return _image_digests[key]
+
+
+def verify_raw(job, progress):
+    image = job.isos[0]
+    size = os.path.getsize(image)
+    expected = image_digests(image)
+    actual = hashing.hash_file(_device_node(job), uncached=True, length=size, progress=progress).digests
+    if actual != expected:
+        raise OSError(f"{job.disk} reads back wrong")
+
+
+def eject_stick(job, progress):
+    eject.eject_disk(_device_node(job))
+
+
+def probe_stick(job, progress):
+    """Reject counterfeit or too small sticks before anything is written.
+
+    The capacity check needs the stick unmounted, so Ventoy sticks rely on
+    an earlier probe cached for the same serial.
+    """
+    result = job.data["probe"] = probe.probe(job.disk, capacity=job.mode == "raw", progress=progress)
+    if result.fake:
+        raise OSError(f"{job.disk} is counterfeit: {probe.describe(result)}")
+    need = sum(os.path.getsize(p) for p in job.isos)
+    limit = result.real_capacity or result.reported_size
+    if limit and need > limit:
+        raise OSError(f"{job.disk} holds {limit} bytes, the job needs {need}")
+
+
+def with_probe(pipelines):
+    """The same pipelines with a probe stage in front of each."""
+    return {mode: [Stage("probe", probe_stick, True)] + stages for mode, stages in pipelines.items()}
+
+
+PIPELINES = {
+    "ventoy": [
+        Stage("copy", copy_to_ventoy, True),
+        Stage("verify", verify_ventoy, True),
+        Stage("eject", eject_stick, False),
+    ],
+    "raw": [
+        Stage("write", write_raw, True),
+        Stage("verify", verify_raw, True),
+        Stage("eject", eject_stick, False),
+    ],
+}
+
+
+def format_metrics(metrics):
+    depth = ", ".join(f"{name} {count}" for name, count in metrics.queue_depth.items()) or "empty"
+    busy = " ".join(f"{u:.0%}" for u in metrics.utilization)
+    return (f"{metrics.done} done, {metrics.failed} failed, {metrics.running} running; "
+            f"queue: {depth}; workers: {busy}; {metrics.jobs_per_hour:.1f} jobs/h")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m altima_usb_installer.scheduler",
+        description="Write the same ISO set to many sticks, respecting USB topology."
+    )
+    parser.add_argument("disks", nargs="*", metavar="DISK")
+    parser.add_argument("--iso", action="append", default=[],
+                        help="ISO file or catalog file name (repeatable; raw mode uses the first)")
+    parser.add_argument("--mode", choices=sorted(PIPELINES), default="ventoy")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--probe", action="store_true",
+                        help="measure each stick and reject fakes before writing")
+    parser.add_argument("--no-resume", action="store_true",
+                        help="do not pick up jobs an earlier run left unfinished")
+    args, rest = parser.parse_known_args(argv)
+    if args.disks and not args.iso:
+        parser.error("--iso is required with disks")
+
+    source = None
+    isos = []
+    for name in args.iso:
+        if not os.path.isfile(name):
+            source = source or sources.configured(rest)
+            print(f"Fetching {name}...")
+            name = sources.fetch_to_cache(source, name)
+        isos.append(name)
+
+    def on_change(job):
+        if job.state == RUNNING:
+            status = scheduler.stage_name(job)
+        elif job.state == QUEUED:
+            status = "waiting for " + scheduler.stage_name(job)
+        else:
+            status = job.state + (f": {job.error}" if job.error else "")
+            if "pipeline" in job.data:
+                status += f" (copy {job.data['pipeline'].format()})"
+        print(f"{job.disk}: {status}")
+
+    job_journal = journal.Journal()
+    job_history = history.History()
+    pipelines = with_probe(PIPELINES) if args.probe else PIPELINES
+    scheduler = Scheduler(pipelines, args.workers, on_change, journal=job_journal,
+                          history=job_history)
+    if not args.no_resume:
+        for job in scheduler.resume():
+            print(f"{job.disk}: resuming at {scheduler.stage_name(job)}")
+        for record, error in scheduler.rejected:
+            print(f"{record.device}: not resuming, {error}")
+    for disk in args.disks:
+        job = scheduler.submit(disk, isos, args.mode)
+        print(f"{job.disk}: {topology.describe(scheduler.locate(job.disk))}")
+    if not scheduler.jobs:
+        print("Nothing to do.")
+        return 0
+    if args.disks:
+        size = sum(os.path.getsize(p) for p in (isos[:1] if args.mode == "raw" else isos))
+        models = {probe.identify(mounts.disk_for_target(d) or os.path.basename(d)).model
+                  for d in args.disks}
+        model = models.pop() if len(models) == 1 else None
+        estimate = job_history.batch_eta(size, len(args.disks), args.workers, device_model=model)
+        print(f"Estimated time for {len(args.disks)} sticks: {history.format_duration(estimate)}")
+    scheduler.start()
+    try:
+        while not scheduler.wait(STATUS_INTERVAL):
+            print(format_metrics(scheduler.metrics()))
+    except KeyboardInterrupt:
+        print("Stopping after the running stages...")
+        scheduler.stop()
+        scheduler.wait()
+    print(format_metrics(scheduler.metrics()))
+    if not scheduler.stopping:
+        job_journal.compact()
+    job_journal.close()
+    job_history.close()
+    return 0 if all(j.state == DONE for j in scheduler.jobs) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,341 @@
+"""Serve mode: share this machine's ISO/Ventoy cache with the room.
+
+    python -m altima_usb_installer.server [--port N] [--source URL|DIR]
+                                          [--cache DIR] [--no-advertise]
+
+Cached files are served with Range, ETag/If-None-Match and If-Range
+support. A file that is not cached yet is fetched once from the upstream
+source and streamed to every client while it is still being written, so the
+room shares a single download. The catalog is refreshed from upstream at
+most every CATALOG_TTL seconds and the cached copy is served when offline.
+The server answers discovery probes (peers.py) unless told not to.
+"""
+import argparse
+import json
+import os
+import posixpath
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlparse
+
+from altima_usb_installer import hedged, peers, sources, transfer
+
+DEFAULT_PORT = 8765
+CATALOG_TTL = 60
+SEND_CHUNK = 1024 * 1024
+
+_RANGE = re.compile(r"bytes=(\d*)-(\d*)$")
+
+
+class _Fill:
+    """One upstream download into the cache that clients can read as it grows."""
+
+    def __init__(self, path):
+        self.path = path
+        self.part = path + ".part"
+        self.size = None
+        self.written = 0
+        self.done = False
+        self.error = None
+        self.cond = threading.Condition()
+
+    def wait_started(self):
+        with self.cond:
+            while self.size is None and self.error is None:
+                self.cond.wait()
+
+    def wait_for(self, offset):
+        """Block until bytes past offset exist or the fill ended; return bytes written."""
+        with self.cond:
+            while self.written <= offset and not self.done and self.error is None:
+                self.cond.wait()
+            return self.written
+
+
+class CacheServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, cache, upstream):
+        super().__init__(address, CacheHandler)
+        self.cache = cache
+        self.upstream = upstream
+        self.fills = {}
+        self.lock = threading.Lock()
+        self._catalog_checked = 0.0
+
+    def refresh_catalog(self):
+        now = time.monotonic()
+        with self.lock:
+            if now - self._catalog_checked < CATALOG_TTL:
+                return
+            self._catalog_checked = now
+        try:
+            data = json.dumps(hedged.fetch_catalog(self.upstream), indent=2).encode()
+        except (OSError, ValueError) as e:
+            self.log_message("catalog refresh failed, serving cached copy: %s", e)
+            return
+        finally:
+            self.log_message("%s", hedged.format_stats(hedged.stats()))
+        path = os.path.join(self.cache, sources.CATALOG_NAME)
+        with open(path + ".part", "wb") as f:
+            f.write(data)
+        os.replace(path + ".part", path)
+
+    def lookup(self, name):
+        """Return a finished path, an in-progress _Fill, or None."""
+        path = os.path.join(self.cache, name)
+        with self.lock:
+            fill = self.fills.get(name)
+            if fill is not None:
+                return fill
+            if os.path.isfile(path):
+                return path
+            if name == sources.CATALOG_NAME:
+                return None
+            fill = self.fills[name] = _Fill(path)
+        threading.Thread(target=self._fill, args=(name, fill), daemon=True).start()
+        return fill
+
+    def _fill(self, name, fill):
+        try:
+            with transfer.open_resumable(self.upstream, name) as stream, open(fill.part, "wb") as f:
+                with fill.cond:
+                    fill.size = stream.size
+                    fill.cond.notify_all()
+                for chunk in stream.iter_chunks():
+                    f.write(chunk)
+                    f.flush()
+                    with fill.cond:
+                        fill.written += len(chunk)
+                        fill.cond.notify_all()
+            os.replace(fill.part, fill.path)
+        except OSError as e:
+            self.log_message("fetching %s failed: %s", name, e)
+            if os.path.exists(fill.part):
+                os.remove(fill.part)
+            with fill.cond:
+                fill.error = e
+                fill.cond.notify_all()
+        else:
+            with fill.cond:
+                fill.done = True
+                fill.cond.notify_all()
+        finally:
+            with self.lock:
+                self.fills.pop(name, None)
+
+    def log_message(self, fmt, *args):
+        sys.stderr.write("altima-cache: " + (fmt % args) + "\n")
+
+
+def _etag(st):
+    return f'"{st.st_size:x}-{st.st_mtime_ns:x}"'
+
+
+def _parse_range(header, size):
+    """Return (start, end) inclusive, None for no usable range, or False if unsatisfiable."""
+    match = _RANGE.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first:
+        if not last:
+            return None
+        start, end = max(0, size - int(last)), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+class CacheHandler(BaseHTTPRequestHandler):
+    server_version = "AltimaCache/1"
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self._serve(head=False)
+
+    def do_HEAD(self):
+        self._serve(head=True)
+
+    def log_message(self, fmt, *args):
+        self.server.log_message("%s %s", self.address_string(), fmt % args)
+
+    def _error(self, code, headers=()):
+        self.send_response(code)
+        for key, value in headers:
+            self.send_header(key, value)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def _serve(self, head):
+        name = unquote(urlparse(self.path).path).lstrip("/")
+        # The cache is flat; never hand out partial downloads, dotfiles or
+        # the journal, history and probe results older versions kept there
+        if (not name or name != posixpath.basename(name) or "\\" in name
+                or name.startswith(".") or name.endswith(".part")
+                or name.startswith(sources.STATE_FILES)):
+            self._error(404)
+            return
+        if name == sources.CATALOG_NAME:
+            self.server.refresh_catalog()
+
+        entry = self.server.lookup(name)
+        try:
+            if entry is None:
+                self._error(404)
+            elif isinstance(entry, _Fill):
+                self._serve_fill(entry, head)
+            else:
+                self._serve_file(entry, name, head)
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+    def _headers(self, code, name, length, extra=()):
+        self.send_response(code)
+        ctype = "application/json" if name.endswith(".json") else "application/octet-stream"
+        self.send_header("Content-Type", ctype)
+        self.send_header("Accept-Ranges", "bytes")
+        if length is None:
+            self.send_header("Connection", "close")
+            self.close_connection = True
+        else:
+            self.send_header("Content-Length", str(length))
+        for key, value in extra:
+            self.send_header(key, value)
+        self.end_headers()
+
+    def _serve_file(self, path, name, head):
+        with open(path, "rb") as f:
+            st = os.fstat(f.fileno())
+            etag = _etag(st)
+            if etag in [t.strip() for t in self.headers.get("If-None-Match", "").split(",")]:
+                self._error(304, [("ETag", etag)])
+                return
+
+            size = st.st_size
+            span = None
+            range_header = self.headers.get("Range")
+            if range_header and self.headers.get("If-Range", etag) == etag:
+                span = _parse_range(range_header, size)
+            if span is False:
+                self._error(416, [("Content-Range", f"bytes */{size}")])
+                return
+
+            start, end = span or (0, size - 1)
+            extra = [("ETag", etag)]
+            if span:
+                extra.append(("Content-Range", f"bytes {start}-{end}/{size}"))
+            self._headers(206 if span else 200, name, end - start + 1, extra)
+            if not head and end >= start:
+                self.wfile.flush()
+                self.connection.sendfile(f, start, end - start + 1)
+
+    def _serve_fill(self, fill, head):
+        fill.wait_started()
+        if fill.error is not None:
+            self._error(404 if fill.size is None else 502)
+            return
+
+        name = os.path.basename(fill.path)
+        size = fill.size or None
+        span = None
+        range_header = self.headers.get("Range")
+        # No ETag exists until the file is complete, so If-Range never matches
+        if size and range_header and "If-Range" not in self.headers:
+            span = _parse_range(range_header, size)
+        if span is False:
+            self._error(416, [("Content-Range", f"bytes */{size}")])
+            return
+
+        if span:
+            start, end = span
+            self._headers(206, name, end - start + 1,
+                          [("Content-Range", f"bytes {start}-{end}/{size}")])
+        else:
+            start, end = 0, (size - 1 if size else None)
+            self._headers(200, name, size)
+        if head:
+            return
+
+        try:
+            f = open(fill.part, "rb")
+        except FileNotFoundError:
+            # Finished and renamed between the lookup and now
+            f = open(fill.path, "rb")
+        with f:
+            pos = start
+            while end is None or pos <= end:
+                available = fill.wait_for(pos)
+                if available <= pos:
+                    if fill.error is not None:
+                        # Truncate the response so the client sees the failure
+                        self.close_connection = True
+                    break
+                stop = available if end is None else min(available, end + 1)
+                while pos < stop:
+                    data = os.pread(f.fileno(), min(SEND_CHUNK, stop - pos), pos)
+                    if not data:
+                        break
+                    self.wfile.write(data)
+                    pos += len(data)
+
+
+def serve(port=DEFAULT_PORT, cache=None, upstream=None, advertise=True, bind=""):
+    """Create the server and its discovery responder; the caller runs serve_forever()."""
+    cache = cache or sources.cache_dir()
+    os.makedirs(cache, exist_ok=True)
+    # Moves state an older version left in the cache out of what is shared
+    sources.state_dir()
+    if upstream is None:
+        upstream = sources.from_spec(os.environ.get(sources.SOURCE_ENV) or sources.DEFAULT_SOURCE)
+    httpd = CacheServer((bind, port), cache, upstream)
+    responder = None
+    if advertise:
+        responder = peers.Responder(httpd.server_address[1])
+        responder.start()
+    return httpd, responder
+
+
+def serve_in_background(port=DEFAULT_PORT, cache=None, upstream=None, advertise=True):
+    """Run a cache server on a daemon thread next to a GUI."""
+    httpd, responder = serve(port, cache, upstream, advertise)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd, responder
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m altima_usb_installer.server",
+        description="Share the ISO/Ventoy download cache with other installers on the LAN."
+    )
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--bind", default="", help="address to listen on (default: all)")
+    parser.add_argument("--cache", help="directory to serve (default: the download cache)")
+    parser.add_argument("--source", help="upstream URL or directory for files not cached yet")
+    parser.add_argument("--no-advertise", action="store_true",
+                        help="do not answer discovery probes; clients must use --peer")
+    args = parser.parse_args(argv)
+
+    upstream = sources.from_spec(args.source) if args.source else None
+    httpd, responder = serve(args.port, args.cache, upstream, not args.no_advertise, args.bind)
+    print(f"Serving {httpd.cache} on port {httpd.server_address[1]} "
+          f"(upstream {httpd.upstream!r})")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        if responder:
+            responder.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,94 @@
+"""Toolkit-neutral slideshow for the right-hand panel.
+
+Each slide is decoded and scaled once by a toolkit-supplied render()
+callback and kept in a small LRU cache, so a tick only swaps a pre-rendered
+frame. Rotation pauses while the window is hidden, while a caller holds a
+pause reason, or while the machine's load says the CPU is saturated.
+"""
+import os
+from collections import OrderedDict
+
+DEFAULT_CAPACITY = 3
+LOAD_THRESHOLD = 0.9
+
+
+def cpu_saturated(threshold=LOAD_THRESHOLD):
+    """True when the 1-minute load average per CPU is at or above threshold."""
+    try:
+        load = os.getloadavg()[0]
+    except (AttributeError, OSError):
+        # Not available on Windows
+        return False
+    return load / (os.cpu_count() or 1) >= threshold
+
+
+class FrameCache:
+    def __init__(self, render, capacity=DEFAULT_CAPACITY):
+        self.render = render
+        self.capacity = capacity
+        self._frames = OrderedDict()
+
+    def get(self, path, size):
+        key = (path, size)
+        frame = self._frames.get(key)
+        if frame is None:
+            frame = self.render(path, *size)
+            self._frames[key] = frame
+            while len(self._frames) > self.capacity:
+                self._frames.popitem(last=False)
+        else:
+            self._frames.move_to_end(key)
+        return frame
+
+    def clear(self):
+        self._frames.clear()
+
+
+class Slideshow:
+    """Rotate pre-rendered slides; the toolkit's timer calls tick().
+
+    render(path, width, height) returns a scaled frame (a GdkPixbuf, a
+    QPixmap, ...) and show(frame) puts it on screen.
+    """
+
+    def __init__(self, paths, render, show, capacity=DEFAULT_CAPACITY,
+                 load_threshold=LOAD_THRESHOLD, size_step=20):
+        self.paths = [p for p in paths if os.path.exists(p)]
+        self.cache = FrameCache(render, max(capacity, 1))
+        self.show = show
+        self.load_threshold = load_threshold
+        self.size_step = size_step
+        self.index = 0
+        self.size = None
+        self._paused = set()
+
+    def pause(self, reason="user"):
+        self._paused.add(reason)
+
+    def resume(self, reason="user"):
+        self._paused.discard(reason)
+
+    @property
+    def paused(self):
+        return bool(self._paused)
+
+    def set_size(self, width, height):
+        # Quantise so a window drag does not re-render on every pixel
+        step = self.size_step
+        size = (max(step, width - width % step), max(step, height - height % step))
+        if size != self.size:
+            self.size = size
+            self.cache.clear()
+            self.show_current()
+
+    def show_current(self):
+        if self.paths and self.size:
+            self.show(self.cache.get(self.paths[self.index], self.size))
+
+    def tick(self, visible=True):
+        """Advance one slide unless paused; returns True to keep GLib timeouts alive."""
+        if (visible and not self._paused and len(self.paths) > 1
+                and not cpu_saturated(self.load_threshold)):
+            self.index = (self.index + 1) % len(self.paths)
+            self.show_current()
+        return True
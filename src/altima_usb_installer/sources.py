@@ -0,0 +1,509 @@
+"""Where the catalog, ISOs, checksums and Ventoy releases come from.
+
+A source is either an HTTP(S) base URL (the public mirror or a LAN mirror)
+or a local directory / file:// URL laid out like the download site, with an
+altima-iso-list.json next to the ISOs. Several sources can be chained with
+commas; each request falls through to the next one on failure.
+
+The source is taken from --source on the command line, then the
+ALTIMA_SOURCE environment variable, then the public mirror. configured()
+puts the local download cache and any LAN cache servers (--peer,
+ALTIMA_PEER, or found by broadcast; see peers.py) in front of it.
+"""
+import glob
+import hashlib
+import json
+import os
+import posixpath
+import select
+import shutil
+import socket
+import ssl
+import time
+from urllib.parse import unquote, urljoin, urlparse
+from urllib.request import url2pathname
+
+import requests
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Windows; splice() is Linux-only anyway
+
+from altima_usb_installer import hashing, peers, preflight, transfer
+
+DEFAULT_SOURCE = "https://download.altimalinux.com/"
+CATALOG_NAME = "altima-iso-list.json"
+SOURCE_ENV = "ALTIMA_SOURCE"
+PEER_ENV = "ALTIMA_PEER"
+CACHE_ENV = "ALTIMA_CACHE"
+STATE_ENV = "ALTIMA_STATE"
+DISCOVER_ENV = "ALTIMA_DISCOVER"
+CHUNK_SIZE = 1024 * 1024
+# Pipe size asked for when splicing a socket into a file
+SPLICE_PIPE_SIZE = 1024 * 1024
+F_SETPIPE_SZ = 1031
+# The journal, transfer history and probe results; older versions kept them
+# in the download cache, where serve mode handed them to anyone who asked
+STATE_FILES = ("journal.jsonl", "history.db", "probes.json")
+
+
+class SourceError(OSError):
+    pass
+
+
+def file_name(name):
+    """The file a name refers to; upstream URLs are mirrored by basename."""
+    return posixpath.basename(urlparse(name).path) if "://" in name else name
+
+
+def cache_dir():
+    """Directory downloads are kept in, and that serve mode shares."""
+    path = os.environ.get(CACHE_ENV)
+    if not path:
+        if os.name == "nt":
+            base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+        else:
+            base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+        path = os.path.join(base, "altima-usb-installer")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def state_dir():
+    """Directory for this machine's own records, kept out of the shared cache.
+
+    They name hosts, sticks and serial numbers. Files an older version left
+    in the cache are moved here.
+    """
+    path = os.environ.get(STATE_ENV)
+    if not path:
+        if os.name == "nt":
+            base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+            path = os.path.join(base, "altima-usb-installer-state")
+        else:
+            base = os.environ.get("XDG_STATE_HOME") or os.path.expanduser("~/.local/state")
+            path = os.path.join(base, "altima-usb-installer")
+    os.makedirs(path, exist_ok=True)
+    cache = cache_dir()
+    if os.path.realpath(cache) != os.path.realpath(path):
+        for name in os.listdir(cache):
+            if name.startswith(STATE_FILES) and not os.path.exists(os.path.join(path, name)):
+                shutil.move(os.path.join(cache, name), os.path.join(path, name))
+    return path
+
+
+class HttpStream:
+    """A (possibly ranged) HTTP response exposing size and chunk iteration.
+
+    size is the whole resource's size (0 if unknown), even for a range.
+    readinto() receives straight into a caller's buffer, and splice() moves
+    a plain-HTTP body from the socket to a file without passing through
+    Python at all (Linux); both bypass requests' per-chunk bytes objects.
+    """
+
+    def __init__(self, response, offset):
+        self.response = response
+        self.offset = offset
+        self.url = response.url
+        self.length = int(response.headers.get("content-length", 0))
+        total = response.headers.get("content-range", "").rpartition("/")[2]
+        if total.isdigit():
+            self.size = int(total)
+        else:
+            self.size = offset + self.length if self.length else 0
+        # http.client's response under urllib3; it reads into buffers directly
+        self._fp = None if response.headers.get("content-encoding") else getattr(response.raw, "_fp", None)
+        self._pipe = None
+        self._head = b""
+        self._left = self.length
+
+    def iter_chunks(self, chunk_size=CHUNK_SIZE):
+        for chunk in self.response.iter_content(chunk_size=chunk_size):
+            if chunk:
+                yield chunk
+
+    def readinto(self, b):
+        """Fill up to len(b) bytes of b; 0 at the end of the body."""
+        if self._fp is not None:
+            return self._fp.readinto(b)
+        data = self.response.raw.read(len(b), decode_content=True)
+        b[:len(data)] = data
+        return len(data)
+
+    def _socket(self):
+        raw = self.response.raw
+        sock = getattr(getattr(raw, "_connection", None), "sock", None)
+        if sock is None:
+            fp = getattr(getattr(raw, "_fp", None), "fp", None)
+            sock = getattr(getattr(fp, "raw", None), "_sock", None)
+        return sock
+
+    def can_splice(self):
+        """True for an unencoded, unchunked body on a plain TCP socket."""
+        if not hasattr(os, "splice") or self._fp is None or not self.length:
+            return False
+        if self.response.headers.get("transfer-encoding"):
+            return False
+        sock = self._socket()
+        return sock is not None and not isinstance(sock, ssl.SSLSocket)
+
+    def splice(self, fd, count, received=None):
+        """Move up to count body bytes to fd at its position; 0 at the end.
+
+        received(n), if given, is called once the bytes are off the socket,
+        before they are written to fd.
+        """
+        if self._pipe is None:
+            self._pipe = os.pipe()
+            try:
+                fcntl.fcntl(self._pipe[1], F_SETPIPE_SZ, SPLICE_PIPE_SIZE)
+            except OSError:
+                pass
+            # Whatever http.client read past the headers is still in its buffer
+            self._head = self._fp.fp.read1(SPLICE_PIPE_SIZE)
+            self._left -= len(self._head)
+        if self._head:
+            if received:
+                received(0)
+            n = os.write(fd, self._head[:count])
+            self._head = self._head[n:]
+            return n
+        if self._left <= 0:
+            return 0
+        sock = self._socket()
+        while True:
+            try:
+                n = os.splice(sock.fileno(), self._pipe[1], min(count, self._left, SPLICE_PIPE_SIZE))
+                break
+            except BlockingIOError:
+                # requests' timeout puts the socket in non-blocking mode
+                if not select.select([sock], [], [], sock.gettimeout())[0]:
+                    raise socket.timeout(f"{self.url}: read timed out")
+        if received:
+            received(n)
+        moved = 0
+        while moved < n:
+            moved += os.splice(self._pipe[0], fd, n - moved)
+        self._left -= n
+        return n
+
+    def close(self):
+        if self._pipe is not None:
+            for pipe_fd in self._pipe:
+                os.close(pipe_fd)
+            self._pipe = None
+        self.response.close()
+
+    def abort(self):
+        """Break off the transfer from another thread; a blocked read then fails."""
+        sock = self._socket()
+        if sock is None:
+            self.response.close()
+            return
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class FileStream:
+    def __init__(self, path, offset, length=None):
+        self.url = "file://" + os.path.abspath(path)
+        self.offset = offset
+        self.size = os.path.getsize(path)
+        self._left = self.size - offset if length is None else length
+        self._f = open(path, "rb")
+        self._f.seek(offset)
+
+    def iter_chunks(self, chunk_size=CHUNK_SIZE):
+        while self._left > 0:
+            chunk = self._f.read(min(chunk_size, self._left))
+            if not chunk:
+                break
+            self._left -= len(chunk)
+            yield chunk
+
+    def readinto(self, b):
+        view = memoryview(b)[:max(0, min(len(b), self._left))]
+        n = self._f.readinto(view) if view else 0
+        self._left -= n
+        return n
+
+    def close(self):
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class HttpSource:
+    def __init__(self, base_url, session=None):
+        self.base_url = base_url if base_url.endswith("/") else base_url + "/"
+        self.session = session or requests.Session()
+
+    def __repr__(self):
+        return f"HttpSource({self.base_url!r})"
+
+    def url(self, name):
+        # Absolute URLs (e.g. a GitHub release) pass through untouched
+        return urljoin(self.base_url, name)
+
+    def local_path(self, name):
+        return None
+
+    def fetch_bytes(self, name, timeout=5):
+        r = self.session.get(self.url(name), timeout=timeout)
+        r.raise_for_status()
+        return r.content
+
+    def fetch_catalog(self, timeout=5):
+        return json.loads(self.fetch_bytes(CATALOG_NAME, timeout))
+
+    def open(self, name, offset=0, timeout=10, length=None):
+        """Stream name from offset; length limits it to one byte range."""
+        headers = {}
+        if length is not None:
+            headers["Range"] = f"bytes={offset}-{offset + length - 1}"
+        elif offset:
+            headers["Range"] = f"bytes={offset}-"
+        r = self.session.get(self.url(name), stream=True, timeout=timeout, headers=headers)
+        r.raise_for_status()
+        if headers and r.status_code != 206:
+            r.close()
+            raise SourceError(f"{self.url(name)} ignored the Range request")
+        return HttpStream(r, offset)
+
+
+class LocalSource:
+    """A directory (NAS share, USB disk, ...) laid out like the download site."""
+
+    def __init__(self, path, catalog=True):
+        self.path = os.path.abspath(path)
+        # The download cache holds files but must not answer for the catalog
+        self.catalog = catalog
+
+    def __repr__(self):
+        return f"LocalSource({self.path!r})"
+
+    def _path(self, name):
+        path = os.path.normpath(os.path.join(self.path, file_name(name)))
+        if path != self.path and not path.startswith(self.path + os.sep):
+            raise SourceError(f"{name} is outside {self.path}")
+        return path
+
+    def url(self, name):
+        return "file://" + self._path(name)
+
+    def local_path(self, name):
+        """The file itself, so callers can copy it without a download step."""
+        path = self._path(name)
+        return path if os.path.isfile(path) else None
+
+    def fetch_bytes(self, name, timeout=None):
+        try:
+            with open(self._path(name), "rb") as f:
+                return f.read()
+        except FileNotFoundError as e:
+            raise SourceError(str(e)) from e
+
+    def fetch_catalog(self, timeout=None):
+        if not self.catalog:
+            raise SourceError(f"{self.path} has no catalog")
+        try:
+            return json.loads(self.fetch_bytes(CATALOG_NAME))
+        except SourceError:
+            pass
+        # No catalog: offer every ISO in the directory
+        isos = []
+        for path in sorted(glob.glob(os.path.join(self.path, "*.iso"))):
+            name = os.path.basename(path)
+            stem = os.path.splitext(name)[0]
+            entry = {"name": stem, "file": name, "size": os.path.getsize(path)}
+            entry["compressed"] = [
+                name + suffix for suffix in transfer.COMPRESSIONS
+                if os.path.exists(path + suffix)
+            ]
+            for ext in (".sha256", ".md5"):
+                if os.path.exists(os.path.join(self.path, stem + ext)):
+                    entry["checksum_file"] = stem + ext
+                    break
+            isos.append(entry)
+        return {"schema": 2, "isos": isos}
+
+    def open(self, name, offset=0, timeout=None, length=None):
+        try:
+            return FileStream(self._path(name), offset, length)
+        except FileNotFoundError as e:
+            raise SourceError(str(e)) from e
+
+
+class SourceList:
+    """Try each source in order until one answers."""
+
+    def __init__(self, sources):
+        self.sources = list(sources)
+
+    def __repr__(self):
+        return f"SourceList({self.sources!r})"
+
+    def _first(self, method, *args, **kwargs):
+        errors = []
+        for source in self.sources:
+            try:
+                return getattr(source, method)(*args, **kwargs)
+            except (OSError, ValueError, requests.RequestException) as e:
+                errors.append(f"{source!r}: {e}")
+        raise SourceError("; ".join(errors) or "No sources configured")
+
+    @property
+    def upstream(self):
+        """The last resort, normally the configured mirror."""
+        return self.sources[-1]
+
+    def url(self, name):
+        return self.sources[0].url(name)
+
+    def local_path(self, name):
+        for source in self.sources:
+            path = source.local_path(name)
+            if path:
+                return path
+        return None
+
+    def fetch_bytes(self, name, timeout=5):
+        return self._first("fetch_bytes", name, timeout)
+
+    def fetch_catalog(self, timeout=5):
+        return self._first("fetch_catalog", timeout)
+
+    def open(self, name, offset=0, timeout=10, length=None):
+        return self._first("open", name, offset, timeout, length)
+
+
+def from_spec(spec):
+    """Build a source from a URL, file:// URL or directory; commas chain them."""
+    parts = [p.strip() for p in spec.split(",") if p.strip()]
+    if len(parts) > 1:
+        return SourceList(from_spec(p) for p in parts)
+    spec = parts[0] if parts else DEFAULT_SOURCE
+    parsed = urlparse(spec)
+    if parsed.scheme in ("http", "https"):
+        return HttpSource(spec)
+    if parsed.scheme == "file":
+        return LocalSource(url2pathname(unquote(parsed.path)))
+    if os.path.isdir(spec):
+        return LocalSource(spec)
+    raise SourceError(f"Unsupported source: {spec}")
+
+
+def _option(argv, name):
+    value = None
+    for i, arg in enumerate(argv):
+        if arg == name and i + 1 < len(argv):
+            value = argv[i + 1]
+        elif arg.startswith(name + "="):
+            value = arg.split("=", 1)[1]
+    return value
+
+
+def configured(argv=None, discover=True):
+    """Return the cache, LAN peers and then the source selected by --source,
+    $ALTIMA_SOURCE or the default, chained in that order.
+
+    Peers come from --peer or $ALTIMA_PEER; without either, the local
+    network is probed unless --no-discover or ALTIMA_DISCOVER=0 is given.
+    """
+    argv = argv or []
+    spec = _option(argv, "--source") or os.environ.get(SOURCE_ENV) or DEFAULT_SOURCE
+    peer_spec = _option(argv, "--peer") or os.environ.get(PEER_ENV) or ""
+    peer_urls = [p.strip() for p in peer_spec.split(",") if p.strip()]
+    if (not peer_urls and discover and "--no-discover" not in argv
+            and os.environ.get(DISCOVER_ENV) != "0"):
+        peer_urls = peers.discover()
+
+    chain = [LocalSource(cache_dir(), catalog=False)]
+    chain += [HttpSource(url) for url in peer_urls]
+    upstream = from_spec(spec)
+    chain += upstream.sources if isinstance(upstream, SourceList) else [upstream]
+    return SourceList(chain)
+
+
+def with_mirrors(source, mirrors):
+    """Append catalog mirrors to a source's fallback chain."""
+    if not mirrors:
+        return source
+    chain = list(source.sources) if isinstance(source, SourceList) else [source]
+    known = {s.base_url for s in chain if isinstance(s, HttpSource)}
+    chain += [HttpSource(m) for m in mirrors if m not in known]
+    return SourceList(chain)
+
+
+def is_current(path, size=None, digests=None):
+    """Whether the file at path has the expected size and digests, where known.
+
+    digests maps hashlib algorithm names to hex digests, as in the catalog;
+    algorithms this Python lacks are skipped.
+    """
+    if size and os.path.getsize(path) != size:
+        return False
+    digests = {a: d.lower() for a, d in (digests or {}).items() if a in hashlib.algorithms_available}
+    if digests:
+        return hashing.hash_file(path, tuple(digests)).digests == digests
+    return True
+
+
+def fetch_to_cache(source, name, progress=None, cache=None, variants=(), size=None, history=None,
+                   digests=None):
+    """Return a local path for name, downloading it into the cache if needed.
+
+    variants are compressed versions of name to try first; they are
+    decompressed on the way in. size is the expected size of the plain file
+    (e.g. from the catalog); with it, or with an uncompressed stream, the
+    space is checked and reserved before the download starts (preflight.py).
+    A copy already on disk is only used if it matches size and digests
+    (see is_current()); a stale one is downloaded again. progress is called as
+    progress(bytes_read, bytes_total) and may raise to abort; the partial
+    file is removed either way. history, a history.History, gets the
+    download logged against the mirror that served it.
+    """
+    path = source.local_path(name)
+    if path:
+        if is_current(path, size, digests):
+            return path
+        # Fetch it again from the sources that do not hold the stale copy
+        chain = source.sources if isinstance(source, SourceList) else [source]
+        source = SourceList([s for s in chain if s.local_path(name) != path])
+    path = os.path.join(cache or cache_dir(), file_name(name))
+    part = path + ".part"
+    stream = None
+    started = time.monotonic()
+    try:
+        stream, variant = transfer.open_variant(source, tuple(variants) + (name,))
+        compression = transfer.compression_of(variant)
+        # The finished file is renamed over any older copy, so both must fit
+        with stream, preflight.open_reserved(part, size or (None if compression else stream.size),
+                                             replacing=False) as f:
+            transfer.copy(stream, f.write, compression, progress=progress, splice_to=f.fileno())
+            f.truncate()
+    except BaseException as e:
+        if os.path.exists(part):
+            os.remove(part)
+        if history is not None and stream is not None:
+            history.record("download", stream.position - stream.offset, time.monotonic() - started,
+                           ok=False, error=e, mirror=stream.source.url(""), iso=file_name(name))
+        raise
+    if history is not None:
+        history.record("download", stream.position - stream.offset, time.monotonic() - started,
+                       mirror=stream.source.url(""), iso=file_name(name))
+    os.replace(part, path)
+    return path
@@ -0,0 +1,103 @@
+"""Where each USB stick hangs off the machine, read from sysfs.
+
+A disk's sysfs path runs through every USB device above it, e.g.
+
+    /sys/devices/pci0000:00/0000:00:14.0/usb2/2-1/2-1.3/2-1.3:1.0/host6/.../block/sdb
+
+is a stick (2-1.3) behind a hub on root port 2-1 of bus 2 of the
+controller at 0000:00:14.0. Sticks behind one root port share its uplink and
+sticks on one bus share the controller, so link_limits() turns the
+negotiated speeds into per-port and per-bus caps on concurrent writers.
+"""
+import os
+import re
+from collections import namedtuple
+
+from altima_usb_installer import mounts
+
+# usbN directories and bus-port[.port...] device directories
+_BUS_DIR = re.compile(r"usb(\d+)$")
+_DEVICE_DIR = re.compile(r"(\d+)-(\d+(?:\.\d+)*)$")
+
+# Concurrent bulk writers a shared link carries before sticks mostly slow
+# each other down: a USB 2 link moves ~40 MB/s in total, a USB 3 one
+# several hundred
+WRITERS_PER_LINK = {"usb2": 2, "usb3": 4}
+
+UsbLocation = namedtuple(
+    "UsbLocation", "disk controller bus root_port parent port speed port_speed bus_speed"
+)
+
+
+def generation(speed):
+    """"usb3" for SuperSpeed links (5000 Mbit/s and up), else "usb2"."""
+    return "usb3" if speed and speed >= 5000 else "usb2"
+
+
+def _speed(path):
+    try:
+        with open(os.path.join(path, "speed")) as f:
+            return float(f.read().strip())
+    except (OSError, ValueError):
+        return None
+
+
+def locate(disk, sys_block=mounts.SYS_BLOCK):
+    """Return the UsbLocation of a disk, or None if it is not on USB."""
+    path = os.path.realpath(os.path.join(sys_block, disk))
+    parts = path.split(os.sep)
+    bus_index = None
+    devices = []
+    for i, part in enumerate(parts):
+        if _BUS_DIR.match(part):
+            bus_index = i
+        elif bus_index is not None and _DEVICE_DIR.match(part):
+            devices.append(i)
+    if bus_index is None or not devices:
+        return None
+
+    def prefix(i):
+        return os.sep.join(parts[:i + 1])
+
+    stick = devices[-1]
+    return UsbLocation(
+        disk=disk,
+        controller=parts[bus_index - 1],
+        bus=int(_BUS_DIR.match(parts[bus_index]).group(1)),
+        root_port=parts[devices[0]],
+        parent=parts[devices[-2]] if len(devices) > 1 else parts[bus_index],
+        port=parts[stick],
+        speed=_speed(prefix(stick)),
+        port_speed=_speed(prefix(devices[0])),
+        bus_speed=_speed(prefix(bus_index)),
+    )
+
+
+def link_limits(location):
+    """Return [(key, max concurrent writers)] for the links a stick shares."""
+    if location is None:
+        return []
+    return [
+        (("bus", location.controller, location.bus),
+         WRITERS_PER_LINK[generation(location.bus_speed)]),
+        (("port", location.controller, location.root_port),
+         WRITERS_PER_LINK[generation(location.port_speed)]),
+    ]
+
+
+def shared_links(locations):
+    """Map each bus/root port to the disks on it, for display and planning."""
+    links = {}
+    for location in locations:
+        for key, _ in link_limits(location):
+            links.setdefault(key, []).append(location.disk)
+    return links
+
+
+def describe(location):
+    if location is None:
+        return "not on USB"
+    via = f" via hub {location.parent}" if location.port != location.root_port else ""
+    speed = f"{location.speed:g} Mbit/s" if location.speed else "unknown speed"
+    return (f"{generation(location.speed).upper()} ({speed}) on port {location.port}{via}, "
+            f"bus {location.bus} of {location.controller}")
@@ -0,0 +1,712 @@
+"""Stream an image from a source to a file, decompressing on the fly.
+
+Catalog entries may list .iso.zst/.iso.xz/.iso.gz variants next to the
+plain ISO. open_variant() takes the first one this machine can decode and
+the source actually has, falling back to the plain file. copy() runs a
+pipeline of threads (receive, decompress, write, update) joined by bounded
+queues of reusable buffers, so a stick that stalls in write() no longer
+stops the socket from being drained, and each stage runs at its own pace
+until the buffers run out; the callbacks only ever see the decompressed
+bytes. A Tuner sizes the blocks and the number in flight from the
+throughput and write latency it measures, within a memory cap, and
+PipelineStats reports how full each queue ran and what the Tuner settled
+on. zstd needs the optional zstandard package.
+
+    python -m altima_usb_installer.transfer --bench [--size MIB]
+
+Streams opened here are watched: when a connection delivers less than
+STALL_FLOOR bytes per second over STALL_WINDOW seconds spent waiting on it
+(a dead mirror, or a proxy that keeps the socket alive without sending
+anything), it is dropped and the transfer carries on with a Range request
+from the last byte delivered, on the next source in the chain if there is
+one. Stalls are logged in STALL_LOG; the caller only sees the bytes.
+"""
+import argparse
+import gzip
+import io
+import lzma
+import math
+import os
+import queue
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import deque, namedtuple
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+QUEUE_DEPTH = 8
+OUT_BLOCK = 1024 * 1024
+CHUNK_SIZE = 1024 * 1024
+
+# Tuner bounds: block sizes, buffers in flight and their total size
+MIN_BLOCK = 64 * 1024
+MAX_BLOCK = 8 * 1024 * 1024
+MIN_DEPTH = 2
+MEMORY_CAP = 64 * 1024 * 1024
+# Blocks are sized so one receive takes about this long at the measured rate
+TARGET_READ_TIME = 0.05
+TUNE_INTERVAL = 0.5
+
+STALL_FLOOR = 32 * 1024
+STALL_WINDOW = 60.0
+WATCH_INTERVAL = 1.0
+# Reconnects in a row without a byte in between before giving up
+MAX_RECONNECTS = 5
+RECONNECT_DELAY = 1.0
+
+StallEvent = namedtuple("StallEvent", "name url offset reason time")
+TunerSettings = namedtuple("TunerSettings", "block depth memory_cap rate write_latency")
+STALL_LOG = deque(maxlen=100)
+
+# In order of preference
+COMPRESSIONS = {".zst": "zstd", ".xz": "xz", ".gz": "gzip"}
+
+
+def compression_of(name):
+    """The compression a file name implies, or None for a plain file."""
+    for suffix, kind in COMPRESSIONS.items():
+        if name.endswith(suffix):
+            return kind
+    return None
+
+
+def strip_compression(name):
+    kind = compression_of(name)
+    return name.rsplit(".", 1)[0] if kind else name
+
+
+def supported(kind):
+    return kind in (None, "gzip", "xz") or (kind == "zstd" and zstandard is not None)
+
+
+class _QueueReader(io.RawIOBase):
+    """File-like view of a queue of (buffer, length, pool) blocks; None marks the end.
+
+    release(block) is called once a block has been read through.
+    """
+
+    def __init__(self, blocks, release, stats=None):
+        self.blocks = blocks
+        self.release = release
+        self.stats = stats
+        self.eof = False
+        self._block = None
+        self._buf = memoryview(b"")
+
+    def readable(self):
+        return True
+
+    def _next(self):
+        if self._block is not None:
+            self.release(self._block)
+            self._block = None
+        block = self.blocks.get()
+        if self.stats is not None:
+            self.stats._sample("decompress", self.blocks)
+        if block is None:
+            self.eof = True
+        else:
+            self._block = block
+            self._buf = memoryview(block[0])[:block[1]]
+
+    def readinto(self, b):
+        while not self._buf and not self.eof:
+            self._next()
+        n = min(len(b), len(self._buf))
+        b[:n] = self._buf[:n]
+        self._buf = self._buf[n:]
+        return n
+
+    def drain(self):
+        self._buf = memoryview(b"")
+        while not self.eof:
+            self._next()
+
+
+def decompressing_reader(kind, fileobj):
+    """Wrap fileobj so reads return decompressed data in bounded pieces."""
+    if kind == "gzip":
+        return gzip.GzipFile(fileobj=fileobj, mode="rb")
+    if kind == "xz":
+        return lzma.LZMAFile(fileobj, mode="rb")
+    if kind == "zstd" and zstandard is not None:
+        return zstandard.ZstdDecompressor().stream_reader(fileobj, read_across_frames=True)
+    raise ValueError(f"cannot decompress {kind}")
+
+
+class StallError(OSError):
+    """A transfer kept stalling on every source it was retried on."""
+
+
+class ResumingStream:
+    """A source stream that reconnects past stalls and dropped connections.
+
+    Has the interface of the streams sources open (url, offset, size,
+    iter_chunks, close); position is the next byte to be delivered.
+    on_stall(event) is called with each StallEvent.
+
+    The watchdog only counts the time the consumer spends waiting on the
+    network and the bytes received in it, so a consumer held up by a slow
+    stick does not make a healthy connection look stalled.
+    """
+
+    def __init__(self, source, name, offset=0, length=None, floor=STALL_FLOOR,
+                 window=STALL_WINDOW, on_stall=None):
+        self.chain = list(getattr(source, "sources", [source]))
+        self.name = name
+        self.offset = self.position = offset
+        self.received = 0
+        self.end = None if length is None else offset + length
+        self.floor = floor
+        self.window = window
+        self.on_stall = on_stall
+        self.stalls = []
+        self._index = -1
+        self._stream = None
+        self._stalled = None
+        self._failures = 0
+        # (seconds spent waiting on the network, when the current wait began or None)
+        self._clock = (0.0, None)
+        self._watchdog = None
+        self._closed = threading.Event()
+        self._connect()
+        self.size = self._stream.size
+
+    @property
+    def source(self):
+        """The source currently serving the stream."""
+        return self.chain[self._index]
+
+    def _connect(self):
+        """Open at position on the next source that has the file."""
+        errors = []
+        for step in range(1, len(self.chain) + 1):
+            index = (self._index + step) % len(self.chain)
+            length = None if self.end is None else self.end - self.position
+            try:
+                stream = self.chain[index].open(self.name, self.position, length=length)
+            except OSError as e:
+                errors.append(e)
+                continue
+            if self._stream is not None and stream.size and self.size and stream.size != self.size:
+                stream.close()
+                errors.append(OSError(f"{stream.url} has a different {self.name}"))
+                continue
+            self._index = index
+            self._stream = stream
+            self.url = stream.url
+            return
+        if len(errors) == 1:
+            raise errors[0]
+        raise OSError("; ".join(str(e) for e in errors) or "No sources configured")
+
+    def _waiting(self):
+        self._clock = (self._clock[0], time.monotonic())
+
+    def _arrived(self, n):
+        """Stop the network clock and count n bytes received; returns n."""
+        waited, since = self._clock
+        if since is not None:
+            self._clock = (waited + time.monotonic() - since, None)
+        self.received += n
+        return n
+
+    def _network_time(self):
+        waited, since = self._clock
+        return waited if since is None else waited + time.monotonic() - since
+
+    def _watch(self):
+        samples = deque()
+        stream = None
+        while not self._closed.wait(WATCH_INTERVAL):
+            now = self._network_time()
+            if stream is not self._stream:
+                # A new connection gets a whole window to get going
+                stream = self._stream
+                samples.clear()
+            elif samples and now == samples[-1][0]:
+                # The consumer is busy elsewhere; nothing is being waited for
+                continue
+            samples.append((now, self.received))
+            while samples and now - samples[0][0] > self.window:
+                samples.popleft()
+            since, start = samples[0]
+            abort = getattr(stream, "abort", None)
+            if abort is None or self._stalled is not None or now - since < self.window * 0.9:
+                continue
+            rate = (self.received - start) / (now - since)
+            if rate < self.floor:
+                self._stalled = f"{rate / 1024:.1f} KiB/s over {now - since:.0f} s"
+                abort()
+
+    def _reconnect(self, reason):
+        self._failures += 1
+        if self._failures > MAX_RECONNECTS:
+            raise StallError(f"{self.name}: gave up after {MAX_RECONNECTS} reconnects ({reason})")
+        time.sleep(RECONNECT_DELAY * (self._failures - 1))
+        event = StallEvent(self.name, self.url, self.position, reason, time.time())
+        self.stalls.append(event)
+        STALL_LOG.append(event)
+        if self.on_stall:
+            self.on_stall(event)
+        self._stream.close()
+        self._stalled = None
+        self._connect()
+
+    def _finished(self):
+        end = self.end if self.end is not None else self.size
+        return not end or self.position >= end
+
+    def _start_watchdog(self):
+        if self._watchdog is None:
+            self._watchdog = threading.Thread(target=self._watch, daemon=True)
+            self._watchdog.start()
+
+    def iter_chunks(self, chunk_size=CHUNK_SIZE):
+        self._start_watchdog()
+        while True:
+            try:
+                chunks = iter(self._stream.iter_chunks(chunk_size))
+                while True:
+                    chunk = None
+                    self._waiting()
+                    try:
+                        chunk = next(chunks, None)
+                    finally:
+                        self._arrived(len(chunk) if chunk else 0)
+                    if chunk is None:
+                        break
+                    self.position += len(chunk)
+                    self._failures = 0
+                    yield chunk
+                if self._stalled is None and self._finished():
+                    return
+                reason = self._stalled or "connection closed early"
+            except (OSError, ValueError) as e:
+                reason = self._stalled or str(e) or type(e).__name__
+            self._reconnect(reason)
+
+    def _move(self, op):
+        """Run op(stream) -> bytes moved, reconnecting until it moves some or the end is reached.
+
+        op calls _arrived() once its bytes are off the network.
+        """
+        self._start_watchdog()
+        while True:
+            try:
+                self._waiting()
+                try:
+                    n = op(self._stream)
+                finally:
+                    self._arrived(0)
+                if n:
+                    self.position += n
+                    self._failures = 0
+                    return n
+                if self._stalled is None and self._finished():
+                    return 0
+                reason = self._stalled or "connection closed early"
+            except (OSError, ValueError) as e:
+                reason = self._stalled or str(e) or type(e).__name__
+            self._reconnect(reason)
+
+    def readinto(self, b):
+        return self._move(lambda stream: self._arrived(stream.readinto(b)))
+
+    def can_splice(self):
+        return getattr(self._stream, "can_splice", lambda: False)()
+
+    def splice(self, fd, count):
+        """Like readinto(), but straight to fd; falls back to a copy on a new connection
+        that cannot splice."""
+        def op(stream):
+            if getattr(stream, "can_splice", lambda: False)():
+                return stream.splice(fd, count, received=self._arrived)
+            buf = bytearray(min(count, CHUNK_SIZE))
+            n = self._arrived(stream.readinto(buf))
+            view = memoryview(buf)[:n]
+            while view:
+                view = view[os.write(fd, view):]
+            return n
+        return self._move(op)
+
+    def close(self):
+        self._closed.set()
+        self._stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_resumable(source, name, offset=0, length=None, on_stall=None):
+    """source.open(name, offset, length), watched for stalls (ResumingStream)."""
+    return ResumingStream(source, name, offset, length, on_stall=on_stall)
+
+
+def open_variant(source, names, on_stall=None):
+    """Open the first name the source has and this machine can decode.
+
+    Returns (stream, name); raises the last error if none could be opened.
+    """
+    error = None
+    for name in names:
+        if not supported(compression_of(name)):
+            continue
+        try:
+            return open_resumable(source, name, on_stall=on_stall), name
+        except OSError as e:
+            error = e
+    raise error or OSError("no usable variant among " + ", ".join(names))
+
+
+class Tuner:
+    """Picks copy()'s block size and buffers in flight from what it measures.
+
+    Blocks are sized so one receive takes about TARGET_READ_TIME at the
+    measured rate: small on a congested line, so progress and the stall
+    watchdog stay responsive, large on a fast LAN, so there are fewer calls
+    per byte. Enough blocks are kept in flight to cover the slowest recent
+    write at that rate, so the receiver keeps going while the stick
+    flushes its cache; the receive buffers never add up to more than
+    memory_cap bytes. Reusing one Tuner
+    for several copies to the same stick starts the later ones tuned.
+    """
+
+    def __init__(self, block=CHUNK_SIZE, depth=QUEUE_DEPTH, memory_cap=MEMORY_CAP):
+        self.lock = threading.Lock()
+        self.memory_cap = memory_cap
+        self.block = min(max(block, MIN_BLOCK), MAX_BLOCK, memory_cap // MIN_DEPTH)
+        self.depth = min(max(depth, MIN_DEPTH), memory_cap // self.block)
+        self.rate = None
+        self.write_latency = deque(maxlen=32)
+        self._bytes = 0
+        self._since = time.monotonic()
+
+    def received(self, n):
+        with self.lock:
+            self._bytes += n
+            now = time.monotonic()
+            if now - self._since < TUNE_INTERVAL:
+                return
+            rate = self._bytes / (now - self._since)
+            self.rate = rate if self.rate is None else 0.7 * self.rate + 0.3 * rate
+            self._bytes = 0
+            self._since = now
+            self._retune()
+
+    def wrote(self, seconds):
+        with self.lock:
+            self.write_latency.append(seconds)
+
+    def _retune(self):
+        block = 1 << max(0, int(self.rate * TARGET_READ_TIME)).bit_length()
+        block = min(max(block, MIN_BLOCK), MAX_BLOCK, self.memory_cap // MIN_DEPTH)
+        slowest = max(self.write_latency, default=0.0)
+        depth = math.ceil(slowest * self.rate / block) + MIN_DEPTH
+        self.block = block
+        self.depth = min(max(depth, MIN_DEPTH), self.memory_cap // block)
+
+    def settings(self):
+        with self.lock:
+            return TunerSettings(self.block, self.depth, self.memory_cap, self.rate,
+                                 max(self.write_latency, default=None))
+
+
+class _BufferPool:
+    """copy()'s receive buffers, reallocated and re-counted as the Tuner decides."""
+
+    def __init__(self, tuner):
+        self.tuner = tuner
+        self.free = queue.Queue()
+        self.lock = threading.Lock()
+        self.count = 0
+        self.allocated = 0
+
+    def get(self):
+        while True:
+            try:
+                buf = self.free.get_nowait()
+            except queue.Empty:
+                with self.lock:
+                    block = self.tuner.block
+                    if (self.count < self.tuner.depth
+                            and self.allocated + block <= self.tuner.memory_cap):
+                        self.count += 1
+                        self.allocated += block
+                        return bytearray(block)
+                buf = self.free.get()
+            with self.lock:
+                if len(buf) == self.tuner.block and self.count <= self.tuner.depth:
+                    return buf
+                # Wrong size or one too many now: let it go
+                self.count -= 1
+                self.allocated -= len(buf)
+
+    def put(self, buf):
+        self.free.put(buf)
+
+
+class PipelineStats:
+    """How full copy()'s queues ran, how long each stage sat idle, and what
+    the Tuner settled on.
+
+    A queue that stays near full points at the stage draining it (usually
+    the stick's writes); one that stays empty, at the stage feeding it.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queues = {}
+        self.idle = {}
+        self.tuner = None
+
+    def _sample(self, name, q):
+        depth = self.tuner.depth if self.tuner else q.maxsize or 1
+        with self.lock:
+            samples = self.queues.setdefault(name, [0, 0.0])
+            samples[0] += 1
+            samples[1] += min(1.0, q.qsize() / depth)
+
+    def _idle(self, stage, seconds):
+        with self.lock:
+            self.idle[stage] = self.idle.get(stage, 0.0) + seconds
+
+    def occupancy(self):
+        """{queue: average fill as a fraction of the buffers in flight}."""
+        with self.lock:
+            return {name: total / count for name, (count, total) in self.queues.items() if count}
+
+    def format(self):
+        queues = ", ".join(f"{name} {fill:.0%}" for name, fill in self.occupancy().items())
+        with self.lock:
+            idle = ", ".join(f"{stage} {seconds:.1f} s" for stage, seconds in self.idle.items())
+        text = f"queues: {queues or 'unused'}; idle: {idle or 'none'}"
+        if self.tuner is not None:
+            t = self.tuner.settings()
+            text += (f"; blocks: {t.block // 1024} KiB x {t.depth} "
+                     f"(cap {t.memory_cap // 2**20} MiB)")
+        return text
+
+
+def _release(block):
+    if block[2] is not None:
+        block[2].put(block[0])
+
+
+def _pool(count, size):
+    pool = queue.Queue()
+    for _ in range(count):
+        pool.put(bytearray(size))
+    return pool
+
+
+def _stage(name, inbox, outbox, work, state, stats):
+    """Run work(view) on each block of inbox, then pass it on or release it.
+
+    Queues are sampled as blocks arrive, under the name of the stage they feed.
+    """
+    while True:
+        started = time.monotonic()
+        block = inbox.get()
+        stats._idle(name, time.monotonic() - started)
+        if block is None:
+            break
+        stats._sample(name, inbox)
+        if state["error"] is None:
+            try:
+                work(memoryview(block[0])[:block[1]])
+            except BaseException as e:
+                state["error"] = e
+        if outbox is not None and state["error"] is None:
+            outbox.put(block)
+        else:
+            _release(block)
+    if outbox is not None:
+        outbox.put(None)
+
+
+def _decompress_stage(kind, inbox, outbox, depth, state, stats):
+    reader = _QueueReader(inbox, _release, stats)
+    pool = _pool(depth, OUT_BLOCK)
+    try:
+        # Reading into bounded blocks keeps a run of zeros from
+        # expanding into one huge buffer
+        with decompressing_reader(kind, reader) as f:
+            while state["error"] is None:
+                buf = pool.get()
+                n = f.readinto(buf)
+                if not n:
+                    break
+                outbox.put((buf, n, pool))
+    except BaseException as e:
+        if state["error"] is None:
+            state["error"] = e
+    # Keep draining so the receiver never waits on a buffer forever
+    reader.drain()
+    outbox.put(None)
+
+
+def _splice(stream, fd, progress, block):
+    read = 0
+    while True:
+        n = stream.splice(fd, block)
+        if not n:
+            return read
+        read += n
+        if progress:
+            progress(read, stream.size)
+
+
+def copy(stream, write, kind=None, update=None, progress=None, depth=QUEUE_DEPTH,
+         splice_to=None, block=CHUNK_SIZE, stats=None, tuner=None):
+    """Write stream's decompressed data through write(); return bytes written.
+
+    update(data) sees every decompressed block after write() has taken it
+    (e.g. a hasher, or a journal checkpoint that fsyncs what was written),
+    and progress(bytes_read, stream_size) follows the bytes read from the
+    source. Receiving, decompressing, writing and updating each run in
+    their own thread over reusable buffers, handed on as memoryviews, so
+    write() and update() must be done with a block when they return.
+    tuner (a Tuner, by default a new one starting from block and depth)
+    resizes the receive blocks and the number in flight as the copy runs.
+    stats, a PipelineStats, collects queue occupancy. splice_to is the file
+    descriptor write() ends in: with no decompression or update() to feed,
+    a plain-HTTP body goes straight from the socket into it (os.splice)
+    and never enters Python.
+    """
+    tuner = tuner or Tuner(block, depth)
+    if (kind is None and splice_to is not None and update is None
+            and getattr(stream, "can_splice", lambda: False)()):
+        return _splice(stream, splice_to, progress, tuner.block)
+
+    stats = stats if stats is not None else PipelineStats()
+    stats.tuner = tuner
+    state = {"written": 0, "error": None}
+    pool = _BufferPool(tuner)
+
+    def count(view):
+        started = time.monotonic()
+        write(view)
+        tuner.wrote(time.monotonic() - started)
+        state["written"] += len(view)
+
+    # receive -> [decompress] -> write -> [update]; the pools bound the queues
+    first = queue.Queue()
+    to_write = queue.Queue() if kind else first
+    to_update = queue.Queue() if update else None
+    threads = [threading.Thread(target=_stage, args=("write", to_write, to_update, count, state, stats))]
+    if kind:
+        threads.append(threading.Thread(target=_decompress_stage,
+                                        args=(kind, first, to_write, depth, state, stats)))
+    if update:
+        threads.append(threading.Thread(target=_stage,
+                                        args=("update", to_update, None, update, state, stats)))
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    read = 0
+    try:
+        while state["error"] is None:
+            started = time.monotonic()
+            buf = pool.get()
+            stats._idle("receive", time.monotonic() - started)
+            n = stream.readinto(buf)
+            if not n:
+                pool.put(buf)
+                break
+            read += n
+            tuner.received(n)
+            first.put((buf, n, pool))
+            if progress:
+                progress(read, stream.size)
+    finally:
+        first.put(None)
+        for thread in threads:
+            thread.join()
+    if state["error"] is not None:
+        raise state["error"]
+    return state["written"]
+
+
+def _bench_run(url, target, method, stats):
+    # Imported here: sources builds on this module
+    from altima_usb_installer import sources
+
+    started, cpu = time.perf_counter(), time.process_time()
+    with open_resumable(sources.HttpSource(url), "bench.bin") as stream, open(target, "wb") as f:
+        if method == "iter8k":
+            # The frontends' old r.iter_content(chunk_size=8192) loop
+            for chunk in stream.iter_chunks(8192):
+                f.write(chunk)
+        elif method == "iter1m":
+            for chunk in stream.iter_chunks():
+                f.write(chunk)
+        else:
+            copy(stream, f.write, splice_to=f.fileno() if method == "splice" else None, stats=stats)
+    return time.perf_counter() - started, time.process_time() - cpu
+
+
+def bench(size, out=sys.stdout):
+    """Download size bytes from a loopback HTTP server with each receive path.
+
+    The server runs in its own process, so CPU time is the receiving side's.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        with open(os.path.join(tmp, "bench.bin"), "wb") as f:
+            block = os.urandom(CHUNK_SIZE)
+            for _ in range(size // CHUNK_SIZE):
+                f.write(block)
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+        server = subprocess.Popen(
+            [sys.executable, "-m", "http.server", "--bind", "127.0.0.1", "--directory", tmp, str(port)],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            for _ in range(50):
+                try:
+                    socket.create_connection(("127.0.0.1", port), timeout=1).close()
+                    break
+                except OSError:
+                    time.sleep(0.1)
+            url = f"http://127.0.0.1:{port}/"
+            target = os.path.join(tmp, "out.bin")
+            print(f"{size / 2**20:.0f} MiB over loopback HTTP", file=out)
+            for method in ("iter8k", "iter1m", "pipeline", "splice"):
+                stats = PipelineStats()
+                seconds, cpu = _bench_run(url, target, method, stats)
+                print(f"  {method:<8} {size / seconds / 1e6:8.1f} MB/s  "
+                      f"{cpu * 1e9 / size:6.2f} ns CPU per byte", file=out)
+                if method == "pipeline":
+                    print(f"           {stats.format()}", file=out)
+        finally:
+            server.terminate()
+            server.wait()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m altima_usb_installer.transfer")
+    parser.add_argument("--bench", action="store_true",
+                        help="compare receive paths on a loopback download")
+    parser.add_argument("--size", type=int, default=512, help="benchmark size in MiB")
+    args = parser.parse_args(argv)
+    if not args.bench:
+        parser.error("nothing to do; try --bench")
+    bench(args.size * 2**20)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
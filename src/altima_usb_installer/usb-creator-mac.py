@@ -1,6 +1,5 @@
 import os
 import sys
-import requests
 import subprocess
 from pathlib import Path
 from tempfile import TemporaryDirectory
@@ -11,9 +10,16 @@ from PySide6.QtWidgets import (
 )
 from PySide6.QtGui import QPixmap, Qt
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from altima_usb_installer import catalog, history, preflight, sources, transfer
+
 ALTIMA_LOGO_PATH = "altima-logo.png"
 VENTOY_RELEASE = "https://github.com/ventoy/Ventoy/releases/latest/download/ventoy-1.0.97-macos.tar.gz"
-ALTIMA_ISO_LIST = "https://download.altimalinux.com/"
+# --source DIR|URL or ALTIMA_SOURCE points at a local mirror; a mirror serves
+# the Ventoy tarball under its release file name
+SOURCE = sources.configured(sys.argv)
+# Past transfer speeds, for mirror order and time estimates
+HISTORY = history.History()
 
 class AltimaUSBFlasher(QWidget):
     def __init__(self):
@@ -34,6 +40,7 @@ class AltimaUSBFlasher(QWidget):
         self.ventoy_button.clicked.connect(self.install_ventoy)
 
         self.iso_select = QComboBox()
+        self.iso_catalog = catalog.Catalog([])
         self.load_iso_list()
 
         self.download_button = QPushButton("Download & Copy ISO")
@@ -69,9 +76,8 @@ class AltimaUSBFlasher(QWidget):
 
     def load_iso_list(self):
         try:
-            html = requests.get(ALTIMA_ISO_LIST).text
-            import re
-            isos = re.findall(r'href="([^"]+\.iso)"', html)
+            self.iso_catalog = catalog.fetch(SOURCE, fallback=False)
+            isos = [iso.file for iso in self.iso_catalog.current()]
             for iso in sorted(set(isos)):
                 self.iso_select.addItem(iso)
         except Exception as e:
@@ -91,10 +97,8 @@ class AltimaUSBFlasher(QWidget):
         with TemporaryDirectory() as tmpdir:
             self.progress.setValue(5)
             ventoy_tar = Path(tmpdir) / "ventoy.tar.gz"
-            r = requests.get(VENTOY_RELEASE, stream=True)
-            with open(ventoy_tar, "wb") as f:
-                for chunk in r.iter_content(chunk_size=8192):
-                    f.write(chunk)
+            with transfer.open_resumable(SOURCE, VENTOY_RELEASE) as stream, open(ventoy_tar, "wb") as f:
+                transfer.copy(stream, f.write, splice_to=f.fileno())
             self.progress.setValue(25)
 
             subprocess.run(["tar", "xf", str(ventoy_tar)], cwd=tmpdir)
@@ -113,16 +117,19 @@ class AltimaUSBFlasher(QWidget):
         iso_file = self.iso_select.currentText()
         if not iso_file:
             return
-        iso_url = ALTIMA_ISO_LIST + iso_file
         self.progress.setValue(0)
         try:
-            r = requests.get(iso_url, stream=True)
-            iso_path = Path.home() / "Downloads" / iso_file
-            with open(iso_path, "wb") as f:
-                total = int(r.headers.get("content-length", 0))
-                for chunk in r.iter_content(chunk_size=8192):
-                    f.write(chunk)
-                    self.progress.setValue(int(f.tell() / total * 100 * 0.5))
+            def show_progress(downloaded, total):
+                if total:
+                    self.progress.setValue(int(downloaded / total * 100 * 0.5))
+
+            # Downloads land in the shared cache; a local mirror is copied from in place
+            entry = self.iso_catalog.get(iso_file)
+            iso_path = sources.fetch_to_cache(HISTORY.order(SOURCE), iso_file, show_progress,
+                                              variants=entry.compressed if entry else (),
+                                              size=entry.size if entry else None,
+                                              digests=entry.digests if entry else None,
+                                              history=HISTORY)
             self.progress.setValue(50)
 
             disk_entry = self.device_select.currentText()
@@ -141,7 +148,12 @@ class AltimaUSBFlasher(QWidget):
                 QMessageBox.warning(self, "Mount Error", "Please replug the USB stick after installing Ventoy.")
                 return
 
-            # Copy ISO
+            # Copy ISO, after making sure it fits
+            try:
+                preflight.check(os.path.join(mount_point, iso_file), os.path.getsize(iso_path))
+            except preflight.NoSpaceError as e:
+                QMessageBox.critical(self, "Not Enough Space", f"{iso_file} does not fit on the USB stick: {e.strerror}")
+                return
             subprocess.run(["cp", str(iso_path), mount_point])
             self.progress.setValue(100)
             QMessageBox.information(self, "Done", f"{iso_file} copied to USB.")
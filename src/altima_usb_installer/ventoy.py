@@ -0,0 +1,148 @@
+"""Install or update Ventoy on Linux by driving Ventoy2Disk.sh.
+
+Ventoy2Disk.sh is run non-interactively (its confirmation prompts are
+answered on stdin) through pkexec when we are not already root. Several
+disks can be prepared at once; install_many() caps how many run together
+and reports progress per disk from the script's own step messages.
+"""
+import glob
+import os
+import re
+import shutil
+import subprocess
+import tarfile
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from altima_usb_installer import mounts
+
+VENTOY_VERSION = "1.0.97"
+VENTOY_LINUX_URL = (
+    f"https://github.com/ventoy/Ventoy/releases/download/v{VENTOY_VERSION}/"
+    f"ventoy-{VENTOY_VERSION}-linux.tar.gz"
+)
+VENTOY_SCRIPT = "Ventoy2Disk.sh"
+DEFAULT_PARALLEL = 2
+
+InstallResult = namedtuple("InstallResult", "device ok returncode output")
+
+# Step messages printed by Ventoy2Disk.sh and how far along each one is
+_STEPS = [
+    ("create partitions", 0.10),
+    ("wait for partitions", 0.20),
+    ("format partition", 0.30),
+    ("mkexfatfs success", 0.45),
+    ("writing data to disk", 0.55),
+    ("sync data", 0.75),
+    ("esp partition processing", 0.90),
+    ("successfully finished", 1.0),
+]
+_ANSI_ESCAPE = re.compile(r"\x1b\[[0-9;]*m")
+
+
+def extract_release(tarball, dest):
+    """Unpack a Ventoy Linux release and return the path to Ventoy2Disk.sh."""
+    with tarfile.open(tarball, "r:gz") as tar:
+        # Extraction filters arrived in 3.11.4 (and 3.8.17, 3.9.17, 3.10.12)
+        if hasattr(tarfile, "data_filter"):
+            tar.extractall(dest, filter="data")
+        else:
+            tar.extractall(dest)
+    return find_script(dest)
+
+
+def find_script(folder):
+    scripts = sorted(glob.glob(os.path.join(folder, "ventoy-*", VENTOY_SCRIPT)))
+    if not scripts:
+        raise FileNotFoundError(f"{VENTOY_SCRIPT} not found in {folder}")
+    script = scripts[-1]
+    # The data filter keeps the archive's exec bits; this only covers a
+    # release packed without them, since install() runs the script via bash
+    os.chmod(script, 0o755)
+    return script
+
+
+def privilege_prefix():
+    if os.geteuid() == 0:
+        return []
+    if shutil.which("pkexec"):
+        return ["pkexec"]
+    raise PermissionError("Writing to the stick needs root; pkexec was not found.")
+
+
+def step_progress(line):
+    """Map a Ventoy2Disk.sh output line to a progress fraction, or None."""
+    lowered = line.lower()
+    for marker, fraction in _STEPS:
+        if marker in lowered:
+            return fraction
+    return None
+
+
+def install(device, script, update=False, progress=None, extra_args=()):
+    """Run Ventoy2Disk.sh -i (or -u) on a whole-disk device node."""
+    name = os.path.basename(device)
+    if mounts.parent_disk(name) != name:
+        raise ValueError(f"{device} is a partition; Ventoy needs the whole disk.")
+
+    # Ventoy2Disk.sh looks for ./boot/boot.img and ./tool next to itself, but
+    # pkexec starts in root's home whatever cwd we pass, so cd after elevating
+    cmd = privilege_prefix() + [
+        "sh", "-c", 'cd "$1" && shift && exec bash "$@"', "sh",
+        os.path.dirname(os.path.abspath(script)), "./" + os.path.basename(script),
+        "-u" if update else "-i", *extra_args, device
+    ]
+    proc = subprocess.Popen(
+        cmd,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        bufsize=1,
+    )
+    # Answer "Continue?" and the "Double-check" prompt up front
+    try:
+        proc.stdin.write("y\ny\n")
+        proc.stdin.close()
+    except BrokenPipeError:
+        pass
+
+    output = []
+    for raw in proc.stdout:
+        line = _ANSI_ESCAPE.sub("", raw).strip()
+        if not line:
+            continue
+        output.append(line)
+        fraction = step_progress(line)
+        if progress and fraction is not None:
+            progress(device, fraction, line)
+    returncode = proc.wait()
+
+    ok = returncode == 0 and any("successfully finished" in l.lower() for l in output)
+    return InstallResult(device, ok, returncode, "\n".join(output))
+
+
+def install_many(devices, script, update=False, progress=None, max_parallel=DEFAULT_PARALLEL):
+    """Install Ventoy on several disks, at most max_parallel at a time.
+
+    Returns one InstallResult per device, in the order given.
+    """
+    devices = list(devices)
+    lock = threading.Lock()
+
+    def report(device, fraction, line):
+        # Serialise callbacks so GUIs can keep a simple per-disk table
+        with lock:
+            progress(device, fraction, line)
+
+    def run(device):
+        try:
+            return install(device, script, update, report if progress else None)
+        except Exception as e:
+            return InstallResult(device, False, None, str(e))
+
+    if not devices:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(max_parallel, len(devices)))) as pool:
+        return list(pool.map(run, devices))
@@ -0,0 +1,136 @@
+"""Read-back verification that checks the stick, not the page cache.
+
+Data is hashed while it is written (DigestRecorder), so the published
+checksums can be compared without another pass. verify_file() then drops the
+file's cached pages (or opens it O_DIRECT) and re-reads it from the device
+through hashing.feed_file(), either fully or for a random sample of blocks.
+"""
+import hashlib
+import math
+import mmap
+import os
+import random
+from collections import namedtuple
+
+from altima_usb_installer import hashing
+
+BLOCK_SIZE = 4 * 1024 * 1024
+BLOCK_ALGORITHM = "blake2b"
+
+VerifyResult = namedtuple("VerifyResult", "ok bytes_checked bad_blocks")
+
+
+def algorithm_for_digest(hexdigest):
+    """Guess the algorithm of a published checksum from its length."""
+    return {32: "md5", 40: "sha1", 64: "sha256", 128: "sha512"}.get(len(hexdigest.strip()))
+
+
+def _block_hash():
+    return hashlib.new(BLOCK_ALGORITHM, digest_size=16)
+
+
+class DigestRecorder:
+    """Hash a stream as it is written: whole-file digests plus one per block.
+
+    algorithm may name several algorithms (e.g. ("md5", "sha256")); all of
+    them are computed from the same pass over the data.
+    """
+
+    def __init__(self, algorithm="sha256", block_size=BLOCK_SIZE):
+        self.algorithms = (algorithm,) if isinstance(algorithm, str) else tuple(algorithm)
+        self.algorithm = self.algorithms[0]
+        self.block_size = block_size
+        self.size = 0
+        self.block_digests = []
+        self._full = hashing.MultiHasher(self.algorithms)
+        self._block = _block_hash()
+        self._block_fill = 0
+
+    def update(self, data):
+        view = memoryview(data)
+        self._full.update(view)
+        self.size += len(view)
+        while view:
+            take = min(len(view), self.block_size - self._block_fill)
+            self._block.update(view[:take])
+            self._block_fill += take
+            view = view[take:]
+            if self._block_fill == self.block_size:
+                self.block_digests.append(self._block.digest())
+                self._block = _block_hash()
+                self._block_fill = 0
+
+    def finish(self):
+        if self._block_fill:
+            self.block_digests.append(self._block.digest())
+            self._block = _block_hash()
+            self._block_fill = 0
+        return self
+
+    def hexdigest(self, algorithm=None):
+        return self._full.hexdigest(algorithm or self.algorithm)
+
+    def matches(self, expected):
+        """True if every {algorithm: hexdigest} in expected that was computed agrees."""
+        return all(self.hexdigest(a) == d.lower() for a, d in expected.items() if a in self.algorithms)
+
+
+def record_file(path, algorithm="sha256", block_size=BLOCK_SIZE, direct=False, progress=None):
+    """Hash a file from the device (not the page cache) into a fresh DigestRecorder."""
+    recorder = DigestRecorder(algorithm, block_size)
+    hashing.feed_file(path, [recorder], buffer_size=block_size, uncached=True, direct=direct,
+                      progress=progress)
+    return recorder.finish()
+
+
+def verify_file(path, recorder, sample=1.0, direct=False, progress=None):
+    """Re-read path from the device and compare it with what was written.
+
+    With sample=1.0 the whole file is read sequentially and compared with
+    the recorder's full digest. A smaller fraction checks that share of
+    blocks (always including the last) against the per-block digests.
+    progress is called as progress(bytes_checked, bytes_to_check).
+    """
+    block_size = recorder.block_size
+    size = os.path.getsize(path)
+    if size != recorder.size:
+        return VerifyResult(False, 0, [])
+
+    if sample >= 1.0:
+        # One sequential pass yields both the full digest and every block digest
+        readback = record_file(path, recorder.algorithm, block_size, direct, progress)
+        bad = [i for i, (a, b) in enumerate(zip(readback.block_digests, recorder.block_digests))
+               if a != b]
+        ok = not bad and readback.hexdigest() == recorder.hexdigest()
+        return VerifyResult(ok, readback.size, bad)
+
+    blocks = len(recorder.block_digests)
+    if not blocks:
+        return VerifyResult(True, 0, [])
+    count = max(1, math.ceil(blocks * sample))
+    indices = sorted(set(random.sample(range(blocks), min(count, blocks))) | {blocks - 1})
+    to_check = sum(min(block_size, size - i * block_size) for i in indices)
+
+    fd, direct = hashing.open_uncached(path, direct)
+    buf = mmap.mmap(-1, block_size)
+    bad = []
+    checked = 0
+    try:
+        for index in indices:
+            n = hashing.read_block(fd, buf, index * block_size, direct)
+            view = memoryview(buf)[:n]
+            block = _block_hash()
+            block.update(view)
+            view.release()
+            if block.digest() != recorder.block_digests[index]:
+                bad.append(index)
+            checked += n
+            if progress:
+                progress(checked, to_check)
+        if not direct and hasattr(os, "posix_fadvise"):
+            # Leave the page cache as we found it
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+        buf.close()
+    return VerifyResult(not bad, checked, bad)